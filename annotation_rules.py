@@ -0,0 +1,177 @@
+"""
+Annotation Rules: Kiểm tra nhanh (không cần GPT) các review note dạng "máy móc" của mode 2.
+
+Các pattern hỗ trợ (tiếng Pháp):
+- Thay thế: "remplacer X par Y", "changer/modifier/corriger X en|par Y",
+  "remplacer/changer/modifier/corriger X → Y" (hoặc ->, =>), "mettre Y au lieu de X"
+- Xóa:      "supprimer X", "enlever X", "retirer X"
+- Thêm:     "ajouter X", "rajouter X"
+
+Note phải BẮT ĐẦU bằng động từ chỉ thị, X / Y ngắn (≤ MAX_VALUE_CHARS ký tự,
+≤ MAX_VALUE_WORDS từ): câu văn thường ("Merci de mettre la photo ... au lieu de ...")
+không bao giờ bị coi là rule.
+Chỉ trả về verdict khi text quanh annotation cho câu trả lời rõ ràng, và text cũ (X) có
+trong vùng quanh annotation ở Ref (ngược lại note không nói về text: "supprimer le logo");
+trường hợp mơ hồ trả về None để gửi cho GPT.
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Dict, Optional, Tuple
+
+RULE_CONFIDENCE = 0.95
+MAX_VALUE_CHARS = 60
+MAX_VALUE_WORDS = 5
+
+_QUOTES = "\"'«»“”‘’`´"
+_Q = f"[\\s:{_QUOTES}]*"
+_VALUE = rf"(.{{1,{MAX_VALUE_CHARS}}}?)"
+_REPLACE_VERB = r"(?:remplacer|remplace|changer|modifier|corriger)"
+
+_REPLACE_PATTERNS = [
+    # remplacer X par Y
+    re.compile(rf"^(?:remplacer|remplace)\b{_Q}{_VALUE}{_Q}\s+par{_Q}{_VALUE}{_Q}[.!]?$", re.IGNORECASE),
+    # changer / modifier / corriger X en|par Y
+    re.compile(rf"^(?:changer|modifier|corriger)\b{_Q}{_VALUE}{_Q}\s+(?:en|par){_Q}{_VALUE}{_Q}[.!]?$", re.IGNORECASE),
+    # remplacer / changer / modifier / corriger X → Y (hoặc ->, =>)
+    re.compile(rf"^{_REPLACE_VERB}\b{_Q}{_VALUE}{_Q}\s*(?:→|->|=>){_Q}{_VALUE}{_Q}[.!]?$", re.IGNORECASE),
+]
+# mettre Y au lieu de X (giá trị mới đứng trước)
+_INSTEAD_PATTERN = re.compile(
+    rf"^mettre\b{_Q}{_VALUE}{_Q}\s+au lieu de{_Q}{_VALUE}{_Q}[.!]?$", re.IGNORECASE
+)
+_DELETE_PATTERN = re.compile(rf"^(?:supprimer|enlever|retirer)\b{_Q}{_VALUE}{_Q}[.!]?$", re.IGNORECASE)
+_ADD_PATTERN = re.compile(rf"^(?:ajouter|rajouter)\b{_Q}{_VALUE}{_Q}[.!]?$", re.IGNORECASE)
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    """NFKC, lowercase, bỏ quotes, tách "€", gộp khoảng trắng (kể cả NBSP trong giá)."""
+    text = unicodedata.normalize("NFKC", text).lower().replace("€", " € ")
+    for q in _QUOTES:
+        text = text.replace(q, " ")
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _contains(haystack: str, needle: str) -> bool:
+    """needle xuất hiện như 1 cụm từ nguyên vẹn (không nằm trong từ/số khác)."""
+    if not needle:
+        return False
+    return re.search(rf"(?<!\w){re.escape(needle)}(?!\w)", haystack) is not None
+
+
+def _short_values(*values: str) -> bool:
+    return all(len(value.split()) <= MAX_VALUE_WORDS for value in values)
+
+
+def parse_instruction(annotation_content: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Phân tích review note. Trả về (kind, old, new) với kind in {"replace", "delete", "add"},
+    hoặc None nếu không khớp pattern nào (hoặc giá trị quá dài để là 1 đoạn text cụ thể).
+    """
+    text = _SPACE_RE.sub(" ", annotation_content).strip()
+
+    parsed = None
+    for pattern in _REPLACE_PATTERNS:
+        m = pattern.match(text)
+        if m:
+            parsed = "replace", _normalize(m.group(1)), _normalize(m.group(2))
+            break
+
+    if parsed is None:
+        m = _INSTEAD_PATTERN.match(text)
+        if m:
+            parsed = "replace", _normalize(m.group(2)), _normalize(m.group(1))
+
+    if parsed is None:
+        m = _DELETE_PATTERN.match(text)
+        if m:
+            parsed = "delete", _normalize(m.group(1)), ""
+
+    if parsed is None:
+        m = _ADD_PATTERN.match(text)
+        if m:
+            parsed = "add", "", _normalize(m.group(1))
+
+    if parsed is None or not _short_values(parsed[1], parsed[2]):
+        return None
+    return parsed
+
+
+def _verdict(status: str, reasoning: str, evidence: str, rule: str) -> Dict:
+    return {
+        "implemented": status == "implemented",
+        "confidence": RULE_CONFIDENCE,
+        "reasoning": reasoning,
+        "evidence": evidence,
+        "status": status,
+        "source": "rule",
+        "rule": rule,
+    }
+
+
+def precheck_annotation(
+    annotation_content: str,
+    current_text: str,
+    context_text: str,
+    ref_text: Optional[str] = None,
+) -> Optional[Dict]:
+    """
+    Kiểm tra review note bằng rule. Trả về verdict (cùng format check_annotation_with_gpt)
+    khi kết quả rõ ràng, None nếu cần hỏi GPT.
+    ref_text: text quanh annotation ở Ref. Bắt buộc: chỉ kết luận khi text cũ có trong ref_text
+    (replace / delete), hoặc text cần thêm CHƯA có trong ref_text (add).
+    """
+    if ref_text is None:
+        return None
+    parsed = parse_instruction(annotation_content)
+    if parsed is None:
+        return None
+
+    kind, old, new = parsed
+    ref = _normalize(ref_text)
+    if kind in ("replace", "delete") and not _contains(ref, old):
+        return None
+    if kind == "add" and _contains(ref, new):
+        return None
+    current = _normalize(current_text)
+    context = _normalize(context_text)
+
+    if kind == "replace":
+        if not old or not new or old == new:
+            return None
+        # old là 1 phần của new (VD: "12" → "125") hoặc ngược lại → để GPT xử lý
+        if _contains(new, old) or _contains(old, new):
+            return None
+        new_here = _contains(current, new)
+        old_here = _contains(current, old)
+        if new_here and not old_here:
+            return _verdict("implemented", f"'{new}' présent, '{old}' absent", new, "replace")
+        if old_here and not new_here:
+            return _verdict("not_implemented", f"'{old}' toujours présent, '{new}' absent", old, "replace")
+        return None
+
+    if kind == "delete":
+        if _contains(current, old):
+            return _verdict("not_implemented", f"'{old}' toujours présent", old, "delete")
+        if not _contains(context, old):
+            return _verdict("implemented", f"'{old}' absent", "", "delete")
+        return None
+
+    if kind == "add":
+        if _contains(current, new):
+            return _verdict("implemented", f"'{new}' présent", new, "add")
+        if not _contains(context, new):
+            return _verdict("not_implemented", f"'{new}' absent", "", "add")
+        return None
+
+    return None
+
+
+__all__ = [
+    "parse_instruction",
+    "precheck_annotation",
+]
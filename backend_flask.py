@@ -293,6 +293,8 @@ def compare_mode3_endpoint():
             result["output_ref"] = os.path.basename(result["output_ref"])
         if "output_final" in result:
             result["output_final"] = os.path.basename(result["output_final"])
+        if "changes_json" in result:
+            result["changes_json"] = os.path.basename(result["changes_json"])
         
         # Tự động schedule cleanup sau 30 giây (fallback nếu JavaScript không chạy)
         import time
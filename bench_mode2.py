@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark mode 2 offline: chạy compare_mode2 qua stub/replay server (không gọi API thật)
+với nhiều cấu hình concurrency × batch, báo cáo annotations/giây và latency end-to-end.
+
+- Có --recordings (ghi bởi MODE2_LLM_RECORD): phát lại response thật, latency = đã ghi × --latency-scale
+- Không có: llm_stub.py với latency cố định + jitter
+
+Chạy: python bench_mode2.py ref.pdf final.pdf --recordings rec.jsonl --concurrency 1,4,8 --batch off,on
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from llm_replay import start_replay_server
+from llm_stub import start_stub_server
+
+
+def _parse_list(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def run_benchmark(
+    ref_pdf_path: str,
+    final_pdf_path: str,
+    concurrency_levels: List[int],
+    batch_modes: List[bool],
+    repeat: int = 1,
+) -> List[Dict]:
+    """
+    Chạy compare_mode2 cho từng cấu hình (cache tắt để mọi annotation đều gọi LLM).
+    OPENAI_BASE_URL phải trỏ tới stub/replay server trước khi gọi.
+    """
+    import mode2  # import sau khi set env để get_openai_client đọc đúng base_url
+
+    rows: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "bench_mode2.pdf")
+        for batch in batch_modes:
+            for concurrency in concurrency_levels:
+                for run in range(repeat):
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = mode2.compare_mode2(
+                            ref_pdf_path,
+                            final_pdf_path,
+                            output_path=output_path,
+                            api_key=os.getenv("OPENAI_API_KEY") or "bench",
+                            max_concurrency=concurrency,
+                            requests_per_second=0,
+                            use_cache=False,
+                            batch=batch,
+                        )
+                    elapsed = time.perf_counter() - start
+
+                    summary = result["summary"]
+                    fast = summary["tiers"].get("fast", {})
+                    total = summary["total_annotations"]
+                    rows.append({
+                        "batch": batch,
+                        "concurrency": concurrency,
+                        "run": run,
+                        "annotations": total,
+                        "llm_calls": sum(t["calls"] for t in summary["tiers"].values()),
+                        "elapsed": elapsed,
+                        "annotations_per_sec": total / elapsed if elapsed > 0 else 0.0,
+                        "call_p50": fast.get("latency_p50", 0.0),
+                        "call_p95": fast.get("latency_p95", 0.0),
+                    })
+    return rows
+
+
+def print_report(rows: List[Dict]) -> None:
+    print(f"{'batch':>5} {'conc':>4} {'annots':>6} {'calls':>5} {'total(s)':>9} {'annot/s':>8} {'p50(s)':>7} {'p95(s)':>7}")
+    for row in rows:
+        print(
+            f"{'on' if row['batch'] else 'off':>5} {row['concurrency']:>4} {row['annotations']:>6} "
+            f"{row['llm_calls']:>5} {row['elapsed']:>9.2f} {row['annotations_per_sec']:>8.2f} "
+            f"{row['call_p50']:>7.3f} {row['call_p95']:>7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline mode 2 throughput benchmark")
+    parser.add_argument("ref_pdf")
+    parser.add_argument("final_pdf")
+    parser.add_argument("--recordings", help="File JSONL ghi bởi MODE2_LLM_RECORD (mặc định: stub)")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.5, help="Latency của stub (không có --recordings)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--concurrency", default="1,4,8")
+    parser.add_argument("--batch", default="off,on")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.recordings:
+        server, base_url = start_replay_server(args.recordings, latency_scale=args.latency_scale)
+    else:
+        server, base_url = start_stub_server(latency=args.latency, jitter=args.jitter)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.pop("MODE2_LLM_RECORD", None)
+
+    rows = run_benchmark(
+        args.ref_pdf,
+        args.final_pdf,
+        concurrency_levels=[int(c) for c in _parse_list(args.concurrency)],
+        batch_modes=[b in ("on", "1", "true") for b in _parse_list(args.batch)],
+        repeat=args.repeat,
+    )
+    print_report(rows)
+    if args.recordings:
+        print(f"ℹ️ Replay: {server.hits} hits, {server.misses} misses")
+    server.shutdown()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Benchmark mode 3 (offline, không cần server):
+
+- normalize: so sánh _normalize_word hiện tại với bản cũ (golden reference bên dưới):
+  output phải giống hệt trên corpus (words từ các PDF truyền vào + ký tự Unicode + chuỗi ngẫu nhiên),
+  báo cáo words/giây trước và sau (cache nguội và cache nóng)
+- diff: so sánh diff engine "difflib", "patience" và "hierarchical" (token_diff.py) trên dãy token tổng hợp
+  (5k+ words, nhiều token lặp lại như giá, "0,00", đơn vị): thời gian + số token khớp;
+  có cặp PDF → so sánh highlight của 2 engine trên từng trang
+
+Chạy: python bench_mode3.py normalize a.pdf b.pdf
+      python bench_mode3.py diff --pairs ref.pdf:final.pdf
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+from typing import Callable, List, Tuple
+
+import fitz  # PyMuPDF
+
+import mode3
+from token_diff import diff_opcodes, hierarchical_opcodes
+
+
+def legacy_normalize_word(word: str) -> str:
+    """Bản _normalize_word cũ (trước khi dùng translate table), giữ nguyên làm golden reference."""
+    import unicodedata
+    
+    if mode3.CASE_INSENSITIVE:
+        word = word.lower()
+    
+    if mode3.IGNORE_QUOTES:
+        # XÓA quotes/apostrophes TRƯỚC normalize để tránh tạo combining chars
+        pre_normalize_chars = ["'", "'", "'", "`", "´"]
+        for char in pre_normalize_chars:
+            word = word.replace(char, "")
+        
+        # SAU ĐÓ mới normalize Unicode
+        word = unicodedata.normalize('NFKC', word)
+        # XÓA HẾT TẤT CẢ các loại apostrophe, quotes, accents
+        # Không replace về ' mà XÓA LUÔN để: d'emploi → demploi
+        chars_to_remove = [
+            "'",  # Normal apostrophe
+            "'",  # U+2019 Right single quotation mark
+            "'",  # U+2018 Left single quotation mark  
+            "ʼ",  # U+02BC Modifier letter apostrophe
+            "`",  # U+0060 Grave accent / Backtick
+            "´",  # U+00B4 Acute accent
+            "ˊ",  # U+02CA Modifier letter acute accent
+            "ˋ",  # U+02CB Modifier letter grave accent
+            "ʹ",  # U+02B9 Modifier letter prime
+            "′",  # U+2032 Prime
+            "‵",  # U+2035 Reversed prime
+            "＇", # U+FF07 Fullwidth apostrophe
+            "՚",  # U+055A Armenian apostrophe
+            "Ꞌ",  # U+A78B Latin capital letter saltillo
+            "ꞌ",  # U+A78C Latin small letter saltillo
+            "ʻ",  # U+02BB Modifier letter turned comma
+            "ʽ",  # U+02BD Modifier letter reversed comma
+            "\u0301",  # Combining acute accent
+            "\u0300",  # Combining grave accent
+            '"',  # Normal double quote
+            """,  # U+201C Left double quotation mark
+            """,  # U+201D Right double quotation mark
+            "«",  # Left-pointing double angle quotation mark
+            "»",  # Right-pointing double angle quotation mark
+            "„",  # Double low-9 quotation mark
+            "‟",  # Double high-reversed-9 quotation mark
+            "〝", # U+301D Reversed double prime quotation mark
+            "〞", # U+301E Double prime quotation mark
+            "＂", # U+FF02 Fullwidth quotation mark
+        ]
+        
+        # XÓA tất cả
+        for char in chars_to_remove:
+            word = word.replace(char, "")
+        
+        # NORMALIZE SUPERSCRIPT/SUBSCRIPT về dạng thường
+        # VD: "PLUS⁽¹⁾" → "PLUS(1)"
+        superscript_map = {
+            '⁰': '0', '¹': '1', '²': '2', '³': '3', '⁴': '4',
+            '⁵': '5', '⁶': '6', '⁷': '7', '⁸': '8', '⁹': '9',
+            '⁽': '(', '⁾': ')', '⁺': '+', '⁻': '-', '⁼': '=',
+        }
+        subscript_map = {
+            '₀': '0', '₁': '1', '₂': '2', '₃': '3', '₄': '4',
+            '₅': '5', '₆': '6', '₇': '7', '₈': '8', '₉': '9',
+            '₍': '(', '₎': ')', '₊': '+', '₋': '-', '₌': '=',
+        }
+        
+        for sup, normal in superscript_map.items():
+            word = word.replace(sup, normal)
+        for sub, normal in subscript_map.items():
+            word = word.replace(sub, normal)
+        
+        # XÓA HOÀN TOÀN patterns (số nhỏ) - VD: (1), (2), (12) để ignore trong comparison
+        # Nhưng GIỮ numbers lớn như 32859, 61545
+        # Dùng regex để tìm và xóa: (1-2 chữ số)
+        import re
+        word = re.sub(r'\([0-9]{1,2}\)', '', word)  # Xóa (1), (2), (12), etc.
+        word = re.sub(r'\[[0-9]{1,2}\]', '', word)  # Xóa [1], [2], etc.
+        word = re.sub(r'\{[0-9]{1,2}\}', '', word)  # Xóa {1}, {2}, etc.
+        
+        # XÓA TẤT CẢ PUNCTUATION còn lại (dấu chấm, dấu phẩy, v.v...)
+        # Category 'P' = Punctuation: . , ; : ! ? - ...
+        word = ''.join(c for c in word if not unicodedata.category(c).startswith('P'))
+        
+        # Remove zero-width characters
+        word = word.replace("\u200b", "")  # Zero-width space
+        word = word.replace("\u200c", "")  # Zero-width non-joiner
+        word = word.replace("\u200d", "")  # Zero-width joiner
+        word = word.replace("\ufeff", "")  # Zero-width no-break space
+        
+        # Remove bất kỳ combining marks còn lại
+        word = ''.join(c for c in word if unicodedata.category(c) != 'Mn')
+        
+        # XÓA HẾT SPACES
+        # VD: "PLUS(1)" → "PLUS 1" → "PLUS1"
+        #     "PLUS⁽¹⁾" → "PLUS(1)" → "PLUS 1" → "PLUS1"
+        word = word.replace(' ', '').strip()
+    
+    return word
+
+
+def _pdf_words(pdf_paths: List[str]) -> List[str]:
+    words: List[str] = []
+    for pdf_path in pdf_paths:
+        doc = fitz.open(pdf_path)
+        for page in doc:
+            words.extend(w[4] for w in page.get_text("words"))
+        doc.close()
+    return words
+
+
+def golden_corpus(pdf_paths: List[str], random_samples: int = 100_000, seed: int = 0) -> List[str]:
+    """Words từ PDF + từng code point Unicode + chuỗi ngẫu nhiên từ các khối ký tự "khó"."""
+    corpus = _pdf_words(pdf_paths)
+    corpus.extend(chr(cp) for cp in range(sys.maxunicode + 1) if not 0xD800 <= cp < 0xE000)
+
+    pool = [chr(cp) for cp in range(0x20, 0x250)]           # Latin
+    pool += [chr(cp) for cp in range(0x300, 0x370)]         # Combining marks
+    pool += [chr(cp) for cp in range(0x2000, 0x2100)]       # Punctuation, super/subscripts
+    pool += list("＇＂〝〞՚Ꞌꞌ\u200b\ufeff()[]{}0123456789")
+    rng = random.Random(seed)
+    corpus.extend(
+        "".join(rng.choice(pool) for _ in range(rng.randint(1, 12)))
+        for _ in range(random_samples)
+    )
+    return corpus
+
+
+def _words_per_second(func: Callable[[str], str], words: List[str]) -> float:
+    start = time.perf_counter()
+    for word in words:
+        func(word)
+    elapsed = time.perf_counter() - start
+    return len(words) / elapsed if elapsed > 0 else float("inf")
+
+
+def bench_normalize(pdf_paths: List[str], repeat: int = 3) -> int:
+    corpus = golden_corpus(pdf_paths)
+    mode3._normalize_word_cached.cache_clear()
+    mismatches = [w for w in corpus if legacy_normalize_word(w) != mode3._normalize_word(w)]
+    print(f"Golden corpus: {len(corpus)} mots, {len(mismatches)} différences")
+    for word in mismatches[:10]:
+        print(f"  {word!r}: {legacy_normalize_word(word)!r} != {mode3._normalize_word(word)!r}")
+
+    # Workload thực tế: words của PDF (nhiều token lặp lại), không có PDF thì dùng corpus
+    words = _pdf_words(pdf_paths) or corpus[:200_000]
+    words = (words * max(1, 200_000 // max(1, len(words))))[:200_000]
+
+    legacy = max(_words_per_second(legacy_normalize_word, words) for _ in range(repeat))
+    mode3._normalize_word_cached.cache_clear()
+    cold = _words_per_second(mode3._normalize_word, words)
+    warm = max(_words_per_second(mode3._normalize_word, words) for _ in range(repeat))
+    uncached_normalize = mode3._normalize_word_cached.__wrapped__
+
+    def _uncached(word: str) -> str:
+        return uncached_normalize(word, mode3.CASE_INSENSITIVE, mode3.IGNORE_QUOTES)
+
+    uncached = max(_words_per_second(_uncached, words) for _ in range(repeat))
+
+    print(f"{'version':<22} {'mots/s':>12}")
+    print(f"{'avant':<22} {legacy:>12,.0f}")
+    print(f"{'après (sans memo)':<22} {uncached:>12,.0f}")
+    print(f"{'après (cache froid)':<22} {cold:>12,.0f}")
+    print(f"{'après (cache chaud)':<22} {warm:>12,.0f}")
+    return 1 if mismatches else 0
+
+
+SYNTHETIC_LINE_WORDS = 10
+SYNTHETIC_BLOCK_LINES = 5
+
+
+def _synthetic_tokens(
+    rng: random.Random, size: int, vocab: int, edit_rate: float
+) -> Tuple[List[int], List[Tuple], List[int], List[Tuple]]:
+    """
+    Dãy token của 1 trang (vocab nhỏ = nhiều token lặp lại) và bản đã sửa với edit_rate,
+    kèm path (block, line) của từng token (token thêm vào thuộc dòng của token đứng trước).
+    """
+    ref = [rng.randrange(vocab) for _ in range(size)]
+    ref_path = [
+        (i // (SYNTHETIC_LINE_WORDS * SYNTHETIC_BLOCK_LINES), i // SYNTHETIC_LINE_WORDS % SYNTHETIC_BLOCK_LINES)
+        for i in range(size)
+    ]
+    final: List[int] = []
+    final_path: List[Tuple] = []
+    for token, path in zip(ref, ref_path):
+        r = rng.random()
+        if r < edit_rate / 3:
+            continue                                    # xóa
+        if r < 2 * edit_rate / 3:
+            final.extend((token, rng.randrange(vocab)))  # thêm
+            final_path.extend((path, path))
+        elif r < edit_rate:
+            final.append(vocab + rng.randrange(1000))    # thay bằng token mới
+            final_path.append(path)
+        else:
+            final.append(token)
+            final_path.append(path)
+    return ref, ref_path, final, final_path
+
+
+def _opcodes(engine: str, a: List[int], a_path: List[Tuple], b: List[int], b_path: List[Tuple]):
+    if engine == "difflib":
+        return SequenceMatcher(None, a, b).get_opcodes()
+    if engine == "hierarchical":
+        return hierarchical_opcodes(a, a_path, b, b_path)
+    return diff_opcodes(a, b)
+
+
+def _highlights(ref_pdf: str, final_pdf: str, engine: str) -> List[Tuple[set, set]]:
+    """(index words highlight ở Ref, ở Final) cho từng trang với engine đã chọn."""
+    mode3.DIFF_ENGINE = engine
+    ref_doc, final_doc = fitz.open(ref_pdf), fitz.open(final_pdf)
+    pages = []
+    for page_index in range(min(ref_doc.page_count, final_doc.page_count)):
+        tokens = mode3.TokenTable()
+        ref_words = [
+            mode3.make_word(w[4], fitz.Rect(w[:4]), tokens, w[5], w[6])
+            for w in ref_doc[page_index].get_text("words")
+        ]
+        final_words = [
+            mode3.make_word(w[4], fitz.Rect(w[:4]), tokens, w[5], w[6])
+            for w in final_doc[page_index].get_text("words")
+        ]
+        mode3.align_words_assemblage(ref_words, final_words, tokens)
+        pages.append((
+            {i for i, w in enumerate(ref_words) if w.get("highlight_color")},
+            {i for i, w in enumerate(final_words) if w.get("highlight_color")},
+        ))
+    ref_doc.close()
+    final_doc.close()
+    return pages
+
+
+DIFF_ENGINES = ("difflib", "patience", "hierarchical")
+
+
+def bench_diff(pairs: List[str], seed: int = 0) -> int:
+    rng = random.Random(seed)
+    print(f"{'words':>6} {'vocab':>6} {'edits':>6} | " + " | ".join(f"{e + '(s)':>16} {'matched':>8}" for e in DIFF_ENGINES))
+    for size, vocab, edit_rate in [
+        (5_000, 30, 0.01), (5_000, 30, 0.05), (5_000, 5_000, 0.02),
+        (20_000, 50, 0.01), (50_000, 200, 0.01),
+    ]:
+        ref, ref_path, final, final_path = _synthetic_tokens(rng, size, vocab, edit_rate)
+        cells = []
+        for engine in DIFF_ENGINES:
+            start = time.perf_counter()
+            opcodes = _opcodes(engine, ref, ref_path, final, final_path)
+            elapsed = time.perf_counter() - start
+            cells.append(f"{elapsed:>16.3f} {sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal'):>8}")
+        print(f"{size:>6} {vocab:>6} {edit_rate:>6.0%} | " + " | ".join(cells))
+
+    engine = mode3.DIFF_ENGINE
+    try:
+        for pair in pairs:
+            ref_pdf, final_pdf = pair.split(":", 1)
+            old = _highlights(ref_pdf, final_pdf, "difflib")
+            for new_engine in DIFF_ENGINES[1:]:
+                new = _highlights(ref_pdf, final_pdf, new_engine)
+                same = sum(1 for a, b in zip(old, new) if a == b)
+                only_old = sum(len(a[0] - b[0]) + len(a[1] - b[1]) for a, b in zip(old, new))
+                only_new = sum(len(b[0] - a[0]) + len(b[1] - a[1]) for a, b in zip(old, new))
+                print(
+                    f"{pair} [{new_engine}]: {same}/{len(old)} pages identiques, "
+                    f"{only_old} highlights difflib seul, {only_new} {new_engine} seul"
+                )
+    finally:
+        mode3.DIFF_ENGINE = engine
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline mode 3 benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    normalize_parser = subparsers.add_parser("normalize", help="Golden check + words/s de _normalize_word")
+    normalize_parser.add_argument("pdfs", nargs="*")
+    normalize_parser.add_argument("--repeat", type=int, default=3)
+
+    diff_parser = subparsers.add_parser("diff", help="difflib vs patience vs hierarchical (token_diff.py)")
+    diff_parser.add_argument("--pairs", nargs="*", default=[], help="ref.pdf:final.pdf")
+
+    args = parser.parse_args()
+    if args.command == "normalize":
+        sys.exit(bench_normalize(args.pdfs, args.repeat))
+    if args.command == "diff":
+        sys.exit(bench_diff(args.pairs))
@@ -0,0 +1,91 @@
+"""
+Fuzzy Match: So khớp gần đúng 2 token với số lỗi giới hạn (Levenshtein ≤ k), dùng cho
+words khác nhau 1-2 glyph do OCR, ligature hoặc soft hyphen.
+
+- Lọc trước O(n): chênh lệch độ dài ≤ k, rồi q-gram lemma (2 chuỗi cách nhau ≤ k lỗi có
+  ít nhất max(|a|, |b|) - q + 1 - k·q q-gram chung)
+- Khoảng cách: thuật toán bit-parallel Myers / Hyyrö, 1 cột DP = vài phép toán trên int
+  (int Python không giới hạn số bit → không giới hạn độ dài pattern), dừng sớm khi chắc chắn > k
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from typing import Dict, Optional
+
+FUZZY_QGRAM = 2
+
+
+def _peq(pattern: str) -> Dict[str, int]:
+    """Bitmask vị trí của từng ký tự trong pattern (bit i = pattern[i])."""
+    masks: Dict[str, int] = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
+
+def qgram_filter(a: str, b: str, max_distance: int, q: int = FUZZY_QGRAM) -> bool:
+    """False nếu a và b chắc chắn cách nhau > max_distance lỗi (q-gram lemma)."""
+    needed = max(len(a), len(b)) - q + 1 - max_distance * q
+    if needed <= 0:
+        return True
+    a_grams = Counter(a[i:i + q] for i in range(len(a) - q + 1))
+    b_grams = Counter(b[i:i + q] for i in range(len(b) - q + 1))
+    return sum((a_grams & b_grams).values()) >= needed
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> Optional[int]:
+    """
+    Khoảng cách Levenshtein giữa a và b nếu ≤ max_distance, ngược lại None.
+    Bit-parallel (Myers 1999, công thức của Hyyrö): pattern a, duyệt từng ký tự của b.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if not a or not b:
+        distance = max(len(a), len(b))
+        return distance if distance <= max_distance else None
+
+    m = len(a)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    peq = _peq(a)
+    pv, mv = full, 0
+    score = m
+    remaining = len(b)
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # Hàng 0 của DP tăng 1 mỗi cột (khoảng cách toàn cục, không phải tìm kiếm)
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv
+        remaining -= 1
+        # Mỗi cột còn lại giảm score tối đa 1
+        if score - remaining > max_distance:
+            return None
+    return score if score <= max_distance else None
+
+
+def fuzzy_equal(a: str, b: str, max_distance: int) -> bool:
+    """a và b cách nhau 1..max_distance lỗi (lọc độ dài + q-gram trước khi tính)."""
+    if a == b or abs(len(a) - len(b)) > max_distance:
+        return False
+    if not qgram_filter(a, b, max_distance):
+        return False
+    return bounded_levenshtein(a, b, max_distance) is not None
+
+
+__all__ = [
+    "bounded_levenshtein",
+    "fuzzy_equal",
+    "qgram_filter",
+    "FUZZY_QGRAM",
+]
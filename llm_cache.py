@@ -0,0 +1,118 @@
+"""
+LLM Cache: Cache verdict GPT của mode 2 trong SQLite + gộp request trùng đang chạy.
+
+Key = model + version prompt template + nội dung annotation + hash context text.
+- Chạy lại mode 2 trên cùng tài liệu → trả về từ SQLite (0 latency, 0 token)
+- Cùng 1 key được hỏi đồng thời (review note lặp lại) → chỉ 1 request thật,
+  các caller khác chờ chung kết quả (in-flight coalescing)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+MODE2_CACHE_PATH = Path(
+    os.getenv("MODE2_CACHE_PATH", str(Path(tempfile.gettempdir()) / "compare_batiment_mode2_cache.sqlite"))
+)
+
+
+def verdict_cache_key(model: str, prompt_version: str, annotation_content: str, *context_parts: str) -> str:
+    """Tạo cache key từ model, version prompt, annotation và hash của context."""
+    context_hash = hashlib.sha256("\x1f".join(context_parts).encode("utf-8")).hexdigest()
+    raw = json.dumps([model, prompt_version, annotation_content, context_hash], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """
+    Cache verdict (dict JSON) trong SQLite, thread-safe.
+    get_or_compute() gộp các request cùng key đang chạy.
+    """
+
+    def __init__(self, path: Path | str = MODE2_CACHE_PATH):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.stats = {"hits": 0, "coalesced": 0, "misses": 0}
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM verdicts WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, value: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Dict],
+        cacheable: Callable[[Dict], bool] = lambda value: True,
+    ) -> Dict:
+        """
+        Trả về verdict từ cache, hoặc chờ request cùng key đang chạy,
+        hoặc gọi compute() (chỉ lưu vào SQLite nếu cacheable(value)).
+        """
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not owner:
+            return dict(future.result())
+
+        try:
+            value = compute()
+            if cacheable(value):
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+__all__ = [
+    "VerdictCache",
+    "verdict_cache_key",
+    "MODE2_CACHE_PATH",
+]
@@ -0,0 +1,282 @@
+"""
+LLM Dispatch: Gọi OpenAI chat completions song song cho mode 2.
+
+- ThreadPoolExecutor với số request đồng thời (in-flight) giới hạn
+- Token bucket để không vượt quá requests/giây
+- Exponential backoff (tôn trọng Retry-After) khi gặp 429 / lỗi tạm thời
+- Deadline cho từng call + hedged request (gửi bản sao khi call chậm hơn p95 đã quan sát)
+- Kết quả trả về ĐÚNG thứ tự input
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, TypeVar
+
+try:
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+except ImportError:
+    RateLimitError = None
+    RETRYABLE_ERRORS = ()
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Cấu hình mặc định (đọc từ env)
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("MODE2_MAX_CONCURRENCY", "8"))
+DEFAULT_REQUESTS_PER_SECOND = float(os.getenv("MODE2_REQUESTS_PER_SECOND", "5"))
+DEFAULT_MAX_RETRIES = int(os.getenv("MODE2_MAX_RETRIES", "5"))
+DEFAULT_CALL_TIMEOUT = float(os.getenv("MODE2_CALL_TIMEOUT", "60"))
+BACKOFF_BASE = 0.5   # giây
+BACKOFF_MAX = 30.0   # giây
+
+# Hedging: chỉ bật khi đã có đủ mẫu latency để ước lượng p95
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = int(os.getenv("MODE2_HEDGE_MIN_SAMPLES", "10"))
+HEDGE_MAX_WORKERS = 32
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """Call LLM không hoàn thành trước deadline."""
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+        return _hedge_executor
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Percentile theo nearest-rank (values không cần sort sẵn)."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # Nearest-rank: rank = ceil(q/100 · n) (1-based); q · n trước khi chia để tránh 0.15 · 20 = 3.0000000000000004
+    rank = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered) / 100) - 1))
+    return ordered[rank]
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe: `rate` tokens/giây, tối đa `capacity` tokens (burst).
+    acquire() block cho đến khi có token.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CallStats:
+    """
+    Thống kê các lần gọi LLM theo tier (thread-safe): số call, latency, token, hedge.
+    p95 latency của tier cũng là ngưỡng hedging (hedge_delay) → tự điều chỉnh theo run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers: Dict[str, Dict] = {}
+
+    def record(self, tier: str, model: str, latency: float, usage=None) -> None:
+        with self._lock:
+            entry = self._tiers.setdefault(tier, {
+                "model": model,
+                "calls": 0,
+                "latencies": [],
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "hedged": 0,
+            })
+            entry["calls"] += 1
+            entry["latencies"].append(latency)
+            if usage is not None:
+                entry["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                entry["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def record_hedge(self, tier: str) -> None:
+        with self._lock:
+            if tier in self._tiers:
+                self._tiers[tier]["hedged"] += 1
+
+    def hedge_delay(self, tier: str) -> Optional[float]:
+        """p95 latency đã quan sát của tier, None nếu chưa đủ HEDGE_MIN_SAMPLES mẫu."""
+        with self._lock:
+            entry = self._tiers.get(tier)
+            if entry is None or len(entry["latencies"]) < HEDGE_MIN_SAMPLES:
+                return None
+            return percentile(entry["latencies"], HEDGE_PERCENTILE)
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                tier: {
+                    "model": entry["model"],
+                    "calls": entry["calls"],
+                    "latency_total": sum(entry["latencies"]),
+                    "latency_avg": sum(entry["latencies"]) / len(entry["latencies"]),
+                    "latency_p50": percentile(entry["latencies"], 50),
+                    "latency_p95": percentile(entry["latencies"], 95),
+                    "latency_p99": percentile(entry["latencies"], 99),
+                    "prompt_tokens": entry["prompt_tokens"],
+                    "completion_tokens": entry["completion_tokens"],
+                    "hedged": entry["hedged"],
+                }
+                for tier, entry in self._tiers.items()
+            }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Đọc header Retry-After (giây) từ response lỗi nếu có."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _hedged_create(
+    client,
+    kwargs: Dict,
+    rate_limiter: Optional[TokenBucket],
+    deadline: Optional[float],
+    hedge_after: Optional[float],
+    on_hedge: Optional[Callable[[], None]],
+):
+    """
+    Gửi request; nếu sau hedge_after giây chưa xong thì gửi thêm 1 bản sao,
+    lấy kết quả nào về trước. Raise DeadlineExceeded nếu quá deadline.
+    """
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline exceeded before request")
+        kwargs = dict(kwargs, timeout=remaining)
+
+    if hedge_after is None:
+        return client.chat.completions.create(**kwargs)
+
+    executor = _get_hedge_executor()
+    futures = {executor.submit(client.chat.completions.create, **kwargs)}
+
+    def _remaining() -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    timeout = hedge_after if deadline is None else min(hedge_after, _remaining())
+    done, _ = wait(futures, timeout=timeout)
+    if not done and (deadline is None or _remaining() > 0):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        if on_hedge is not None:
+            on_hedge()
+        futures.add(executor.submit(client.chat.completions.create, **kwargs))
+
+    pending = futures
+    while pending:
+        done, pending = wait(pending, timeout=_remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded("deadline exceeded")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+        if not pending:
+            # Mọi bản đều lỗi → raise lỗi của bản cuối cùng
+            raise next(iter(done)).exception()
+    raise DeadlineExceeded("deadline exceeded")
+
+
+def chat_completion_with_backoff(
+    client,
+    rate_limiter: Optional[TokenBucket] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    deadline: Optional[float] = None,
+    hedge_after: Optional[float] = None,
+    on_hedge: Optional[Callable[[], None]] = None,
+    **kwargs,
+):
+    """
+    client.chat.completions.create(**kwargs) với rate limit + backoff.
+    deadline: thời điểm (time.monotonic()) phải xong, quá hạn → DeadlineExceeded.
+    hedge_after: gửi bản sao nếu request chưa xong sau số giây này (on_hedge được gọi).
+    Raise exception cuối cùng nếu hết số lần retry.
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return _hedged_create(client, kwargs, rate_limiter, deadline, hedge_after, on_hedge)
+        except RETRYABLE_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+                delay *= 0.5 + random.random()  # jitter
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise DeadlineExceeded(f"deadline exceeded while backing off ({e})")
+            attempt += 1
+            time.sleep(delay)
+
+
+def run_ordered(
+    func: Callable[[T], R],
+    items: Sequence[T],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> List[R]:
+    """
+    Chạy func(item) song song với tối đa max_concurrency item đồng thời.
+    Trả về list kết quả theo đúng thứ tự items.
+    """
+    if not items:
+        return []
+    if max_concurrency <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+__all__ = [
+    "CallStats",
+    "DeadlineExceeded",
+    "TokenBucket",
+    "chat_completion_with_backoff",
+    "run_ordered",
+    "DEFAULT_MAX_CONCURRENCY",
+    "DEFAULT_REQUESTS_PER_SECOND",
+    "DEFAULT_CALL_TIMEOUT",
+    "percentile",
+]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+LLM Replay: Ghi lại (record) các request/response OpenAI thật của mode 2 rồi phát lại
+(replay) qua stub server local → đo hiệu năng mode 2 offline, kết quả tất định.
+
+- RecordingClient: bọc OpenAI client, ghi mỗi call thành 1 dòng JSONL
+  {"key", "request", "content", "usage", "latency"}
+- ReplayServer: StubServer (llm_stub.py) trả lại đúng content đã ghi theo key của request,
+  latency giả lập = latency đã ghi × latency_scale (0 = trả ngay)
+
+Record: MODE2_LLM_RECORD=recordings.jsonl → get_openai_client() tự bọc client.
+Replay: python llm_replay.py recordings.jsonl --port 8089 --latency-scale 1.0
+Rồi:    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=replay ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from llm_stub import StubServer
+
+# Các field quyết định nội dung response (timeout, stream... không tính vào key)
+KEY_FIELDS = ("model", "messages", "temperature", "response_format")
+
+
+def request_key(payload: Dict) -> str:
+    """Key tất định của 1 request chat completion (giống nhau ở client và server)."""
+    canonical = json.dumps(
+        {field: payload.get(field) for field in KEY_FIELDS},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Completions:
+    def __init__(self, recorder: "RecordingClient"):
+        self._recorder = recorder
+
+    def create(self, **kwargs):
+        return self._recorder._create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, recorder: "RecordingClient"):
+        self.completions = _Completions(recorder)
+
+
+class RecordingClient:
+    """
+    Bọc OpenAI client: client.chat.completions.create(...) gọi API thật và
+    append request/response + latency vào file JSONL (thread-safe).
+    Call lỗi không được ghi.
+    """
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self._lock = threading.Lock()
+        self.chat = _Chat(self)
+
+    def _create(self, **kwargs):
+        start = time.monotonic()
+        response = self._client.chat.completions.create(**kwargs)
+        latency = time.monotonic() - start
+
+        usage = getattr(response, "usage", None)
+        record = {
+            "key": request_key(kwargs),
+            "request": {field: kwargs.get(field) for field in KEY_FIELDS},
+            "content": response.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            },
+            "latency": latency,
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def load_recordings(path: str) -> Dict[str, Dict]:
+    """Đọc file JSONL → {key: record}. Key trùng (VD: hedged request) giữ bản ghi đầu tiên."""
+    recordings: Dict[str, Dict] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            recordings.setdefault(record["key"], record)
+    return recordings
+
+
+class ReplayServer(StubServer):
+    """
+    Stub server phát lại recordings. Request không có trong recordings → verdict mặc định
+    của StubServer (đếm vào `misses`).
+    """
+
+    def __init__(self, address, recordings: Dict[str, Dict], latency_scale: float = 0.0):
+        super().__init__(address)
+        self.recordings = recordings
+        self.latency_scale = latency_scale
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, body: Dict) -> Optional[Dict]:
+        return self.recordings.get(request_key(body))
+
+    def delay(self, body: Dict) -> float:
+        record = self._lookup(body)
+        if record is None:
+            return 0.0
+        return record["latency"] * self.latency_scale
+
+    def usage(self, body: Dict, content: str) -> Tuple[int, int]:
+        record = self._lookup(body)
+        if record is None:
+            return super().usage(body, content)
+        return record["usage"]["prompt_tokens"], record["usage"]["completion_tokens"]
+
+    def respond(self, body: Dict) -> str:
+        record = self._lookup(body)
+        with self.lock:
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if record is None:
+            return super().respond(body)
+        return record["content"]
+
+
+def start_replay_server(
+    recordings_path: str,
+    port: int = 0,
+    latency_scale: float = 0.0,
+) -> Tuple[ReplayServer, str]:
+    """Chạy replay server trong daemon thread. Trả về (server, base_url)."""
+    server = ReplayServer(("127.0.0.1", port), load_recordings(recordings_path), latency_scale)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+__all__ = [
+    "RecordingClient",
+    "ReplayServer",
+    "load_recordings",
+    "request_key",
+    "start_replay_server",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded OpenAI responses")
+    parser.add_argument("recordings", help="File JSONL ghi bởi RecordingClient (MODE2_LLM_RECORD)")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = ReplayServer(("127.0.0.1", args.port), load_recordings(args.recordings), args.latency_scale)
+    print(f"🚀 LLM replay ({len(server.recordings)} réponses): http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+LLM Stub: Server local tương thích OpenAI (/v1/chat/completions) để test mode 2
+không cần API thật.
+
+- Giả lập latency (cố định + jitter)
+- Giả lập lỗi 429 với xác suất error_rate (kèm header Retry-After)
+- Trả về verdict JSON cố định
+
+Chạy: python llm_stub.py --port 8089 --latency 0.5 --error-rate 0.1
+Rồi:  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+DEFAULT_VERDICT = {
+    "implemented": True,
+    "confidence": 0.9,
+    "reasoning": "stub",
+    "evidence": "",
+    "status": "implemented",
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Handler cho POST /v1/chat/completions."""
+
+    server: "StubServer"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.server.lock:
+            self.server.request_count += 1
+
+        time.sleep(self.server.delay(body))
+
+        if random.random() < self.server.error_rate:
+            self._send(429, {"error": {"message": "Rate limit (stub)", "type": "rate_limit_error"}},
+                       headers={"Retry-After": "0.05"})
+            return
+
+        content = self.server.respond(body)
+        prompt_tokens, completion_tokens = self.server.usage(body, content)
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _send(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Ẩn log messages
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def delay(self, body: Dict) -> float:
+        """Latency giả lập (giây) cho 1 request (override để tùy biến)."""
+        return self.latency + random.random() * self.jitter
+
+    def usage(self, body: Dict, content: str) -> Tuple[int, int]:
+        """(prompt_tokens, completion_tokens): ước lượng ~4 ký tự / token."""
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        return prompt_tokens, len(content) // 4
+
+    def respond(self, body: Dict) -> str:
+        """
+        Nội dung message trả về cho 1 request (override để tùy biến).
+        Prompt batch (các yêu cầu đánh số [0], [1], ...) → {"results": [...]}.
+        """
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        ids = re.findall(r"^\[(\d+)\]", prompt, re.MULTILINE)
+        if ids:
+            return json.dumps({"results": [dict(DEFAULT_VERDICT, id=int(i)) for i in ids]})
+        return json.dumps(DEFAULT_VERDICT)
+
+
+def start_stub_server(
+    port: int = 0,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+) -> Tuple[StubServer, str]:
+    """Chạy stub server trong daemon thread. Trả về (server, base_url)."""
+    server = StubServer(("127.0.0.1", port), latency=latency, jitter=jitter, error_rate=error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubServer(("127.0.0.1", args.port), args.latency, args.jitter, args.error_rate)
+    print(f"🚀 LLM stub: http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
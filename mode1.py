@@ -11,19 +11,43 @@ Features:
 
 from __future__ import annotations
 
+import hashlib
 import os
+import re
 import tempfile
+import unicodedata
+import zlib
+from difflib import SequenceMatcher
 from typing import Dict, List, Tuple
 
 import fitz  # PyMuPDF
 from PIL import Image
 import imagehash
 
+from ocr_cache import get_ocr_cache, raster_digest
 from pdf_optimizer import smart_preprocess
 
 # Ngưỡng hash distance để coi là cùng sản phẩm
 DEFAULT_HASH_THRESHOLD = 28
 
+# Cấu hình OCR engine - là một phần của cache key (đổi config → OCR lại)
+OCR_ENGINE_CONFIG = {
+    "engine": "paddleocr",
+    "lang": "fr",
+    "use_angle_cls": True,
+    "dpi": 200,
+}
+
+# Text block matching: shingle = k từ liên tiếp sau normalize
+SHINGLE_SIZE = 3
+# Bỏ qua shingle quá phổ biến (xuất hiện ở > N blocks ref) khi tra index
+MAX_SHINGLE_POSTINGS = 50
+# Jaccard tối thiểu để coi 2 blocks là cùng một đoạn mô tả (đã bị sửa)
+TEXT_MATCH_THRESHOLD = 0.3
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
 
 def extract_products(pdf_path: str, out_dir: str) -> List[Dict]:
     """
@@ -77,6 +101,19 @@ def extract_products(pdf_path: str, out_dir: str) -> List[Dict]:
     return products
 
 
+def normalize_text(text: str) -> str:
+    """
+    Normalize text block để so sánh:
+    - NFKC + lowercase
+    - Nối từ bị ngắt dòng bằng gạch nối ("pro-\\nduit" → "produit")
+    - Xóa punctuation, gộp whitespace
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = text.replace("-\n", "")
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
 def should_compare_text_block(text: str) -> bool:
     """
     Filter text blocks for comparison.
@@ -106,19 +143,48 @@ def should_compare_text_block(text: str) -> bool:
     return True
 
 
-def extract_text_blocks_ocr(pdf_path: str) -> List[Dict]:
+def _run_paddle_ocr(ocr, pix) -> List[Dict]:
+    """
+    Chạy PaddleOCR trên 1 pixmap, trả về list dòng OCR dạng thuần (cache được):
+    {"points": [[x, y], ...], "text": str, "confidence": float}.
+    """
+    import cv2
+    import numpy as np
+
+    img_data = pix.tobytes("png")
+
+    # Convert to numpy array for OCR
+    nparr = np.frombuffer(img_data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+    result = ocr.ocr(img, cls=True)
+    if not result or not result[0]:
+        return []
+
+    lines = []
+    for line in result[0]:
+        bbox_points = line[0]  # [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
+        text_info = line[1]    # (text, confidence)
+        lines.append({
+            "points": [[float(x), float(y)] for x, y in bbox_points],
+            "text": text_info[0],
+            "confidence": float(text_info[1]),
+        })
+    return lines
+
+
+def extract_text_blocks_ocr(pdf_path: str, use_cache: bool = True) -> List[Dict]:
     """
     Extract text blocks using PaddleOCR (for scanned PDFs).
     Returns list of detected text blocks with bbox.
+
+    Kết quả OCR được cache trên đĩa theo digest raster trang + cấu hình engine
+    (xem ocr_cache.py): trang đã OCR sẽ không phải chạy lại.
     """
     try:
-        from paddleocr import PaddleOCR
-        import cv2
-        import numpy as np
-        
-        # Initialize OCR (suppress logging)
-        ocr = PaddleOCR(use_angle_cls=True, lang='fr', show_log=False)
-        
+        ocr = None
+        cache = get_ocr_cache() if use_cache else None
+
         # Convert PDF pages to images
         doc = fitz.open(pdf_path)
         text_blocks = []
@@ -126,33 +192,41 @@ def extract_text_blocks_ocr(pdf_path: str) -> List[Dict]:
         
         for page_index, page in enumerate(doc):
             # Render page to image
-            pix = page.get_pixmap(dpi=200)  # High DPI for OCR
-            img_data = pix.tobytes("png")
-            
-            # Convert to numpy array for OCR
-            nparr = np.frombuffer(img_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Run OCR
-            result = ocr.ocr(img, cls=True)
-            
-            if not result or not result[0]:
-                continue
+            pix = page.get_pixmap(dpi=OCR_ENGINE_CONFIG["dpi"])  # High DPI for OCR
+
+            key = raster_digest(pix, OCR_ENGINE_CONFIG) if cache else None
+            lines = cache.get(key) if cache else None
+
+            if lines is None:
+                if ocr is None:
+                    # Initialize OCR lazily (suppress logging) - chỉ khi cache miss
+                    from paddleocr import PaddleOCR
+
+                    ocr = PaddleOCR(
+                        use_angle_cls=OCR_ENGINE_CONFIG["use_angle_cls"],
+                        lang=OCR_ENGINE_CONFIG["lang"],
+                        show_log=False,
+                    )
+
+                # Run OCR
+                lines = _run_paddle_ocr(ocr, pix)
+                if cache:
+                    cache.put(key, lines)
             
             # Process OCR results
-            for line in result[0]:
-                bbox_points = line[0]  # [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
-                text_info = line[1]    # (text, confidence)
-                text = text_info[0]
-                confidence = text_info[1]
+            for line in lines:
+                bbox_points = line["points"]
+                text = line["text"]
+                confidence = line["confidence"]
                 
                 # Skip low confidence
                 if confidence < 0.7:
                     continue
                 
-                # Calculate bbox (x0, y0, x1, y1)
-                xs = [p[0] for p in bbox_points]
-                ys = [p[1] for p in bbox_points]
+                # Calculate bbox (x0, y0, x1, y1) - pixel (dpi) → PDF points
+                scale = 72 / OCR_ENGINE_CONFIG["dpi"]
+                xs = [p[0] * scale for p in bbox_points]
+                ys = [p[1] * scale for p in bbox_points]
                 bbox = (min(xs), min(ys), max(xs), max(ys))
                 
                 # Apply filters
@@ -164,6 +238,7 @@ def extract_text_blocks_ocr(pdf_path: str) -> List[Dict]:
                     "page": page_index,
                     "bbox": bbox,
                     "text": text,
+                    "confidence": confidence,
                     "normalized": normalize_text(text),
                     "source": "ocr"
                 })
@@ -250,6 +325,114 @@ def extract_text_blocks(pdf_path: str) -> List[Dict]:
     return text_blocks
 
 
+def _block_shingles(normalized: str) -> set:
+    """Fingerprint 1 block: tập hash (crc32) của các shingle SHINGLE_SIZE từ."""
+    words = normalized.split()
+    k = min(SHINGLE_SIZE, len(words))
+    if k == 0:
+        return set()
+    return {
+        zlib.crc32(" ".join(words[i:i + k]).encode("utf-8"))
+        for i in range(len(words) - k + 1)
+    }
+
+
+def index_text_blocks(blocks: List[Dict]) -> Dict:
+    """
+    Fingerprint và index các text blocks của PDF reference.
+    Gắn "digest" và "shingles" vào từng block.
+
+    Returns: {"by_digest": {digest: [block]}, "by_shingle": {hash: [block]}}
+    """
+    by_digest: Dict[str, List[Dict]] = {}
+    by_shingle: Dict[int, List[Dict]] = {}
+
+    for block in blocks:
+        block["digest"] = hashlib.sha1(block["normalized"].encode("utf-8")).hexdigest()
+        block["shingles"] = _block_shingles(block["normalized"])
+        by_digest.setdefault(block["digest"], []).append(block)
+        for sh in block["shingles"]:
+            by_shingle.setdefault(sh, []).append(block)
+
+    return {"by_digest": by_digest, "by_shingle": by_shingle}
+
+
+def match_text_blocks(
+    ref_blocks: List[Dict],
+    final_blocks: List[Dict],
+    threshold: float = TEXT_MATCH_THRESHOLD,
+) -> List[Dict]:
+    """
+    Ghép text blocks giữa Ref và Final qua index shingle (không so sánh all-pairs).
+
+    - Digest giống nhau → "unchanged"
+    - Jaccard shingle >= threshold → "changed" (kèm similarity)
+    - Block Final không ghép được → "added"; block Ref không ghép được → "removed"
+
+    Greedy như pair_products: ưu tiên cặp có điểm cao nhất, mỗi block chỉ ghép 1 lần.
+    """
+    index = index_text_blocks(ref_blocks)
+    by_digest = index["by_digest"]
+    by_shingle = index["by_shingle"]
+
+    used_ref = set()
+    used_final = set()
+    results: List[Dict] = []
+
+    # Pass 1: exact match theo digest
+    for fb in final_blocks:
+        fb["digest"] = hashlib.sha1(fb["normalized"].encode("utf-8")).hexdigest()
+        fb["shingles"] = _block_shingles(fb["normalized"])
+        for rb in by_digest.get(fb["digest"], []):
+            if id(rb) not in used_ref:
+                used_ref.add(id(rb))
+                used_final.add(id(fb))
+                results.append({"status": "unchanged", "ref": rb, "final": fb, "similarity": 1.0})
+                break
+
+    # Pass 2: đếm shingle chung qua index → Jaccard cho các candidates
+    candidates: List[Tuple[float, Dict, Dict]] = []
+    for fb in final_blocks:
+        if id(fb) in used_final:
+            continue
+        shared: Dict[int, int] = {}
+        ref_by_id: Dict[int, Dict] = {}
+        for sh in fb["shingles"]:
+            postings = by_shingle.get(sh)
+            if not postings or len(postings) > MAX_SHINGLE_POSTINGS:
+                continue
+            for rb in postings:
+                if id(rb) in used_ref:
+                    continue
+                shared[id(rb)] = shared.get(id(rb), 0) + 1
+                ref_by_id[id(rb)] = rb
+        for rid, count in shared.items():
+            rb = ref_by_id[rid]
+            union = len(fb["shingles"]) + len(rb["shingles"]) - count
+            jaccard = count / union if union else 0.0
+            if jaccard >= threshold:
+                candidates.append((jaccard, rb, fb))
+
+    candidates.sort(key=lambda x: x[0], reverse=True)
+    for jaccard, rb, fb in candidates:
+        if id(rb) in used_ref or id(fb) in used_final:
+            continue
+        used_ref.add(id(rb))
+        used_final.add(id(fb))
+        # Chỉ tính diff ratio chi tiết cho cặp đã ghép
+        similarity = SequenceMatcher(None, rb["normalized"], fb["normalized"]).ratio()
+        results.append({"status": "changed", "ref": rb, "final": fb, "similarity": similarity})
+
+    for fb in final_blocks:
+        if id(fb) not in used_final:
+            results.append({"status": "added", "ref": None, "final": fb, "similarity": 0.0})
+    for rb in ref_blocks:
+        if id(rb) not in used_ref:
+            results.append({"status": "removed", "ref": rb, "final": None, "similarity": 0.0})
+
+    return results
+
+
 def compute_hash(path: str):
     img = Image.open(path).convert("RGB")
     return imagehash.phash(img)
@@ -310,11 +493,14 @@ def compare_pairs(
     output_pdf1: str,
     output_pdf2: str,
     hash_threshold: int = DEFAULT_HASH_THRESHOLD,
+    text_matches: List[Dict] | None = None,
 ) -> List[Dict]:
     """
     So sánh kích thước từng cặp và annotate vào CẢ 2 PDF.
     - Matched products (dist <= hash_threshold): Blue annotation trên CẢ 2 PDF
     - Unmatched products (dist > hash_threshold): Red annotation CHỈ trên PDF gốc
+    - text_matches (từ match_text_blocks): Orange annotation cho text blocks
+      changed/added/removed
     
     Returns: danh sách kết quả comparison.
     """
@@ -483,6 +669,37 @@ def compare_pairs(
             annot1.update()
             annotations_added_pdf1 += 1
     
+    # Text blocks (mô tả sản phẩm) bị sửa / thêm / xóa - Orange annotation
+    for match in text_matches or []:
+        status = match["status"]
+        if status == "unchanged":
+            continue
+
+        if status == "changed":
+            title = "≠ Texte Modifié"
+            content = f"Similarité: {match['similarity']:.0%}"
+        elif status == "added":
+            title = "+ Texte Ajouté"
+            content = "Texte non trouvé dans Ref"
+        else:
+            title = "− Texte Supprimé"
+            content = "Texte non trouvé dans Final"
+
+        for doc, block in ((doc1, match["ref"]), (doc2, match["final"])):
+            if block is None:
+                continue
+            page = doc.load_page(block["page"])
+            annot = page.add_rect_annot(fitz.Rect(block["bbox"]))
+            annot.set_colors(stroke=(1, 0.5, 0))  # Orange
+            annot.set_border(width=1.5)
+            annot.set_opacity(0.5)
+            annot.set_info(title=title, content=content)
+            annot.update()
+            if doc is doc1:
+                annotations_added_pdf1 += 1
+            else:
+                annotations_added_pdf2 += 1
+
     # Save both annotated PDFs
     doc1.save(output_pdf1, garbage=4, deflate=True)
     doc1.close()
@@ -533,6 +750,13 @@ def compare_mode1(
         list2 = extract_products(final_pdf_path, pdf2_dir)
 
         pairs, list1, list2 = pair_products(list1, list2)
+
+        # Text blocks (mô tả): ghép qua index shingle
+        text_matches = match_text_blocks(
+            extract_text_blocks(ref_pdf_path),
+            extract_text_blocks(final_pdf_path),
+        )
+
         comparisons = compare_pairs(
             pairs=pairs,
             list1=list1,
@@ -542,8 +766,24 @@ def compare_mode1(
             output_pdf1=output_pdf1,
             output_pdf2=output_pdf2,
             hash_threshold=hash_threshold,
+            text_matches=text_matches,
         )
 
+    text_comparisons = [
+        {
+            "status": m["status"],
+            "similarity": m["similarity"],
+            "ref_page": m["ref"]["page"] if m["ref"] else None,
+            "ref_bbox": m["ref"]["bbox"] if m["ref"] else None,
+            "ref_text": m["ref"]["text"] if m["ref"] else None,
+            "final_page": m["final"]["page"] if m["final"] else None,
+            "final_bbox": m["final"]["bbox"] if m["final"] else None,
+            "final_text": m["final"]["text"] if m["final"] else None,
+        }
+        for m in text_matches
+        if m["status"] != "unchanged"
+    ]
+
     return {
         "output_pdf1": output_pdf1,
         "output_pdf2": output_pdf2,
@@ -551,6 +791,8 @@ def compare_mode1(
         "num_products_final": len(list2),
         "num_comparisons": len(comparisons),
         "comparisons": comparisons,
+        "num_text_blocks_unchanged": sum(1 for m in text_matches if m["status"] == "unchanged"),
+        "text_comparisons": text_comparisons,
         "preprocessing": preprocess_metadata,  # NEW
     }
 
@@ -561,5 +803,8 @@ __all__ = [
     "pair_products",
     "compute_hash",
     "compare_pairs",
+    "extract_text_blocks",
+    "normalize_text",
+    "match_text_blocks",
 ]
 
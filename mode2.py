@@ -7,11 +7,35 @@ from __future__ import annotations
 
 import json
 import os
-from typing import Dict, List, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 import fitz  # PyMuPDF
 
+from llm_dispatch import (
+    CallStats,
+    DEFAULT_CALL_TIMEOUT,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_REQUESTS_PER_SECOND,
+    DeadlineExceeded,
+    TokenBucket,
+    chat_completion_with_backoff,
+    run_ordered,
+)
+from annotation_rules import precheck_annotation
+from llm_cache import VerdictCache, verdict_cache_key
+from llm_replay import RecordingClient
 from pdf_optimizer import smart_preprocess
+from spatial_index import (
+    DocumentWordIndex,
+    PageWordIndex,
+    capture_anchor,
+    expand_rect,
+    locate_anchor,
+    texts_around,
+)
 
 try:
     from openai import OpenAI
@@ -29,10 +53,41 @@ except Exception:
 # Đọc model từ env, fallback mặc định
 GPT_MODEL = os.getenv("GPT_MODEL", "gpt-4o-mini")
 
+# Tiered routing: model mạnh hơn (tùy chọn) cho verdict confidence thấp / partial / unclear
+GPT_MODEL_STRONG = os.getenv("GPT_MODEL_STRONG", "")
+ESCALATION_CONFIDENCE = float(os.getenv("MODE2_ESCALATION_CONFIDENCE", "0.7"))
 
-def get_openai_client(api_key: Optional[str] = None) -> Optional[OpenAI]:
+# Version của prompt template - tăng khi sửa prompt để cache verdict cũ không còn dùng
+PROMPT_TEMPLATE_VERSION = "2"
+BATCH_PROMPT_TEMPLATE_VERSION = "batch-1"
+
+# Batch mode: gộp các annotation cùng trang vào 1 request, tối đa ~N tokens prompt
+BATCH_TOKEN_BUDGET = int(os.getenv("MODE2_BATCH_TOKEN_BUDGET", "6000"))
+
+# Prompt từng annotation: text hiện tại (200pt) + context (400pt, bỏ phần trùng) tối đa ~N tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("MODE2_CONTEXT_TOKEN_BUDGET", "800"))
+CURRENT_TEXT_SIZE = 200  # pt
+CONTEXT_SIZE = 400       # pt
+
+# Budget thời gian (giây) cho toàn bộ phần gọi GPT của 1 lần chạy, 0 = không giới hạn.
+# Hết budget → các annotation còn lại nhận verdict "unclear" thay vì chờ.
+TIME_BUDGET = float(os.getenv("MODE2_TIME_BUDGET", "0"))
+
+# Ghi request/response GPT vào file JSONL để replay offline (llm_replay.py), rỗng = tắt
+LLM_RECORD_PATH = os.getenv("MODE2_LLM_RECORD", "")
+
+# Cache records annotation theo file Ref (trong process), tối đa N file
+ANNOTATION_CACHE_SIZE = 8
+_ANNOTATION_CACHE: "OrderedDict[Tuple, List[Dict]]" = OrderedDict()
+_ANNOTATION_CACHE_LOCK = threading.Lock()
+
+
+def get_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> Optional[OpenAI]:
     """
     Khởi tạo OpenAI client từ api_key (ưu tiên) hoặc từ env OPENAI_API_KEY.
+    base_url (hoặc env OPENAI_BASE_URL) cho phép trỏ tới server tương thích OpenAI
+    (VD: llm_stub.py, llm_replay.py). Retry do chat_completion_with_backoff xử lý (max_retries=0).
+    Env MODE2_LLM_RECORD: client được bọc bởi RecordingClient để ghi lại mọi call.
     """
     if OpenAI is None:
         return None
@@ -42,15 +97,42 @@ def get_openai_client(api_key: Optional[str] = None) -> Optional[OpenAI]:
         return None
 
     try:
-        return OpenAI(api_key=key)
+        client = OpenAI(
+            api_key=key,
+            base_url=base_url or os.getenv("OPENAI_BASE_URL") or None,
+            max_retries=0,
+        )
     except Exception:
         return None
+    if LLM_RECORD_PATH:
+        return RecordingClient(client, LLM_RECORD_PATH)
+    return client
 
 
-def extract_popup_annotations(pdf_path: str) -> List[Dict]:
+def _annotation_cache_key(pdf_path: str, with_anchors: bool) -> Tuple:
+    st = os.stat(pdf_path)
+    return os.path.realpath(pdf_path), st.st_mtime_ns, st.st_size, with_anchors
+
+
+def extract_popup_annotations(pdf_path: str, with_anchors: bool = False, use_cache: bool = True) -> List[Dict]:
     """
-    Trích xuất các popup/text annotations từ PDF reference.
+    Trích xuất các popup/text annotations từ PDF reference (mở file 1 lần).
+
+    Mỗi record chỉ chứa dữ liệu thuần (picklable, dùng được ở process khác):
+    {"page", "rect": (x0, y0, x1, y1), "content", "author", "type", "ref_text"}.
+    ref_text: text quanh annotation ở Ref (bán kính CONTEXT_SIZE), dùng cho precheck.
+    with_anchors: thêm "anchor" (capture_anchor của spatial_index, bbox dạng tuple)
+    để relocate trên Final mà không cần mở lại Ref.
+    use_cache: records được cache theo file (path + mtime + size) trong process.
     """
+    cache_key = _annotation_cache_key(pdf_path, with_anchors) if use_cache else None
+    if cache_key is not None:
+        with _ANNOTATION_CACHE_LOCK:
+            cached = _ANNOTATION_CACHE.get(cache_key)
+            if cached is not None:
+                _ANNOTATION_CACHE.move_to_end(cache_key)
+                return [dict(record) for record in cached]
+
     doc = fitz.open(pdf_path)
     annotations: List[Dict] = []
 
@@ -60,6 +142,7 @@ def extract_popup_annotations(pdf_path: str) -> List[Dict]:
         if not annots:
             continue
 
+        word_index: Optional[PageWordIndex] = None
         for annot in annots:
             annot_type = annot.type[0]
             if annot_type not in (
@@ -70,7 +153,8 @@ def extract_popup_annotations(pdf_path: str) -> List[Dict]:
                 continue
 
             try:
-                content = annot.info.get("content", "") or annot.info.get("title", "")
+                info = annot.info
+                content = info.get("content", "") or info.get("title", "")
 
                 if not content and hasattr(annot, "popup"):
                     popup = getattr(annot, "popup", None)
@@ -78,50 +162,176 @@ def extract_popup_annotations(pdf_path: str) -> List[Dict]:
                         content = popup.info.get("content", "")
 
                 if content and content.strip():
-                    annotations.append(
-                        {
-                            "page": page_num,
-                            "annotation": annot,
-                            "content": content.strip(),
-                            "rect": annot.rect,
-                        }
-                    )
+                    rect = annot.rect
+                    if word_index is None:
+                        word_index = PageWordIndex.from_page(page)
+                    record = {
+                        "page": page_num,
+                        "rect": tuple(rect),
+                        "content": content.strip(),
+                        "author": info.get("title", ""),
+                        "type": annot.type[1],
+                        "ref_text": texts_around(word_index, rect, [CONTEXT_SIZE])[0],
+                    }
+                    if with_anchors:
+                        anchor = capture_anchor(word_index, rect)
+                        if anchor["bbox"] is not None:
+                            anchor["bbox"] = tuple(anchor["bbox"])
+                        record["anchor"] = anchor
+                    annotations.append(record)
             except Exception:
                 # Bỏ qua annotation lỗi
                 continue
 
     doc.close()
+
+    if cache_key is not None:
+        with _ANNOTATION_CACHE_LOCK:
+            _ANNOTATION_CACHE[cache_key] = annotations
+            while len(_ANNOTATION_CACHE) > ANNOTATION_CACHE_SIZE:
+                _ANNOTATION_CACHE.popitem(last=False)
+        return [dict(record) for record in annotations]
     return annotations
 
 
-def get_text_around_annotation(page: fitz.Page, rect: fitz.Rect, context_size: int = 200) -> str:
-    expanded_rect = fitz.Rect(
-        max(0, rect.x0 - context_size),
-        max(0, rect.y0 - context_size),
-        min(page.rect.width, rect.x1 + context_size),
-        min(page.rect.height, rect.y1 + context_size),
-    )
+def get_text_around_annotation(
+    page: fitz.Page,
+    rect: fitz.Rect,
+    context_size: int = 200,
+    word_index: Optional[PageWordIndex] = None,
+) -> str:
+    """
+    Text quanh annotation. Có word_index (spatial_index.py) → tra index,
+    không extract lại text layer của trang.
+    """
+    if word_index is not None:
+        return texts_around(word_index, rect, [context_size])[0]
+    expanded_rect = expand_rect(rect, context_size, page.rect)
     return page.get_text("text", clip=expanded_rect).strip()
 
 
+def _error_verdict(reasoning: str, error: str) -> Dict:
+    """Verdict "unclear" cho trường hợp lỗi (không được cache)."""
+    return {
+        "implemented": False,
+        "confidence": 0.0,
+        "reasoning": reasoning,
+        "evidence": "",
+        "status": "unclear",
+        "error": error,
+    }
+
+
+def _cached_verdict(verdict: Dict) -> Dict:
+    """
+    Bản sao verdict lấy từ cache (hoặc từ request trùng key đang chạy): lần này không có
+    call GPT nào → 0 token, không escalate, source "cache".
+    """
+    return dict(verdict, prompt_tokens=0, escalated=False, source="cache")
+
+
+def _parse_verdict(result: Dict) -> Dict:
+    return {
+        "implemented": bool(result.get("implemented", False)),
+        "confidence": float(result.get("confidence", 0.0)),
+        "reasoning": result.get("reasoning", ""),
+        "evidence": result.get("evidence", ""),
+        "status": result.get("status", "unclear"),
+    }
+
+
+def _call_deadline(deadline: Optional[float], call_timeout: float) -> Optional[float]:
+    """Deadline của 1 call: sớm hơn giữa (bây giờ + call_timeout) và deadline của cả lần chạy."""
+    call_deadline = time.monotonic() + call_timeout if call_timeout and call_timeout > 0 else None
+    if deadline is None:
+        return call_deadline
+    return deadline if call_deadline is None else min(deadline, call_deadline)
+
+
+def _budget_exhausted(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _estimate_tokens(text: str) -> int:
+    """Ước lượng số token (~4 ký tự / token)."""
+    return len(text) // 4 + 1
+
+
+def _prompt_tokens(usage, messages: List[Dict]) -> int:
+    """Số token prompt: theo usage của API nếu có, không thì ước lượng."""
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    if prompt_tokens:
+        return int(prompt_tokens)
+    return sum(_estimate_tokens(m["content"]) for m in messages)
+
+
+def _rect_distance(a: fitz.Rect, b: fitz.Rect) -> float:
+    """Khoảng cách ngắn nhất giữa 2 rect (0 nếu giao nhau)."""
+    dx = max(a.x0 - b.x1, b.x0 - a.x1, 0)
+    dy = max(a.y0 - b.y1, b.y0 - a.y1, 0)
+    return (dx * dx + dy * dy) ** 0.5
+
+
+def build_prompt_context(
+    word_index: PageWordIndex,
+    rect: fitz.Rect,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    current_size: float = CURRENT_TEXT_SIZE,
+    context_size: float = CONTEXT_SIZE,
+) -> Tuple[str, str]:
+    """
+    Text cho prompt 1 annotation, trả về (current_text, context_text):
+    - current_text: các dòng có word trong vùng current_size, lấy trọn dòng trong vùng
+      context_size (không cắt giữa dòng), luôn gửi đầy đủ
+    - context_text: các dòng còn lại của vùng context_size (không gửi 2 lần),
+      giữ các dòng gần rect nhất cho đến khi tổng vượt token_budget,
+      rồi ghép lại theo thứ tự đọc.
+    """
+    rect = fitz.Rect(rect)
+    base = word_index.query(expand_rect(rect, context_size, word_index.page_rect))
+    inner = word_index.filter(base, expand_rect(rect, current_size, word_index.page_rect))
+
+    current_lines = {word_index.words[idx][5:7] for idx in inner}
+    current_text = word_index.text([idx for idx in base if word_index.words[idx][5:7] in current_lines])
+    lines = word_index.lines([idx for idx in base if word_index.words[idx][5:7] not in current_lines])
+    remaining = token_budget - _estimate_tokens(current_text)
+    kept = []
+    for line_no in sorted(range(len(lines)), key=lambda k: _rect_distance(lines[k][1], rect)):
+        cost = _estimate_tokens(word_index.text(lines[line_no][0]))
+        if cost > remaining:
+            break
+        kept.append(line_no)
+        remaining -= cost
+
+    context_text = word_index.text([idx for line_no in sorted(kept) for idx in lines[line_no][0]])
+    return current_text, context_text
+
+
 def check_annotation_with_gpt(
     client: Optional[OpenAI],
     annotation_content: str,
     current_text: str,
     context_text: str,
     model: str = GPT_MODEL,
+    rate_limiter: Optional[TokenBucket] = None,
+    stats: Optional[CallStats] = None,
+    tier: str = "fast",
+    deadline: Optional[float] = None,
+    call_timeout: float = DEFAULT_CALL_TIMEOUT,
+    hedge: bool = True,
 ) -> Dict:
     """
     Gọi GPT để đánh giá annotation đã được thực hiện hay chưa.
+    rate_limiter: token bucket dùng chung khi gọi song song (xem llm_dispatch.py).
+    stats: ghi latency + token của lần gọi vào tier tương ứng.
+    deadline: thời điểm (time.monotonic()) hết budget của lần chạy; mỗi call còn bị
+    giới hạn bởi call_timeout. Quá hạn → verdict "unclear" (error "deadline").
+    hedge: gửi thêm 1 request khi call chậm hơn p95 latency đã quan sát của tier.
     """
     if client is None:
-        return {
-            "implemented": False,
-            "confidence": 0.0,
-            "reasoning": "OpenAI client not available",
-            "evidence": "",
-            "status": "unclear",
-        }
+        return _error_verdict("OpenAI client not available", "client_unavailable")
+    if _budget_exhausted(deadline):
+        return _error_verdict("Time budget exhausted", "budget_exhausted")
 
     prompt = f"""
 Bạn là một chuyên gia kiểm tra tài liệu PDF. Kiểm tra yêu cầu sửa đổi từ popup annotation đã được thực hiện chưa.
@@ -132,43 +342,233 @@ YÊU CẦU SỬA ĐỔI:
 TEXT HIỆN TẠI (vị trí annotation):
 {current_text}
 
-CONTEXT XUNG QUANH:
+CONTEXT XUNG QUANH (không lặp lại text hiện tại):
 {context_text}
 
 Trả lời JSON với các field: implemented (true/false), reasoning, evidence, status (implemented/not_implemented/partial/unclear), confidence (0-1).
 """
-
+    messages = [
+        {
+            "role": "system",
+            "content": "Bạn là chuyên gia kiểm tra tài liệu. Trả lời chỉ bằng JSON, không thêm text.",
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+    start = time.monotonic()
+    usage = None
     try:
-        response = client.chat.completions.create(
+        response = chat_completion_with_backoff(
+            client,
+            rate_limiter=rate_limiter,
+            deadline=_call_deadline(deadline, call_timeout),
+            hedge_after=stats.hedge_delay(tier) if (hedge and stats is not None) else None,
+            on_hedge=(lambda: stats.record_hedge(tier)) if stats is not None else None,
             model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Bạn là chuyên gia kiểm tra tài liệu. Trả lời chỉ bằng JSON, không thêm text.",
-                },
-                {"role": "user", "content": prompt},
-            ],
+            messages=messages,
             temperature=0.3,
             response_format={"type": "json_object"},
         )
+        usage = getattr(response, "usage", None)
 
         result = json.loads(response.choices[0].message.content)
-        return {
-            "implemented": bool(result.get("implemented", False)),
-            "confidence": float(result.get("confidence", 0.0)),
-            "reasoning": result.get("reasoning", ""),
-            "evidence": result.get("evidence", ""),
-            "status": result.get("status", "unclear"),
-        }
+        verdict = _parse_verdict(result)
+        verdict["prompt_tokens"] = _prompt_tokens(usage, messages)
+        return verdict
+    except DeadlineExceeded as e:
+        return _error_verdict(f"Deadline exceeded: {e}", "deadline")
     except Exception as e:
-        return {
-            "implemented": False,
-            "confidence": 0.0,
-            "reasoning": f"Error: {e}",
-            "evidence": "",
-            "status": "unclear",
+        return _error_verdict(f"Error: {e}", str(e))
+    finally:
+        if stats is not None:
+            stats.record(tier, model, time.monotonic() - start, usage)
+
+
+def needs_escalation(verdict: Dict, escalation_confidence: float = ESCALATION_CONFIDENCE) -> bool:
+    """Verdict cần hỏi lại model mạnh hơn: partial/unclear hoặc confidence thấp (không tính lỗi)."""
+    if verdict.get("error"):
+        return False
+    return (
+        verdict.get("status") in ("partial", "unclear")
+        or float(verdict.get("confidence", 0.0)) < escalation_confidence
+    )
+
+
+def check_annotation_routed(
+    client: Optional[OpenAI],
+    annotation_content: str,
+    current_text: str,
+    context_text: str,
+    model: str = GPT_MODEL,
+    strong_model: Optional[str] = GPT_MODEL_STRONG,
+    escalation_confidence: float = ESCALATION_CONFIDENCE,
+    rate_limiter: Optional[TokenBucket] = None,
+    stats: Optional[CallStats] = None,
+    deadline: Optional[float] = None,
+    call_timeout: float = DEFAULT_CALL_TIMEOUT,
+    hedge: bool = True,
+) -> Dict:
+    """
+    Tiered routing: hỏi model nhanh/rẻ trước, chỉ escalate lên strong_model khi
+    needs_escalation(). Verdict có thêm "model" (model ra verdict cuối) và "escalated".
+    Hết budget (deadline) → giữ verdict của model nhanh, không escalate.
+    """
+    verdict = check_annotation_with_gpt(
+        client, annotation_content, current_text, context_text,
+        model=model, rate_limiter=rate_limiter, stats=stats, tier="fast",
+        deadline=deadline, call_timeout=call_timeout, hedge=hedge,
+    )
+    verdict["model"] = model
+    verdict["escalated"] = False
+
+    if (
+        strong_model and strong_model != model
+        and needs_escalation(verdict, escalation_confidence)
+        and not _budget_exhausted(deadline)
+    ):
+        fast_tokens = verdict.get("prompt_tokens", 0)
+        verdict = check_annotation_with_gpt(
+            client, annotation_content, current_text, context_text,
+            model=strong_model, rate_limiter=rate_limiter, stats=stats, tier="strong",
+            deadline=deadline, call_timeout=call_timeout, hedge=hedge,
+        )
+        verdict["prompt_tokens"] = fast_tokens + verdict.get("prompt_tokens", 0)
+        verdict["model"] = strong_model
+        verdict["escalated"] = True
+
+    return verdict
+
+
+def check_annotations_batch_with_gpt(
+    client: Optional[OpenAI],
+    items: List[Dict],
+    page_context: str,
+    model: str = GPT_MODEL,
+    rate_limiter: Optional[TokenBucket] = None,
+    stats: Optional[CallStats] = None,
+    tier: str = "fast",
+    deadline: Optional[float] = None,
+    call_timeout: float = DEFAULT_CALL_TIMEOUT,
+    hedge: bool = True,
+) -> List[Dict]:
+    """
+    Gọi GPT 1 lần cho nhiều annotation cùng trang: context trang chỉ gửi 1 lần.
+    items: [{"annotation_content": str, "current_text": str}, ...]
+    deadline / call_timeout / hedge: như check_annotation_with_gpt.
+    Trả về list verdict theo đúng thứ tự items.
+    """
+    if client is None:
+        return [_error_verdict("OpenAI client not available", "client_unavailable") for _ in items]
+    if _budget_exhausted(deadline):
+        return [_error_verdict("Time budget exhausted", "budget_exhausted") for _ in items]
+
+    requests_text = "\n\n".join(
+        f"[{idx}] YÊU CẦU SỬA ĐỔI:\n{item['annotation_content']}\n"
+        f"TEXT HIỆN TẠI (vị trí annotation):\n{item['current_text']}"
+        for idx, item in enumerate(items)
+    )
+
+    prompt = f"""
+Bạn là một chuyên gia kiểm tra tài liệu PDF. Kiểm tra TỪNG yêu cầu sửa đổi từ popup annotation đã được thực hiện chưa.
+
+CONTEXT TRANG (dùng chung cho mọi yêu cầu):
+{page_context}
+
+CÁC YÊU CẦU:
+{requests_text}
+
+Trả lời JSON: {{"results": [{{"id": <số trong ngoặc vuông>, "implemented": true/false, "reasoning": "...", "evidence": "...", "status": "implemented/not_implemented/partial/unclear", "confidence": 0-1}}, ...]}} với đúng 1 phần tử cho mỗi yêu cầu.
+"""
+    messages = [
+        {
+            "role": "system",
+            "content": "Bạn là chuyên gia kiểm tra tài liệu. Trả lời chỉ bằng JSON, không thêm text.",
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+    start = time.monotonic()
+    usage = None
+    try:
+        response = chat_completion_with_backoff(
+            client,
+            rate_limiter=rate_limiter,
+            deadline=_call_deadline(deadline, call_timeout),
+            hedge_after=stats.hedge_delay(tier) if (hedge and stats is not None) else None,
+            on_hedge=(lambda: stats.record_hedge(tier)) if stats is not None else None,
+            model=model,
+            messages=messages,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+        )
+        usage = getattr(response, "usage", None)
+
+        answers = json.loads(response.choices[0].message.content).get("results", [])
+        by_id = {}
+        for answer in answers:
+            try:
+                by_id[int(answer.get("id"))] = answer
+            except (TypeError, ValueError):
+                continue
+
+        # Token prompt của batch chia đều cho các yêu cầu
+        share = round(_prompt_tokens(usage, messages) / len(items))
+        verdicts = []
+        for idx in range(len(items)):
+            if idx in by_id:
+                verdict = _parse_verdict(by_id[idx])
+                verdict["prompt_tokens"] = share
+            else:
+                verdict = _error_verdict("No answer in batch response", "missing_batch_answer")
+            verdicts.append(verdict)
+        return verdicts
+    except DeadlineExceeded as e:
+        return [_error_verdict(f"Deadline exceeded: {e}", "deadline") for _ in items]
+    except Exception as e:
+        return [_error_verdict(f"Error: {e}", str(e)) for _ in items]
+    finally:
+        if stats is not None:
+            stats.record(tier, model, time.monotonic() - start, usage)
+
+
+def _build_page_batches(
+    word_index: PageWordIndex,
+    page_jobs: List[Dict],
+    token_budget: int,
+    context_size: float = CONTEXT_SIZE,
+) -> List[Dict]:
+    """
+    Chia các job cùng trang thành batch sao cho context trang (union các vùng context_size,
+    cùng bán kính với context_text của từng job) + các yêu cầu không vượt quá token_budget.
+    Mỗi batch có ít nhất 1 job.
+    """
+    batches: List[Dict] = []
+    current: Optional[Dict] = None
+
+    for job in page_jobs:
+        job_tokens = _estimate_tokens(job["annotation_content"]) + _estimate_tokens(job["current_text"])
+        if current is not None:
+            union_rect = current["rect"] | job["rect"]
+            context = texts_around(word_index, union_rect, [context_size])[0]
+            if current["item_tokens"] + job_tokens + _estimate_tokens(context) <= token_budget:
+                current["jobs"].append(job)
+                current["rect"] = union_rect
+                current["context_text"] = context
+                current["item_tokens"] += job_tokens
+                continue
+            batches.append(current)
+
+        current = {
+            "jobs": [job],
+            "rect": fitz.Rect(job["rect"]),
+            "context_text": job["context_text"],
+            "item_tokens": job_tokens,
         }
 
+    if current is not None:
+        batches.append(current)
+    return batches
+
 
 def _annotate_status(final_page: fitz.Page, rect: fitz.Rect, annotation_content: str, result: Dict):
     status = result.get("status", "unclear")
@@ -201,15 +601,159 @@ def _annotate_status(final_page: fitz.Page, rect: fitz.Rect, annotation_content:
     annot.update()
 
 
+def _run_batched_checks(
+    jobs: List[Dict],
+    word_indexes: Dict[int, PageWordIndex],
+    client: Optional[OpenAI],
+    model_name: str,
+    rate_limiter: TokenBucket,
+    cache: Optional[VerdictCache],
+    max_concurrency: int,
+    token_budget: int,
+    strong_model: Optional[str] = None,
+    escalation_confidence: float = ESCALATION_CONFIDENCE,
+    stats: Optional[CallStats] = None,
+    deadline: Optional[float] = None,
+    call_timeout: float = DEFAULT_CALL_TIMEOUT,
+    hedge: bool = True,
+) -> Tuple[List[Dict], int]:
+    """
+    Batch mode: lấy verdict từ cache nếu có, gộp các job còn lại theo trang thành batch,
+    gọi GPT song song theo batch rồi map kết quả về đúng job.
+    Verdict cần escalate được hỏi lại strong_model từng annotation một.
+    Job trùng key chỉ được gửi 1 lần (token / escalation chỉ tính cho job đầu tiên).
+    Trả về (verdicts theo thứ tự jobs, số batch đã gửi).
+    """
+    cache_model = f"{model_name}>{strong_model}" if strong_model else model_name
+    verdicts: List[Optional[Dict]] = [None] * len(jobs)
+    keys = [
+        verdict_cache_key(
+            cache_model,
+            BATCH_PROMPT_TEMPLATE_VERSION,
+            job["annotation_content"],
+            job["current_text"],
+            job["context_text"],
+        )
+        for job in jobs
+    ]
+
+    # Job đại diện cho mỗi key cần gửi, theo trang
+    pending_by_page: Dict[int, List[Dict]] = {}
+    seen_keys = set()
+    for idx, (job, key) in enumerate(zip(jobs, keys)):
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            verdicts[idx] = _cached_verdict(cached)
+            cache.stats["hits"] += 1
+        elif key in seen_keys:
+            if cache is not None:
+                cache.stats["coalesced"] += 1
+        else:
+            seen_keys.add(key)
+            if cache is not None:
+                cache.stats["misses"] += 1
+            pending_by_page.setdefault(job["page"], []).append(dict(job, key=key))
+
+    batches: List[Dict] = []
+    for page_index, page_jobs in pending_by_page.items():
+        batches.extend(_build_page_batches(word_indexes[page_index], page_jobs, token_budget))
+
+    def _check_batch(batch_data: Dict) -> List[Dict]:
+        return check_annotations_batch_with_gpt(
+            client=client,
+            items=batch_data["jobs"],
+            page_context=batch_data["context_text"],
+            model=model_name,
+            rate_limiter=rate_limiter,
+            stats=stats,
+            tier="fast",
+            deadline=deadline,
+            call_timeout=call_timeout,
+            hedge=hedge,
+        )
+
+    by_key: Dict[str, Dict] = {}
+    to_escalate: List[Dict] = []
+    for batch_data, batch_verdicts in zip(batches, run_ordered(_check_batch, batches, max_concurrency)):
+        for job, verdict in zip(batch_data["jobs"], batch_verdicts):
+            verdict["model"] = model_name
+            verdict["escalated"] = False
+            by_key[job["key"]] = verdict
+            if (
+                strong_model and strong_model != model_name
+                and needs_escalation(verdict, escalation_confidence)
+                and not _budget_exhausted(deadline)
+            ):
+                to_escalate.append(job)
+
+    def _escalate(job: Dict) -> Dict:
+        verdict = check_annotation_with_gpt(
+            client, job["annotation_content"], job["prompt_current"], job["prompt_context"],
+            model=strong_model, rate_limiter=rate_limiter, stats=stats, tier="strong",
+            deadline=deadline, call_timeout=call_timeout, hedge=hedge,
+        )
+        verdict["model"] = strong_model
+        verdict["escalated"] = True
+        return verdict
+
+    for job, verdict in zip(to_escalate, run_ordered(_escalate, to_escalate, max_concurrency)):
+        verdict["prompt_tokens"] = by_key[job["key"]].get("prompt_tokens", 0) + verdict.get("prompt_tokens", 0)
+        by_key[job["key"]] = verdict
+
+    if cache is not None:
+        for key, verdict in by_key.items():
+            if not verdict.get("error"):
+                cache.put(key, verdict)
+
+    delivered = set()
+    for idx, key in enumerate(keys):
+        if verdicts[idx] is None:
+            verdicts[idx] = dict(by_key[key]) if key not in delivered else _cached_verdict(by_key[key])
+            delivered.add(key)
+
+    return verdicts, len(batches)
+
+
 def compare_mode2(
     ref_pdf_path: str,
     final_pdf_path: str,
     output_path: Optional[str] = None,
     api_key: Optional[str] = None,
     model: Optional[str] = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+    use_cache: bool = True,
+    batch: bool = False,
+    batch_token_budget: int = BATCH_TOKEN_BUDGET,
+    precheck: bool = True,
+    relocate: bool = True,
+    strong_model: Optional[str] = None,
+    escalation_confidence: float = ESCALATION_CONFIDENCE,
+    time_budget: float = TIME_BUDGET,
+    call_timeout: float = DEFAULT_CALL_TIMEOUT,
+    hedge: bool = True,
+    context_token_budget: int = CONTEXT_TOKEN_BUDGET,
 ) -> Dict:
     """
     Mode 2 – Đọc popup annotations từ ref_pdf, kiểm tra bằng GPT, annotate vào final_pdf.
+
+    Các annotation được kiểm tra song song (tối đa max_concurrency request đồng thời,
+    giới hạn requests_per_second), kết quả giữ đúng thứ tự annotation.
+    use_cache: verdict được cache trong SQLite (llm_cache.py); annotation trùng nhau
+    trong cùng 1 lần chạy chỉ gọi GPT 1 lần. Verdict từ cache có source "cache",
+    prompt_tokens 0 và không tính là escalation (summary["cache_hits"]).
+    batch: gộp các annotation cùng trang (tối đa batch_token_budget tokens) vào 1 request,
+    context trang chỉ gửi 1 lần.
+    precheck: review note dạng máy móc ("remplacer X par Y", ...) được kiểm tra bằng rule
+    (annotation_rules.py), chỉ note mơ hồ mới gửi GPT.
+    relocate: tìm lại vị trí annotation trên Final theo text anchor (layout bị dịch chuyển).
+    strong_model (mặc định env GPT_MODEL_STRONG): model được hỏi lại khi verdict của
+    `model` có confidence < escalation_confidence hoặc status partial/unclear.
+    time_budget: tổng số giây cho phần gọi GPT (0 = không giới hạn); mỗi call tối đa
+    call_timeout giây. Hết hạn → verdict "unclear" kèm lý do, không chờ thêm.
+    hedge: call chậm hơn p95 đã quan sát được gửi thêm 1 bản sao, lấy kết quả về trước.
+    context_token_budget: giới hạn ~token cho text hiện tại + context của prompt từng
+    annotation (build_prompt_context); mỗi result ghi lại prompt_tokens.
     """
     # === SMART PREPROCESSING ===
     print("\n=== MODE 2: Vérification des annotations ===")
@@ -217,63 +761,169 @@ def compare_mode2(
     # ===========================
     
     model_name = model or GPT_MODEL
+    strong_model_name = strong_model or GPT_MODEL_STRONG or None
     if output_path is None:
         base = os.path.splitext(final_pdf_path)[0]
         output_path = f"{base}_mode2_lasolution_diff.pdf"
 
-    annotations = extract_popup_annotations(ref_pdf_path)
+    # Ref chỉ được mở 1 lần trong extract_popup_annotations (kèm anchor nếu relocate)
+    annotations = extract_popup_annotations(ref_pdf_path, with_anchors=relocate)
 
-    ref_doc = fitz.open(ref_pdf_path)
     final_doc = fitz.open(final_pdf_path)
 
     client = get_openai_client(api_key=api_key)
-
-    annotations_by_page: Dict[int, List[Dict]] = {}
-    for ann in annotations:
-        annotations_by_page.setdefault(ann["page"], []).append(ann)
-
-    num_pages = min(ref_doc.page_count, final_doc.page_count)
-    results: List[Dict] = []
-
-    for i in range(num_pages):
-        if i not in annotations_by_page:
+    rate_limiter = TokenBucket(requests_per_second)
+    cache = VerdictCache() if use_cache else None
+    stats = CallStats()
+
+    # 1. Thu thập context cho từng annotation (PyMuPDF không thread-safe → tuần tự)
+    # Words của mỗi trang chỉ extract 1 lần vào spatial index; text 200pt
+    # là subset lọc lại từ kết quả 400pt.
+    # relocate: anchor (text dưới annotation ở Ref) được tìm lại trên Final qua
+    # inverted index, context window dời theo khi layout bị reflow.
+    word_indexes: Dict[int, PageWordIndex] = {}
+    final_index: Optional[DocumentWordIndex] = None
+    if relocate:
+        final_index = DocumentWordIndex.from_document(final_doc)
+        word_indexes = final_index.pages
+
+    jobs: List[Dict] = []
+    for ann_data in annotations:
+        ref_page_no = ann_data["page"]
+        page_no, rect = ref_page_no, fitz.Rect(ann_data["rect"])
+        relocated = False
+        anchor_score = None
+        if final_index is not None:
+            located = locate_anchor(final_index, ann_data["anchor"], preferred_page=ref_page_no)
+            if located is not None:
+                page_no, anchor_score = located["page"], located["score"]
+                dx, dy = located["offset"]
+                rect = fitz.Rect(rect.x0 + dx, rect.y0 + dy, rect.x1 + dx, rect.y1 + dy)
+                relocated = page_no != ref_page_no or abs(dx) > 1 or abs(dy) > 1
+
+        if page_no >= final_doc.page_count:
             continue
+        if page_no not in word_indexes:
+            word_indexes[page_no] = PageWordIndex.from_page(final_doc.load_page(page_no))
+
+        current_text, context_text = texts_around(word_indexes[page_no], rect, (CURRENT_TEXT_SIZE, CONTEXT_SIZE))
+        # Prompt từng annotation: context không lặp lại current text, cắt theo token budget
+        prompt_current, prompt_context = build_prompt_context(word_indexes[page_no], rect, context_token_budget)
+        jobs.append({
+            "page": page_no,
+            "ref_page": ref_page_no,
+            "rect": rect,
+            "relocated": relocated,
+            "anchor_score": anchor_score,
+            "annotation_content": ann_data["content"],
+            "ref_text": ann_data["ref_text"],
+            "current_text": current_text,
+            "context_text": context_text,
+            "prompt_current": prompt_current,
+            "prompt_context": prompt_context,
+        })
+
+    # 2a. Rule-based pre-check: note rõ ràng không cần gọi GPT
+    check_results: List[Optional[Dict]] = [None] * len(jobs)
+    if precheck:
+        for idx, job in enumerate(jobs):
+            check_results[idx] = precheck_annotation(
+                job["annotation_content"], job["current_text"], job["context_text"], job["ref_text"]
+            )
+    llm_indices = [idx for idx, r in enumerate(check_results) if r is None]
+    llm_jobs = [jobs[idx] for idx in llm_indices]
+
+    # 2b. Gọi GPT song song cho các note còn lại, kết quả theo đúng thứ tự jobs
+    deadline = time.monotonic() + time_budget if time_budget and time_budget > 0 else None
+    num_batches = None
+    if batch:
+        llm_results, num_batches = _run_batched_checks(
+            llm_jobs, word_indexes, client, model_name, rate_limiter, cache,
+            max_concurrency=max_concurrency, token_budget=batch_token_budget,
+            strong_model=strong_model_name, escalation_confidence=escalation_confidence,
+            stats=stats, deadline=deadline, call_timeout=call_timeout, hedge=hedge,
+        )
+    else:
+        def _check(job: Dict) -> Dict:
+            computed = []
+
+            def _compute() -> Dict:
+                computed.append(True)
+                return check_annotation_routed(
+                    client=client,
+                    annotation_content=job["annotation_content"],
+                    current_text=job["prompt_current"],
+                    context_text=job["prompt_context"],
+                    model=model_name,
+                    strong_model=strong_model_name,
+                    escalation_confidence=escalation_confidence,
+                    rate_limiter=rate_limiter,
+                    stats=stats,
+                    deadline=deadline,
+                    call_timeout=call_timeout,
+                    hedge=hedge,
+                )
+
+            if cache is None:
+                return _compute()
+
+            key = verdict_cache_key(
+                f"{model_name}>{strong_model_name}" if strong_model_name else model_name,
+                PROMPT_TEMPLATE_VERSION,
+                job["annotation_content"],
+                job["prompt_current"],
+                job["prompt_context"],
+            )
+            # Không cache kết quả lỗi (client không có, API lỗi)
+            verdict = cache.get_or_compute(key, _compute, cacheable=lambda r: not r.get("error"))
+            return verdict if computed else _cached_verdict(verdict)
 
-        final_page = final_doc.load_page(i)
-        for ann_data in annotations_by_page[i]:
-            annotation_content = ann_data["content"]
-            rect = ann_data["rect"]
+        llm_results = run_ordered(_check, llm_jobs, max_concurrency=max_concurrency)
 
-            current_text = get_text_around_annotation(final_page, rect, context_size=200)
-            context_text = get_text_around_annotation(final_page, rect, context_size=400)
+    for idx, llm_result in zip(llm_indices, llm_results):
+        check_results[idx] = llm_result
 
-            check_result = check_annotation_with_gpt(
-                client=client,
-                annotation_content=annotation_content,
-                current_text=current_text,
-                context_text=context_text,
-                model=model_name,
-            )
+    if cache is not None:
+        cache.close()
 
-            result_entry = {
-                "page": i + 1,
-                "status": check_result.get("status"),
-                "implemented": check_result.get("implemented"),
-                "reasoning": check_result.get("reasoning", ""),
-                "evidence": check_result.get("evidence", ""),
-                "confidence": check_result.get("confidence", 0.0),
-                "annotation": annotation_content,
-            }
-            results.append(result_entry)
+    tier_stats = stats.summary()
+    for tier, tier_summary in tier_stats.items():
+        print(
+            f"⏱️ {tier} ({tier_summary['model']}): {tier_summary['calls']} appels, "
+            f"p50={tier_summary['latency_p50']:.2f}s p95={tier_summary['latency_p95']:.2f}s "
+            f"p99={tier_summary['latency_p99']:.2f}s, {tier_summary['hedged']} hedged"
+        )
 
-            try:
-                _annotate_status(final_page, rect, annotation_content, check_result)
-            except Exception:
-                # Không làm ngắt luồng nếu annotate lỗi
-                pass
+    # 3. Annotate vào final PDF
+    results: List[Dict] = []
+    for job, check_result in zip(jobs, check_results):
+        annotation_content = job["annotation_content"]
+
+        result_entry = {
+            "page": job["page"] + 1,
+            "ref_page": job["ref_page"] + 1,
+            "relocated": job["relocated"],
+            "anchor_score": job["anchor_score"],
+            "status": check_result.get("status"),
+            "implemented": check_result.get("implemented"),
+            "reasoning": check_result.get("reasoning", ""),
+            "evidence": check_result.get("evidence", ""),
+            "confidence": check_result.get("confidence", 0.0),
+            "annotation": annotation_content,
+            "source": check_result.get("source", "llm"),
+            "model": check_result.get("model"),
+            "prompt_tokens": check_result.get("prompt_tokens", 0),
+        }
+        results.append(result_entry)
+
+        try:
+            final_page = final_doc.load_page(job["page"])
+            _annotate_status(final_page, job["rect"], annotation_content, check_result)
+        except Exception:
+            # Không làm ngắt luồng nếu annotate lỗi
+            pass
 
     final_doc.save(output_path, garbage=4, deflate=True)
-    ref_doc.close()
     final_doc.close()
 
     summary = {
@@ -282,6 +932,17 @@ def compare_mode2(
         "not_implemented": sum(1 for r in results if r["status"] == "not_implemented"),
         "partial": sum(1 for r in results if r["status"] == "partial"),
         "unclear": sum(1 for r in results if r["status"] == "unclear"),
+        "cache": dict(cache.stats) if cache is not None else None,
+        "cache_hits": sum(1 for r in results if r["source"] == "cache"),
+        "batches": num_batches,
+        "prechecked": len(jobs) - len(llm_jobs),
+        "escalated": sum(1 for r in check_results if r.get("escalated")),
+        "tiers": tier_stats,
+        "deadline_exceeded": sum(
+            1 for r in check_results if r.get("error") in ("deadline", "budget_exhausted")
+        ),
+        "relocated": sum(1 for job in jobs if job["relocated"]),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in results),
     }
 
     return {
@@ -297,6 +958,8 @@ __all__ = [
     "extract_popup_annotations",
     "get_text_around_annotation",
     "check_annotation_with_gpt",
+    "build_prompt_context",
+    "check_annotation_routed",
     "get_openai_client",
 ]
 
@@ -3,7 +3,7 @@ Mode 3: So sánh word-by-word giữa 2 PDF và annotate highlight.
 Refactor từ tool_compare_assemblage.py với enhanced logic:
 
 Features:
-- Word-by-word comparison với difflib SequenceMatcher
+- Word-by-word comparison trên token id (token_diff.py: patience + Myers; hoặc difflib SequenceMatcher)
 - 3 loại thay đổi với màu sắc rõ ràng:
   
   🔴 ĐỎ (REPLACED): Text bị THAY ĐỔI
@@ -22,411 +22,731 @@ Features:
 
 from __future__ import annotations
 
-from typing import Dict, List, Tuple
+import json
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterator, List, Tuple
 
 import fitz  # PyMuPDF
+import numpy as np
 
+from page_bands import BAND_MIN_PAGES, BandDetector
+from fuzzy_match import fuzzy_equal
 from pdf_optimizer import smart_preprocess
+from text_moves import MOVE_MAX_GAP, MoveIndex
+from token_diff import diff_opcodes, hierarchical_opcodes
 
 CASE_INSENSITIVE = True
 IGNORE_QUOTES = True
 
+# Diff engine cho word diff: "patience" (token_diff.py: anchor duy nhất + Myers, không autojunk),
+# "hierarchical" (như patience, vùng không còn anchor duy nhất khớp block → line theo hash trước
+# thay vì Myers; nhanh hơn trên trang lặp từ) hoặc "difflib" (SequenceMatcher như bản gốc)
+DIFF_ENGINES = ("patience", "hierarchical", "difflib")
+DIFF_ENGINE = os.getenv("MODE3_DIFF_ENGINE", "patience")
 
-def _normalize_word(word: str) -> str:
-    import unicodedata
-    
-    if CASE_INSENSITIVE:
+# Diff song song theo trang (ProcessPoolExecutor): 1 = tuần tự (mặc định), 0 = os.cpu_count().
+# Mặc định tuần tự: backend Flask chạy threaded, mỗi request song song sẽ tạo 1 pool riêng
+# → chỉ bật (VD: 4) khi biết trước số request đồng thời và số core của máy.
+# Tài liệu ít hơn MODE3_PARALLEL_MIN_PAGES trang luôn chạy tuần tự (chi phí spawn worker).
+DEFAULT_WORKERS = int(os.getenv("MODE3_WORKERS", "1"))
+PARALLEL_MIN_PAGES = int(os.getenv("MODE3_PARALLEL_MIN_PAGES", "8"))
+CHUNKS_PER_WORKER = 4  # mỗi worker nhận vài khoảng trang để cân bằng tải
+
+# Kiểu annotation output: "group" (1 highlight / nhóm words cùng hàng, như bản gốc) hoặc
+# "consolidated" (1 highlight nhiều quads / vùng thay đổi trên các dòng liên tiếp + JSON sidecar)
+ANNOTATION_MODE = os.getenv("MODE3_ANNOTATION_MODE", "group")
+REGION_LINE_GAP = 0.5  # vùng mới nếu khoảng trống dọc > 0.5 × chiều cao dòng (= có dòng không đổi ở giữa)
+
+# Trang "réécrite": tỉ lệ token khớp = 2 × matched / (words Ref + words Final) (như
+# SequenceMatcher.ratio) < ngưỡng → 1 annotation cho cả trang thay vì tô từng word.
+# 0 = tắt (mặc định, tô từng word như bản gốc), VD: 0.2
+REWRITE_THRESHOLD = float(os.getenv("MODE3_REWRITE_THRESHOLD", "0"))
+REWRITE_MIN_WORDS = 20  # trang quá ít words (Ref + Final) không bao giờ bị coi là réécrite
+
+# Text déplacé giữa các trang (text_moves.py): đoạn MISSING / EXTRA tìm thấy ở trang khác
+# (mặc định tắt, bật bằng MODE3_DETECT_MOVES=1)
+DETECT_MOVES = os.getenv("MODE3_DETECT_MOVES", "0") == "1"
+MoveIndexes = Tuple[MoveIndex, MoveIndex]  # (index Ref, index Final)
+
+# Header / footer lặp lại (page_bands.py): bỏ khỏi word diff mọi trang, trừ trang đầu tiên
+# có chúng nếu MODE3_BAND_DIFF_ONCE=1 (thay đổi header / footer vẫn được báo 1 lần / tài liệu).
+# Mặc định tắt (bật bằng MODE3_SKIP_BANDS=1): sửa đổi thật trong footer ở các trang sau bị bỏ qua
+SKIP_BANDS = os.getenv("MODE3_SKIP_BANDS", "0") == "1"
+BAND_DIFF_ONCE = os.getenv("MODE3_BAND_DIFF_ONCE", "1") == "1"
+# Fuzzy pass (fuzzy_match.py): trong mỗi đoạn "replace" của diff, cặp word xóa / thêm khác nhau
+# ≤ MODE3_FUZZY_MAX_DISTANCE glyph (OCR, ligature, soft hyphen) được coi là giống nhau.
+# Word có chữ số hoặc ngắn hơn FUZZY_MIN_LENGTH không bao giờ khớp gần đúng (12,50 ≠ 13,50).
+FUZZY_MATCH = os.getenv("MODE3_FUZZY_MATCH", "0") == "1"
+FUZZY_MAX_DISTANCE = int(os.getenv("MODE3_FUZZY_MAX_DISTANCE", "1"))
+FUZZY_MIN_LENGTH = 4
+FUZZY_LOOKAHEAD = 3  # số word Final xét cho mỗi word Ref (giữ thứ tự, không thử mọi cặp)
+
+PageBands = Tuple[Dict[int, FrozenSet[Tuple[int, int]]], Dict[int, FrozenSet[Tuple[int, int]]]]  # (Ref, Final)
+
+HIGHLIGHT_COLORS = {
+    "red": (1.0, 0.4, 0.4),      # Đỏ - Text bị thay đổi (REPLACED)
+    "yellow": (1.0, 1.0, 0.4),   # Vàng - Text bị xóa (MISSING)
+    "green": (0.5, 1.0, 0.5),    # Xanh lá - Text được thêm (EXTRA)
+    "blue": (0.45, 0.7, 1.0),    # Xanh dương - Text déplacé sang / từ trang khác (MOVED_OUT / MOVED_IN)
+}
+
+
+# === Normalizer: bảng translate + regex compile 1 lần, memo theo token ===
+# Thứ tự xử lý giữ nguyên như bản gốc (lower → xóa quotes → NFKC → ...) để output không đổi.
+
+# Xóa quotes/apostrophes TRƯỚC NFKC để tránh tạo combining chars (VD: "´" → " ́")
+_PRE_NFKC_TABLE = str.maketrans("", "", "'`´")
+
+# Sau NFKC: XÓA mọi loại apostrophe/quote/accent (d'emploi → demploi)
+# và đưa superscript/subscript về dạng thường (PLUS⁽¹⁾ → PLUS(1))
+_QUOTE_CHARS = (
+    "'"         # Normal apostrophe
+    "ʼ"         # U+02BC Modifier letter apostrophe
+    "`´ˊˋ"      # Grave/acute accents, modifier letter acute/grave
+    "ʹ′‵"       # Primes
+    "＇՚Ꞌꞌʻʽ"   # Fullwidth / Armenian apostrophe, saltillo, turned/reversed comma
+    "\u0301\u0300"  # Combining acute / grave accent
+    '"«»„‟〝〞＂'  # Double quotes
+)
+_POST_NFKC_TABLE = str.maketrans(
+    "⁰¹²³⁴⁵⁶⁷⁸⁹⁽⁾⁺⁻⁼₀₁₂₃₄₅₆₇₈₉₍₎₊₋₌",
+    "0123456789()+-=0123456789()+-=",
+    _QUOTE_CHARS,
+)
+
+# XÓA HOÀN TOÀN (số nhỏ) - VD: (1), [2], {12}; GIỮ numbers lớn như 32859
+_SMALL_NUMBER_PATTERNS = (
+    re.compile(r"\([0-9]{1,2}\)"),
+    re.compile(r"\[[0-9]{1,2}\]"),
+    re.compile(r"\{[0-9]{1,2}\}"),
+)
+
+_ZERO_WIDTH_CHARS = frozenset("\u200b\u200c\u200d\ufeff")
+
+
+class _FinalDeleteTable(dict):
+    """
+    Bảng translate bước cuối, tính lazily theo code point: XÓA punctuation (category P),
+    zero-width chars, combining marks (Mn) và spaces; các ký tự khác giữ nguyên.
+    """
+
+    def __missing__(self, code_point: int):
+        char = chr(code_point)
+        category = unicodedata.category(char)
+        if category.startswith("P") or category == "Mn" or char in _ZERO_WIDTH_CHARS or char == " ":
+            value = None
+        else:
+            value = code_point
+        self[code_point] = value
+        return value
+
+
+_FINAL_DELETE_TABLE = _FinalDeleteTable()
+
+NORMALIZE_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_word_cached(word: str, case_insensitive: bool, ignore_quotes: bool) -> str:
+    if case_insensitive:
         word = word.lower()
-    
-    if IGNORE_QUOTES:
-        # XÓA quotes/apostrophes TRƯỚC normalize để tránh tạo combining chars
-        pre_normalize_chars = ["'", "'", "'", "`", "´"]
-        for char in pre_normalize_chars:
-            word = word.replace(char, "")
-        
-        # SAU ĐÓ mới normalize Unicode
-        word = unicodedata.normalize('NFKC', word)
-        # XÓA HẾT TẤT CẢ các loại apostrophe, quotes, accents
-        # Không replace về ' mà XÓA LUÔN để: d'emploi → demploi
-        chars_to_remove = [
-            "'",  # Normal apostrophe
-            "'",  # U+2019 Right single quotation mark
-            "'",  # U+2018 Left single quotation mark  
-            "ʼ",  # U+02BC Modifier letter apostrophe
-            "`",  # U+0060 Grave accent / Backtick
-            "´",  # U+00B4 Acute accent
-            "ˊ",  # U+02CA Modifier letter acute accent
-            "ˋ",  # U+02CB Modifier letter grave accent
-            "ʹ",  # U+02B9 Modifier letter prime
-            "′",  # U+2032 Prime
-            "‵",  # U+2035 Reversed prime
-            "＇", # U+FF07 Fullwidth apostrophe
-            "՚",  # U+055A Armenian apostrophe
-            "Ꞌ",  # U+A78B Latin capital letter saltillo
-            "ꞌ",  # U+A78C Latin small letter saltillo
-            "ʻ",  # U+02BB Modifier letter turned comma
-            "ʽ",  # U+02BD Modifier letter reversed comma
-            "\u0301",  # Combining acute accent
-            "\u0300",  # Combining grave accent
-            '"',  # Normal double quote
-            """,  # U+201C Left double quotation mark
-            """,  # U+201D Right double quotation mark
-            "«",  # Left-pointing double angle quotation mark
-            "»",  # Right-pointing double angle quotation mark
-            "„",  # Double low-9 quotation mark
-            "‟",  # Double high-reversed-9 quotation mark
-            "〝", # U+301D Reversed double prime quotation mark
-            "〞", # U+301E Double prime quotation mark
-            "＂", # U+FF02 Fullwidth quotation mark
-        ]
-        
-        # XÓA tất cả
-        for char in chars_to_remove:
-            word = word.replace(char, "")
-        
-        # NORMALIZE SUPERSCRIPT/SUBSCRIPT về dạng thường
-        # VD: "PLUS⁽¹⁾" → "PLUS(1)"
-        superscript_map = {
-            '⁰': '0', '¹': '1', '²': '2', '³': '3', '⁴': '4',
-            '⁵': '5', '⁶': '6', '⁷': '7', '⁸': '8', '⁹': '9',
-            '⁽': '(', '⁾': ')', '⁺': '+', '⁻': '-', '⁼': '=',
-        }
-        subscript_map = {
-            '₀': '0', '₁': '1', '₂': '2', '₃': '3', '₄': '4',
-            '₅': '5', '₆': '6', '₇': '7', '₈': '8', '₉': '9',
-            '₍': '(', '₎': ')', '₊': '+', '₋': '-', '₌': '=',
-        }
-        
-        for sup, normal in superscript_map.items():
-            word = word.replace(sup, normal)
-        for sub, normal in subscript_map.items():
-            word = word.replace(sub, normal)
-        
-        # XÓA HOÀN TOÀN patterns (số nhỏ) - VD: (1), (2), (12) để ignore trong comparison
-        # Nhưng GIỮ numbers lớn như 32859, 61545
-        # Dùng regex để tìm và xóa: (1-2 chữ số)
-        import re
-        word = re.sub(r'\([0-9]{1,2}\)', '', word)  # Xóa (1), (2), (12), etc.
-        word = re.sub(r'\[[0-9]{1,2}\]', '', word)  # Xóa [1], [2], etc.
-        word = re.sub(r'\{[0-9]{1,2}\}', '', word)  # Xóa {1}, {2}, etc.
-        
-        # XÓA TẤT CẢ PUNCTUATION còn lại (dấu chấm, dấu phẩy, v.v...)
-        # Category 'P' = Punctuation: . , ; : ! ? - ...
-        word = ''.join(c for c in word if not unicodedata.category(c).startswith('P'))
-        
-        # Remove zero-width characters
-        word = word.replace("\u200b", "")  # Zero-width space
-        word = word.replace("\u200c", "")  # Zero-width non-joiner
-        word = word.replace("\u200d", "")  # Zero-width joiner
-        word = word.replace("\ufeff", "")  # Zero-width no-break space
-        
-        # Remove bất kỳ combining marks còn lại
-        word = ''.join(c for c in word if unicodedata.category(c) != 'Mn')
-        
-        # XÓA HẾT SPACES
-        # VD: "PLUS(1)" → "PLUS 1" → "PLUS1"
-        #     "PLUS⁽¹⁾" → "PLUS(1)" → "PLUS 1" → "PLUS1"
-        word = word.replace(' ', '').strip()
-    
+
+    if ignore_quotes:
+        word = unicodedata.normalize("NFKC", word.translate(_PRE_NFKC_TABLE))
+        word = word.translate(_POST_NFKC_TABLE)
+        for pattern in _SMALL_NUMBER_PATTERNS:
+            word = pattern.sub("", word)
+        # XÓA punctuation, zero-width, combining marks, spaces ("PLUS(1)" → "PLUS1")
+        word = word.translate(_FINAL_DELETE_TABLE).strip()
+
     return word
 
 
-def extract_page_words_with_boxes(pdf_path: str) -> List[Dict]:
+def _normalize_word(word: str) -> str:
+    return _normalize_word_cached(word, CASE_INSENSITIVE, IGNORE_QUOTES)
+
+
+class TokenTable:
+    """
+    Intern normalized key → id (int) cho 1 lần so sánh.
+    Mỗi word chỉ normalize 1 lần khi extract; diff và các bước sau so sánh id / key đã có sẵn.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+
+    def intern(self, key: str) -> int:
+        token = self._ids.get(key)
+        if token is None:
+            token = len(self.keys)
+            self._ids[key] = token
+            self.keys.append(key)
+        return token
+
+    def lookup(self, key: str) -> int | None:
+        """Id của key nếu đã intern, không thêm mới."""
+        return self._ids.get(key)
+
+
+def make_word(text: str, rect: fitz.Rect, tokens: TokenTable, block: int = 0, line: int = 0) -> Dict:
+    """
+    Word record: text gốc, rect, normalized key ("norm"), id đã intern ("token")
+    và số block / line của get_text("words") (dùng cho diff hierarchical).
+    """
+    norm = _normalize_word(text)
+    return {
+        "text": text,
+        "rect": rect,
+        "highlight_color": None,
+        "norm": norm,
+        "token": tokens.intern(norm),
+        "block": block,
+        "line": line,
+    }
+
+
+def _ensure_word_keys(words_data: List[Dict], tokens: TokenTable, reintern: bool = False) -> None:
+    """
+    Bổ sung norm/token cho words được tạo bên ngoài (không qua make_word).
+    reintern: gán lại token từ norm đã có (words đến từ các bảng intern khác nhau).
+    """
+    for w in words_data:
+        if "norm" not in w:
+            w["norm"] = _normalize_word(w["text"])
+            w["token"] = tokens.intern(w["norm"])
+        elif reintern or "token" not in w:
+            w["token"] = tokens.intern(w["norm"])
+
+
+def _page_words(page: fitz.Page, tokens: TokenTable) -> List[Dict]:
+    """Word records của 1 trang theo thứ tự get_text("words")."""
+    return [
+        make_word(text, fitz.Rect(x0, y0, x1, y1), tokens, block_no, line_no)
+        for x0, y0, x1, y1, text, block_no, line_no, *_ in page.get_text("words")
+    ]
+
+
+def extract_page_words_with_boxes(pdf_path: str, tokens: TokenTable | None = None) -> List[Dict]:
+    tokens = tokens if tokens is not None else TokenTable()
     doc = fitz.open(pdf_path)
     pages: List[Dict] = []
     for page_index in range(doc.page_count):
-        page = doc.load_page(page_index)
-        words_raw = page.get_text("words")
-        words = []
-        for x0, y0, x1, y1, text, *_ in words_raw:
-            words.append(
-                {"text": text, "rect": fitz.Rect(x0, y0, x1, y1), "highlight_color": None}
-            )
-        pages.append({"page": page_index, "words": words})
+        pages.append({"page": page_index, "words": _page_words(doc.load_page(page_index), tokens)})
     doc.close()
     return pages
 
 
-def preprocess_merge_parentheses(words_data: List[Dict]) -> List[Dict]:
+_PARENTHESIS_NUMBER_RE = re.compile(r'^[\(⁽][0-9⁰¹²³⁴⁵⁶⁷⁸⁹]{1,2}[\)⁾]$')
+_PARENTHESIS_OPEN = "(⁽"
+
+# Flags của bảng words (1 byte / word)
+FLAG_MISSING = 1  # Ref: text bị xóa → VÀNG
+FLAG_EXTRA = 2    # Final: text được thêm → XANH
+FLAG_MOVED = 4    # kết hợp với MISSING / EXTRA: text có ở trang khác → XANH DƯƠNG
+_FLAG_HIGHLIGHT = {
+    0: (None, None),
+    FLAG_MISSING: ("yellow", "MISSING"),
+    FLAG_EXTRA: ("green", "EXTRA"),
+    FLAG_MISSING | FLAG_MOVED: ("blue", "MOVED_OUT"),
+    FLAG_EXTRA | FLAG_MOVED: ("blue", "MOVED_IN"),
+}
+
+
+class PageWordTable:
     """
-    Pre-process: Merge patterns như "PLUS" + "(1)" thành "PLUS(1)" TRƯỚC KHI normalize.
-    
-    VD: ["PLUS", "(1)"] → ["PLUS(1)"]
-        ["PLUS", "⁽¹⁾"] → ["PLUS⁽¹⁾"]
+    Words của 1 trang dạng cột (thay cho list dict + fitz.Rect):
+    - rects: float64 (n, 4) = x0, y0, x1, y1
+    - tokens: int32 id đã intern (TokenTable), blocks / lines: int32 (get_text("words"))
+    - flags: uint8 (FLAG_MISSING / FLAG_EXTRA [| FLAG_MOVED]), 0 = không highlight
+    - moved_pages: int32, trang (1-based) ở tài liệu kia chứa đoạn déplacé, 0 = không
+    - texts: text gốc (list str, cần cho nội dung annotation)
+    - source: index word gốc của từng dòng, -1 = word ghép "PLUS" + "(1)"
     """
-    import re
-    
-    if not words_data:
-        return words_data
-    
-    merged = []
-    i = 0
-    
-    while i < len(words_data):
-        current = words_data[i]
-        
-        # Check nếu word tiếp theo là pattern: (số) hoặc ⁽số⁾
-        if i + 1 < len(words_data):
-            next_word = words_data[i + 1]
-            next_text = next_word["text"]
-            
+
+    def __init__(self, texts: List[str], rects, tokens, blocks, lines, source=None):
+        self.texts = texts
+        self.rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        self.tokens = np.asarray(tokens, dtype=np.int32)
+        self.blocks = np.asarray(blocks, dtype=np.int32)
+        self.lines = np.asarray(lines, dtype=np.int32)
+        self.flags = np.zeros(len(texts), dtype=np.uint8)
+        self.moved_pages = np.zeros(len(texts), dtype=np.int32)
+        self.source = np.arange(len(texts)) if source is None else np.asarray(source, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def from_page(
+        cls, page: fitz.Page, tokens: TokenTable, exclude_lines: FrozenSet[Tuple[int, int]] | None = None
+    ) -> "PageWordTable":
+        """exclude_lines: các dòng (block_no, line_no) bỏ qua, không normalize (header / footer)."""
+        words_raw = page.get_text("words")
+        if exclude_lines:
+            words_raw = [w for w in words_raw if (w[5], w[6]) not in exclude_lines]
+        texts = [w[4] for w in words_raw]
+        return cls(
+            texts,
+            [w[:4] for w in words_raw],
+            [tokens.intern(_normalize_word(text)) for text in texts],
+            [w[5] for w in words_raw],
+            [w[6] for w in words_raw],
+        )
+
+    @classmethod
+    def from_words(cls, words_data: List[Dict]) -> "PageWordTable":
+        """Bảng từ word records (make_word, đã có "token")."""
+        return cls(
+            [w["text"] for w in words_data],
+            [tuple(w["rect"]) for w in words_data],
+            [w["token"] for w in words_data],
+            [w.get("block", 0) for w in words_data],
+            [w.get("line", 0) for w in words_data],
+        )
+
+    def merge_parentheses(self, tokens: TokenTable) -> "PageWordTable":
+        """
+        Pre-process: Merge patterns như "PLUS" + "(1)" thành "PLUS(1)" TRƯỚC KHI so sánh.
+        Word đã merge được normalize lại (norm/token) từ text ghép.
+
+        VD: ["PLUS", "(1)"] → ["PLUS(1)"]
+            ["PLUS", "⁽¹⁾"] → ["PLUS⁽¹⁾"]
+
+        Ghép tham lam từ trái sang phải (1 word chỉ ghép 1 lần). Không có gì để ghép → trả về self.
+        """
+        merge_at: List[int] = []
+        next_free = 0
+        for j, text in enumerate(self.texts):
             # Pattern: (1), (2), ⁽¹⁾, ⁽²⁾, etc. (chỉ có số 1-2 chữ số trong ngoặc)
-            if re.match(r'^[\(⁽][0-9⁰¹²³⁴⁵⁶⁷⁸⁹]{1,2}[\)⁾]$', next_text):
-                # MERGE: "PLUS" + "(1)" → "PLUS(1)"
-                merged_text = current["text"] + next_text
-                merged_rect = fitz.Rect(current["rect"]) | fitz.Rect(next_word["rect"])
-                
-                merged.append({
-                    "text": merged_text,
-                    "rect": merged_rect,
-                    "highlight_color": None
-                })
-                i += 2  # Skip cả 2 words
-                continue
-        
-        # Không merge, giữ nguyên
-        merged.append(current)
-        i += 1
-    
-    return merged
+            if j >= 1 and j - 1 >= next_free and text[:1] in _PARENTHESIS_OPEN and _PARENTHESIS_NUMBER_RE.match(text):
+                merge_at.append(j - 1)
+                next_free = j + 1
+        if not merge_at:
+            return self
 
+        heads = np.asarray(merge_at)
+        keep = np.ones(len(self), dtype=bool)
+        keep[heads + 1] = False
 
-def align_words_assemblage(ref_words_data: List[Dict], final_words_data: List[Dict]):
+        rects = self.rects.copy()
+        token_ids = self.tokens.copy()
+        source = self.source.copy()
+        texts = list(self.texts)
+        for i in merge_at:
+            texts[i] = self.texts[i] + self.texts[i + 1]
+            rects[i] = tuple(fitz.Rect(self.rects[i].tolist()) | fitz.Rect(self.rects[i + 1].tolist()))
+            token_ids[i] = tokens.intern(_normalize_word(texts[i]))
+            source[i] = -1
+
+        return PageWordTable(
+            [text for text, kept in zip(texts, keep.tolist()) if kept],
+            rects[keep], token_ids[keep], self.blocks[keep], self.lines[keep], source[keep],
+        )
+
+    def scatter_flags(self, merged: "PageWordTable") -> None:
+        """
+        Chép flags từ bảng đã merge_parentheses về bảng gốc.
+        Word ghép chỉ dùng để so khớp, không được highlight (như bản gốc dùng list dict).
+        """
+        if merged is self:
+            return
+        kept = merged.source >= 0
+        self.flags[:] = 0
+        self.flags[merged.source[kept]] = merged.flags[kept]
+        self.moved_pages[:] = 0
+        self.moved_pages[merged.source[kept]] = merged.moved_pages[kept]
+
+    def highlight_groups(self) -> List[Dict]:
+        """Group highlight liền kề cùng hàng / cùng màu (xem merge_adjacent_words)."""
+        highlighted = np.flatnonzero(self.flags)
+        if not highlighted.size:
+            return []
+        # Sort theo y (top), rồi x (left); lexsort ổn định như list.sort
+        order = highlighted[np.lexsort((self.rects[highlighted, 0], self.rects[highlighted, 1]))]
+        entries = []
+        for i, rect, flag, moved_page in zip(
+            order.tolist(), self.rects[order].tolist(), self.flags[order].tolist(), self.moved_pages[order].tolist()
+        ):
+            color, change_type = _FLAG_HIGHLIGHT[flag]
+            entries.append((fitz.Rect(rect), color, change_type, self.texts[i], None, None, moved_page or None))
+        return _merge_groups(entries)
+
+    def mark_moves(self, keys: List[str], move_index: MoveIndex, own_index: MoveIndex, page_index: int) -> int:
+        """
+        Các đoạn highlight (cùng flag, theo thứ tự đọc) tìm thấy ở 1 trang khác của tài liệu
+        kia (move_index) → thêm FLAG_MOVED + moved_pages. Trả về số đoạn déplacé.
+        Trang đó phải chưa có đoạn này trong chính tài liệu của bảng (own_index), nếu không
+        đoạn chỉ bị xóa / thêm ở trang này, không phải déplacé.
+        Diff hay khớp tình cờ vài word phổ biến giữa đoạn déplacé và text của trang, nên
+        1 đoạn được nối qua các khoảng ≤ MOVE_MAX_GAP word không highlight (chỉ để tra index).
+        keys: TokenTable.keys của bảng (token id → normalized text).
+        """
+        highlighted = np.flatnonzero(self.flags)
+        if not highlighted.size:
+            return 0
+        breaks = np.flatnonzero(
+            (np.diff(highlighted) > MOVE_MAX_GAP + 1) | (np.diff(self.flags[highlighted]) != 0)
+        ) + 1
+        moved = 0
+        for span in np.split(highlighted, breaks):
+            norms = [keys[token] for token in self.tokens[span[0]:span[-1] + 1].tolist()]
+            hit = move_index.find(norms, exclude_page=page_index, counterpart=own_index)
+            if hit is not None:
+                self.flags[span] |= FLAG_MOVED
+                self.moved_pages[span] = hit[0] + 1
+                moved += 1
+        return moved
+
+    def text_bbox(self) -> Tuple[float, float, float, float] | None:
+        """Bbox của toàn bộ words trên trang (None nếu trang không có word)."""
+        if not len(self):
+            return None
+        return (
+            float(self.rects[:, 0].min()), float(self.rects[:, 1].min()),
+            float(self.rects[:, 2].max()), float(self.rects[:, 3].max()),
+        )
+
+
+def _mark_opcodes(ref_table: PageWordTable, final_table: PageWordTable, opcodes) -> None:
+    """
+    - delete  → MISSING (VÀNG) trên Ref
+    - insert  → EXTRA (XANH) trên Final
+    - replace → DELETE + INSERT (không dùng ĐỎ vì gây nhiều false positives)
+    """
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag in ("delete", "replace"):
+            ref_table.flags[i1:i2] = FLAG_MISSING
+        if tag in ("insert", "replace"):
+            final_table.flags[j1:j2] = FLAG_EXTRA
+
+
+def _quick_match_ratio(ref_tokens: np.ndarray, final_tokens: np.ndarray) -> float:
+    """
+    Cận trên của tỉ lệ khớp (như SequenceMatcher.quick_ratio): giao 2 multiset token,
+    không cần diff. Dưới ngưỡng → chắc chắn trang réécrite, bỏ qua diff.
+    """
+    total = len(ref_tokens) + len(final_tokens)
+    if not total:
+        return 1.0
+    ref_values, ref_counts = np.unique(ref_tokens, return_counts=True)
+    final_values, final_counts = np.unique(final_tokens, return_counts=True)
+    _, ref_idx, final_idx = np.intersect1d(ref_values, final_values, assume_unique=True, return_indices=True)
+    return 2.0 * int(np.minimum(ref_counts[ref_idx], final_counts[final_idx]).sum()) / total
+
+
+def _fuzzy_candidate(ref_key: str, final_key: str, max_distance: int) -> bool:
+    if len(ref_key) < FUZZY_MIN_LENGTH or len(final_key) < FUZZY_MIN_LENGTH:
+        return False
+    if any(char.isdigit() for char in ref_key + final_key):
+        return False
+    return fuzzy_equal(ref_key, final_key, max_distance)
+
+
+def _pair_fuzzy_replacements(
+    ref_table: PageWordTable, final_table: PageWordTable, opcodes, keys: List[str], max_distance: int
+) -> int:
+    """
+    Trong mỗi đoạn replace: ghép theo thứ tự mỗi word Ref với word Final đầu tiên (trong
+    FUZZY_LOOKAHEAD words kế tiếp) gần giống nó → bỏ highlight cả 2. Trả về số cặp đã ghép.
+    Kết quả được nhớ theo cặp token id (cùng cặp word lặp lại chỉ tính 1 lần).
+    """
+    similar_cache: Dict[Tuple[int, int], bool] = {}
+    ref_ids = ref_table.tokens
+    final_ids = final_table.tokens
+    pairs = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "replace":
+            continue
+        j = j1
+        for i in range(i1, i2):
+            if j >= j2:
+                break
+            ref_token = int(ref_ids[i])
+            for candidate in range(j, min(j + FUZZY_LOOKAHEAD, j2)):
+                pair = (ref_token, int(final_ids[candidate]))
+                similar = similar_cache.get(pair)
+                if similar is None:
+                    similar = similar_cache[pair] = _fuzzy_candidate(keys[pair[0]], keys[pair[1]], max_distance)
+                if similar:
+                    ref_table.flags[i] = 0
+                    final_table.flags[candidate] = 0
+                    pairs += 1
+                    j = candidate + 1
+                    break
+    return pairs
+
+
+def align_word_tables(
+    ref_table: PageWordTable,
+    final_table: PageWordTable,
+    tokens: TokenTable,
+    rewrite_threshold: float = 0.0,
+    move_indexes: MoveIndexes | None = None,
+    page_index: int = 0,
+    fuzzy_distance: int | None = None,
+    diff_engine: str | None = None,
+) -> Dict:
+    """
+    So sánh word-by-word 2 bảng (cùng TokenTable), ghi kết quả vào flags của 2 bảng:
+    MISSING (VÀNG) trên Ref, EXTRA (XANH) trên Final, rồi bỏ highlight text có ở cả 2 PDFs.
+
+    rewrite_threshold > 0: nếu tỉ lệ token khớp < ngưỡng thì trang là "réécrite", không
+    gán flag nào. Cận trên (_quick_match_ratio) đã dưới ngưỡng → dừng trước khi diff.
+    move_indexes: (index Ref, index Final) của text_moves.MoveIndex. Đoạn xóa / thêm của
+    diff được tra ở tài liệu kia (trừ trang page_index) TRƯỚC khi lọc text chung, đoạn
+    déplacé giữ nguyên highlight (XANH DƯƠNG).
+    fuzzy_distance: > 0 → cặp word xóa / thêm gần giống nhau được coi là giống (xem
+    _pair_fuzzy_replacements). None → MODE3_FUZZY_MAX_DISTANCE nếu MODE3_FUZZY_MATCH=1, ngược lại 0.
+    diff_engine: 1 trong DIFF_ENGINES (None → MODE3_DIFF_ENGINE).
+    Trả về {"matched_ratio", "rewritten", "moved_spans", "fuzzy_pairs"}
+    (matched_ratio là cận trên nếu dừng sớm, không tính các cặp fuzzy).
+    """
+    from difflib import SequenceMatcher
+
+    # PRE-PROCESS: Merge "PLUS" + "(1)" → "PLUS(1)"
+    ref_merged = ref_table.merge_parentheses(tokens)
+    final_merged = final_table.merge_parentheses(tokens)
+
+    total_words = len(ref_merged) + len(final_merged)
+    check_rewrite = rewrite_threshold > 0 and total_words >= REWRITE_MIN_WORDS
+    if check_rewrite:
+        quick_ratio = _quick_match_ratio(ref_merged.tokens, final_merged.tokens)
+        if quick_ratio < rewrite_threshold:
+            return {"matched_ratio": quick_ratio, "rewritten": True, "moved_spans": 0, "fuzzy_pairs": 0}
+
+    # So sánh theo token id (normalized key đã tính lúc extract)
+    ref_ids = ref_merged.tokens.tolist()
+    final_ids = final_merged.tokens.tolist()
+
+    diff_engine = diff_engine or DIFF_ENGINE
+    if diff_engine == "difflib":
+        opcodes = list(SequenceMatcher(None, ref_ids, final_ids).get_opcodes())
+    elif diff_engine == "hierarchical":
+        opcodes = hierarchical_opcodes(
+            ref_ids, list(zip(ref_merged.blocks.tolist(), ref_merged.lines.tolist())),
+            final_ids, list(zip(final_merged.blocks.tolist(), final_merged.lines.tolist())),
+        )
+    else:
+        opcodes = diff_opcodes(ref_ids, final_ids)
+
+    matched = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal")
+    matched_ratio = 2.0 * matched / total_words if total_words else 1.0
+    if check_rewrite and matched_ratio < rewrite_threshold:
+        return {"matched_ratio": matched_ratio, "rewritten": True, "moved_spans": 0, "fuzzy_pairs": 0}
+
+    _mark_opcodes(ref_merged, final_merged, opcodes)
+
+    if fuzzy_distance is None:
+        fuzzy_distance = FUZZY_MAX_DISTANCE if FUZZY_MATCH else 0
+    fuzzy_pairs = 0
+    if fuzzy_distance > 0:
+        fuzzy_pairs = _pair_fuzzy_replacements(ref_merged, final_merged, opcodes, tokens.keys, fuzzy_distance)
+
+    moved_spans = 0
+    if move_indexes is not None:
+        ref_index, final_index = move_indexes
+        moved_spans = (
+            ref_merged.mark_moves(tokens.keys, final_index, ref_index, page_index)
+            + final_merged.mark_moves(tokens.keys, ref_index, final_index, page_index)
+        )
+
+    # POST-PROCESSING: Loại bỏ highlights cho words có text GIỐNG NHAU
+    # Mục đích: Tránh tô màu cho '32859' khi nó có ở cả 2 PDF
+    remove_same_text_highlights(ref_merged, final_merged, tokens)
+
+    ref_table.scatter_flags(ref_merged)
+    final_table.scatter_flags(final_merged)
+    return {
+        "matched_ratio": matched_ratio,
+        "rewritten": False,
+        "moved_spans": moved_spans,
+        "fuzzy_pairs": fuzzy_pairs,
+    }
+
+
+def align_words_assemblage(
+    ref_words_data: List[Dict],
+    final_words_data: List[Dict],
+    tokens: TokenTable | None = None,
+):
     """
     So sánh word-by-word với 3 loại thay đổi:
-    
+
     1. REPLACED (ĐỎ): Text bị THAY ĐỔI (cùng vị trí nhưng khác nội dung)
        - Tô ĐỎ trên CẢ 2 PDF (Ref và Final)
-    
+
     2. MISSING (VÀNG): Text có trong Reference nhưng KHÔNG có trong Final
        - Tô VÀNG trên PDF Reference
-    
+
     3. EXTRA (XANH): Text có trong Final nhưng KHÔNG có trong Reference
        - Tô XANH trên PDF Final
-       
+
     POST-PROCESSING: Loại bỏ highlight nếu text giống nhau ở cả 2 PDFs
-    """
-    from difflib import SequenceMatcher
 
-    # PRE-PROCESS: Merge "PLUS" + "(1)" → "PLUS(1)"
-    ref_words_data = preprocess_merge_parentheses(ref_words_data)
-    final_words_data = preprocess_merge_parentheses(final_words_data)
+    Bản cho list word records (make_word): chạy align_word_tables rồi ghi
+    highlight_color / change_type lại vào từng dict.
 
-    # Normalize for comparison
-    ref_norm = [_normalize_word(w["text"]) for w in ref_words_data]
-    final_norm = [_normalize_word(w["text"]) for w in final_words_data]
+    tokens: bảng intern đã dùng khi extract CẢ 2 list words. Không truyền → token id
+    được intern lại từ norm vào 1 bảng mới (norm không bị tính lại).
+    """
+    reintern = tokens is None
+    tokens = tokens if tokens is not None else TokenTable()
+    _ensure_word_keys(ref_words_data, tokens, reintern)
+    _ensure_word_keys(final_words_data, tokens, reintern)
 
-    s = SequenceMatcher(None, ref_norm, final_norm)
-    opcodes = list(s.get_opcodes())
-    
-    # DISABLE REPLACE MERGE
-    # Chỉ giữ DELETE (MISSING - màu vàng) và INSERT (EXTRA - màu xanh)
-    # Không merge thành REPLACE (màu đỏ) vì gây nhiều false positives
-    merged_opcodes = opcodes
-    
-    # Process opcodes
-    idx1_current = 0
-    idx2_current = 0
-
-    for tag, i1, i2, j1, j2 in merged_opcodes:
-        if tag == "equal":
-            # Skip - text giống nhau, không cần highlight
-            idx1_current += i2 - i1
-            idx2_current += j2 - j1
-
-        elif tag == "delete":
-            # MISSING TEXT: Text chỉ có trong Reference
-            # Tô VÀNG trên Reference
-            for k in range(i2 - i1):
-                ref_words_data[idx1_current + k]["highlight_color"] = "yellow"
-                ref_words_data[idx1_current + k]["change_type"] = "MISSING"
-            idx1_current += i2 - i1
-
-        elif tag == "insert":
-            # EXTRA TEXT: Text chỉ có trong Final
-            # Tô XANH trên Final
-            for k in range(j2 - j1):
-                final_words_data[idx2_current + k]["highlight_color"] = "green"
-                final_words_data[idx2_current + k]["change_type"] = "EXTRA"
-            idx2_current += j2 - j1
-
-        elif tag == "replace":
-            # TREAT REPLACE AS DELETE + INSERT
-            # Phần bị xóa: Tô VÀNG trên Ref
-            for k in range(i2 - i1):
-                ref_words_data[idx1_current + k]["highlight_color"] = "yellow"
-                ref_words_data[idx1_current + k]["change_type"] = "MISSING"
-            
-            # Phần được thêm: Tô XANH trên Final
-            for k in range(j2 - j1):
-                final_words_data[idx2_current + k]["highlight_color"] = "green"
-                final_words_data[idx2_current + k]["change_type"] = "EXTRA"
-
-            idx1_current += i2 - i1
-            idx2_current += j2 - j1
+    ref_table = PageWordTable.from_words(ref_words_data)
+    final_table = PageWordTable.from_words(final_words_data)
+    align_word_tables(ref_table, final_table, tokens)
 
-    # POST-PROCESSING: Loại bỏ highlights cho words có text GIỐNG NHAU
-    # Mục đích: Tránh tô màu cho '32859' khi nó có ở cả 2 PDF
-    remove_same_text_highlights(ref_words_data, final_words_data)
+    for words_data, table in ((ref_words_data, ref_table), (final_words_data, final_table)):
+        for w, flag in zip(words_data, table.flags.tolist()):
+            w["highlight_color"], w["change_type"] = _FLAG_HIGHLIGHT[flag]
 
     return ref_words_data, final_words_data
 
 
-def remove_same_text_highlights(ref_words_data: List[Dict], final_words_data: List[Dict]):
+def _suppressible(flags: np.ndarray) -> np.ndarray:
+    """Words đang highlight và không thuộc đoạn déplacé (đoạn déplacé giữ nguyên highlight)."""
+    return (flags != 0) & ((flags & FLAG_MOVED) == 0)
+
+
+def _clear_pairs(table: PageWordTable, keys: List[str], common_texts: set) -> None:
+    """Bỏ highlight 2 words liên tiếp nếu concat của chúng nằm trong common_texts."""
+    flags = table.flags
+    suppressible = _suppressible(flags)
+    token_ids = table.tokens
+    for i in np.flatnonzero(suppressible[:-1] & suppressible[1:]).tolist():
+        # Xét tuần tự: cặp trước có thể vừa bỏ highlight word i
+        if flags[i] and flags[i + 1] and keys[token_ids[i]] + keys[token_ids[i + 1]] in common_texts:
+            flags[i] = 0
+            flags[i + 1] = 0
+
+
+def _norm_set(table: PageWordTable, keys: List[str]) -> set:
+    """Normalized texts của mọi words + concat của các cặp words liên tiếp đang highlight."""
+    norms = {keys[token] for token in np.unique(table.tokens).tolist()}
+    highlighted = table.flags != 0
+    token_ids = table.tokens
+    for i in np.flatnonzero(highlighted[:-1] & highlighted[1:]).tolist():
+        norms.add(keys[token_ids[i]] + keys[token_ids[i + 1]])
+    norms.discard("")
+    return norms
+
+
+def remove_same_text_highlights(ref_table: PageWordTable, final_table: PageWordTable, tokens: TokenTable):
     """
     Loại bỏ highlights cho các words có text giống nhau trong cả 2 PDFs.
-    
+
     Logic:
     - Thu thập TẤT CẢ normalized texts từ cả 2 PDFs (ALL words, không chỉ highlighted)
     - Tìm common texts (texts xuất hiện ở CẢ 2 PDFs)
     - Nếu 1 highlighted word nằm trong common texts → XÓA highlight
-    
+
     Ví dụ: '0,00' xuất hiện nhiều lần ở cả 2 PDF → không tô màu
             '32859' có ở cả Ref và Final → không tô màu
+
+    Word đơn so theo token id (np.isin); chỉ các cặp words liên tiếp cùng highlight
+    mới phải ghép chuỗi.
     """
-    # Thu thập TẤT CẢ normalized texts từ CẢ 2 PDFs (không phân biệt highlighted hay không)
-    all_ref_norm_set = set()
-    all_final_norm_set = set()
-    
-    for w in ref_words_data:
-        norm_text = _normalize_word(w["text"])
-        if norm_text:  # Chỉ add nếu không rỗng
-            all_ref_norm_set.add(norm_text)
-    
-    for w in final_words_data:
-        norm_text = _normalize_word(w["text"])
-        if norm_text:
-            all_final_norm_set.add(norm_text)
-    
-    # Thu thập concatenated versions của HIGHLIGHTED consecutive words
-    # VD: ["PLUS", "(1)"] highlighted → cũng add "plus" vào check
-    for i in range(len(ref_words_data) - 1):
-        if ref_words_data[i].get("highlight_color") and ref_words_data[i+1].get("highlight_color"):
-            concat = _normalize_word(ref_words_data[i]["text"]) + _normalize_word(ref_words_data[i+1]["text"])
-            if concat:
-                all_ref_norm_set.add(concat)
-    
-    for i in range(len(final_words_data) - 1):
-        if final_words_data[i].get("highlight_color") and final_words_data[i+1].get("highlight_color"):
-            concat = _normalize_word(final_words_data[i]["text"]) + _normalize_word(final_words_data[i+1]["text"])
-            if concat:
-                all_final_norm_set.add(concat)
-    
-    # Tìm COMMON texts: texts xuất hiện ở CẢ 2 PDFs
-    common_texts = all_ref_norm_set & all_final_norm_set
-    
+    keys = tokens.keys
+
+    # Texts của mỗi PDF, kèm concatenated versions của HIGHLIGHTED consecutive words
+    # VD: ["PLUS", "(1)"] highlighted → cũng add "plus1" vào check
+    common_texts = _norm_set(ref_table, keys) & _norm_set(final_table, keys)
     if not common_texts:
         return
-    
-    # Loại bỏ highlight cho các words có normalized text nằm trong common_texts
-    for w in ref_words_data:
-        if w.get("highlight_color"):
-            norm_text = _normalize_word(w["text"])
-            if norm_text and norm_text in common_texts:
-                w["highlight_color"] = None
-                w["change_type"] = None
-    
-    for w in final_words_data:
-        if w.get("highlight_color"):
-            norm_text = _normalize_word(w["text"])
-            if norm_text and norm_text in common_texts:
-                w["highlight_color"] = None
-                w["change_type"] = None
-    
+
+    common_ids = [token for token in map(tokens.lookup, common_texts) if token is not None]
+    for table in (ref_table, final_table):
+        # Loại bỏ highlight cho các words có normalized text nằm trong common_texts
+        table.flags[_suppressible(table.flags) & np.isin(table.tokens, common_ids)] = 0
+
     # Check consecutive pairs: nếu concat của 2 words liên tiếp match với common_texts
-    for i in range(len(ref_words_data) - 1):
-        w1, w2 = ref_words_data[i], ref_words_data[i+1]
-        if w1.get("highlight_color") and w2.get("highlight_color"):
-            concat = _normalize_word(w1["text"]) + _normalize_word(w2["text"])
-            if concat in common_texts:
-                w1["highlight_color"] = None
-                w1["change_type"] = None
-                w2["highlight_color"] = None
-                w2["change_type"] = None
-    
-    for i in range(len(final_words_data) - 1):
-        w1, w2 = final_words_data[i], final_words_data[i+1]
-        if w1.get("highlight_color") and w2.get("highlight_color"):
-            concat = _normalize_word(w1["text"]) + _normalize_word(w2["text"])
-            if concat in common_texts:
-                w1["highlight_color"] = None
-                w1["change_type"] = None
-                w2["highlight_color"] = None
-                w2["change_type"] = None
+    _clear_pairs(ref_table, keys, common_texts)
+    _clear_pairs(final_table, keys, common_texts)
 
 
-def merge_adjacent_words(words_data: List[Dict]) -> List[Dict]:
+def _merge_groups(entries) -> List[Dict]:
     """
-    Gộp các words liền kề cùng hàng và cùng màu thành một annotation dài ngang.
-    
-    Args:
-        words_data: Danh sách words với rect, highlight_color, change_type
-    
-    Returns:
-        Danh sách merged annotations (mỗi item là một group gộp)
+    entries: (rect, highlight_color, change_type, text, replaced_with, replaced_from, moved_page)
+    đã sort theo thứ tự đọc. Gộp liền kề cùng hàng, cùng màu, cùng loại (và cùng trang déplacé).
     """
-    # Chỉ lấy các words có highlight
-    highlighted_words = [w for w in words_data if w.get("highlight_color")]
-    
-    if not highlighted_words:
-        return []
-    
-    # Sort theo y (top), rồi x (left) để xử lý theo thứ tự đọc
-    highlighted_words.sort(key=lambda w: (w["rect"].y0, w["rect"].x0))
-    
     merged_groups = []
     current_group = None
-    
+
     VERTICAL_THRESHOLD = 5    # pixels - cùng hàng nếu y chênh lệch < 5px
     HORIZONTAL_GAP = 20       # pixels - merge nếu khoảng cách ngang < 20px
-    
-    for word in highlighted_words:
-        if current_group is None:
-            # Bắt đầu group mới
-            current_group = {
-                "rect": fitz.Rect(word["rect"]),
-                "highlight_color": word["highlight_color"],
-                "change_type": word.get("change_type"),
-                "texts": [word["text"]],
-                "replaced_with": word.get("replaced_with"),
-                "replaced_from": word.get("replaced_from"),
-            }
-        else:
+
+    for rect, color, change_type, text, replaced_with, replaced_from, moved_page in entries:
+        if current_group is not None:
             # Kiểm tra xem có thể merge với group hiện tại không
-            same_row = abs(word["rect"].y0 - current_group["rect"].y0) < VERTICAL_THRESHOLD
-            same_color = word["highlight_color"] == current_group["highlight_color"]
-            same_type = word.get("change_type") == current_group.get("change_type")
-            horizontal_gap = word["rect"].x0 - current_group["rect"].x1
+            same_row = abs(rect.y0 - current_group["rect"].y0) < VERTICAL_THRESHOLD
+            same_color = color == current_group["highlight_color"]
+            same_type = change_type == current_group.get("change_type")
+            same_move = moved_page == current_group["moved_page"]
+            horizontal_gap = rect.x0 - current_group["rect"].x1
             close_enough = horizontal_gap < HORIZONTAL_GAP
-            
-            if same_row and same_color and same_type and close_enough:
+
+            if same_row and same_color and same_type and same_move and close_enough:
                 # Merge vào group hiện tại
-                current_group["rect"] = current_group["rect"] | word["rect"]  # Union của 2 rects
-                current_group["texts"].append(word["text"])
+                current_group["rect"] = current_group["rect"] | rect  # Union của 2 rects
+                current_group["texts"].append(text)
                 # Cập nhật replaced info nếu có
-                if word.get("replaced_with"):
-                    current_group["replaced_with"] = word.get("replaced_with")
-                if word.get("replaced_from"):
-                    current_group["replaced_from"] = word.get("replaced_from")
-            else:
-                # Lưu group hiện tại và bắt đầu group mới
-                merged_groups.append(current_group)
-                current_group = {
-                    "rect": fitz.Rect(word["rect"]),
-                    "highlight_color": word["highlight_color"],
-                    "change_type": word.get("change_type"),
-                    "texts": [word["text"]],
-                    "replaced_with": word.get("replaced_with"),
-                    "replaced_from": word.get("replaced_from"),
-                }
-    
+                if replaced_with:
+                    current_group["replaced_with"] = replaced_with
+                if replaced_from:
+                    current_group["replaced_from"] = replaced_from
+                continue
+            # Lưu group hiện tại và bắt đầu group mới
+            merged_groups.append(current_group)
+
+        current_group = {
+            "rect": fitz.Rect(rect),
+            "highlight_color": color,
+            "change_type": change_type,
+            "texts": [text],
+            "replaced_with": replaced_with,
+            "replaced_from": replaced_from,
+            "moved_page": moved_page,
+        }
+
     # Đừng quên group cuối cùng
     if current_group:
         merged_groups.append(current_group)
-    
+
     return merged_groups
 
 
+def merge_adjacent_words(words_data: List[Dict]) -> List[Dict]:
+    """
+    Gộp các words liền kề cùng hàng và cùng màu thành một annotation dài ngang.
+
+    Args:
+        words_data: Danh sách words với rect, highlight_color, change_type
+
+    Returns:
+        Danh sách merged annotations (mỗi item là một group gộp)
+    """
+    # Chỉ lấy các words có highlight
+    highlighted_words = [w for w in words_data if w.get("highlight_color")]
+
+    # Sort theo y (top), rồi x (left) để xử lý theo thứ tự đọc
+    highlighted_words.sort(key=lambda w: (w["rect"].y0, w["rect"].x0))
+
+    return _merge_groups(
+        (
+            w["rect"], w["highlight_color"], w.get("change_type"), w["text"],
+            w.get("replaced_with"), w.get("replaced_from"), w.get("moved_page"),
+        )
+        for w in highlighted_words
+    )
+
+
 def apply_highlights_to_page(page: fitz.Page, words_data: List[Dict], page_num: int) -> int:
     """
     Apply highlights to a PDF page with detailed change type information.
@@ -439,26 +759,22 @@ def apply_highlights_to_page(page: fitz.Page, words_data: List[Dict], page_num:
     
     Note: Logic thông minh - không tô màu nếu text giống nhau ở cả 2 PDFs
     """
-    # Color map
-    color_map = {
-        "red": (1.0, 0.4, 0.4),      # Đỏ - Text bị thay đổi (REPLACED)
-        "yellow": (1.0, 1.0, 0.4),   # Vàng - Text bị xóa (MISSING)
-        "green": (0.5, 1.0, 0.5),    # Xanh lá - Text được thêm (EXTRA)
-    }
+    # MERGE các words liền kề cùng hàng trước khi apply annotation
+    return apply_highlight_groups(page, merge_adjacent_words(words_data))
 
+
+def apply_highlight_groups(page: fitz.Page, merged_groups: List[Dict]) -> int:
+    """Tạo highlight annotation cho các group của merge_adjacent_words (rect: Rect hoặc tuple)."""
     highlights_added = 0
-    
-    # MERGE các words liền kề cùng hàng trước khi apply annotation
-    merged_groups = merge_adjacent_words(words_data)
 
     for group in merged_groups:
-        color = color_map.get(group["highlight_color"])
+        color = HIGHLIGHT_COLORS.get(group["highlight_color"])
         if not color:
             continue
 
         try:
             # Apply highlight cho toàn bộ merged rect
-            annot = page.add_highlight_annot(group["rect"])
+            annot = page.add_highlight_annot(fitz.Rect(group["rect"]))
             annot.set_colors(stroke=color)
             annot.set_opacity(0.5)
 
@@ -508,6 +824,22 @@ def apply_highlights_to_page(page: fitz.Page, words_data: List[Dict], page_num:
                     f"Statut: Présent dans Final mais PAS dans Référence\n"
                     f"Action: Texte a été AJOUTÉ"
                 )
+            elif change_type == "MOVED_OUT":
+                title = "Mode3-DÉPLACÉ"
+                content = (
+                    f"🔵 TEXTE DÉPLACÉ\n"
+                    f"Texte: '{text_content}'\n"
+                    f"Statut: Absent de cette page du Final, présent page {group['moved_page']} du Final\n"
+                    f"Action: Texte a été DÉPLACÉ"
+                )
+            elif change_type == "MOVED_IN":
+                title = "Mode3-DÉPLACÉ"
+                content = (
+                    f"🔵 TEXTE DÉPLACÉ\n"
+                    f"Texte: '{text_content}'\n"
+                    f"Statut: Absent de cette page de Référence, présent page {group['moved_page']} de Référence\n"
+                    f"Action: Texte a été DÉPLACÉ"
+                )
             else:
                 title = f"Mode3-{change_type}"
                 content = f"Change: {change_type}\nText: '{text_content}'"
@@ -522,29 +854,315 @@ def apply_highlights_to_page(page: fitz.Page, words_data: List[Dict], page_num:
     return highlights_added
 
 
+_REGION_HEADERS = {
+    "REPLACED": ("Mode3-MODIFIÉ", "🔴 TEXTE MODIFIÉ", "Statut: Texte a été MODIFIÉ"),
+    "MISSING": ("Mode3-MANQUANT", "🟡 TEXTE MANQUANT", "Statut: Présent dans Référence mais PAS dans Final"),
+    "EXTRA": ("Mode3-SUPPLÉMENTAIRE", "🟢 TEXTE SUPPLÉMENTAIRE", "Statut: Présent dans Final mais PAS dans Référence"),
+    "MOVED_OUT": ("Mode3-DÉPLACÉ", "🔵 TEXTE DÉPLACÉ", "Statut: Présent page {page} du Final"),
+    "MOVED_IN": ("Mode3-DÉPLACÉ", "🔵 TEXTE DÉPLACÉ", "Statut: Présent page {page} de Référence"),
+}
+
+
+def consolidate_groups(merged_groups: List[Dict]) -> List[Dict]:
+    """
+    Gộp các group (theo thứ tự đọc) thành vùng thay đổi: cùng màu / cùng loại và nằm trên
+    các dòng liên tiếp (khoảng trống dọc ≤ REGION_LINE_GAP × chiều cao dòng).
+    Trả về [{"highlight_color", "change_type", "moved_page", "rects": [Rect], "texts": [str]}].
+    """
+    regions: List[Dict] = []
+    open_regions: Dict[Tuple, Dict] = {}  # (màu, loại, trang déplacé) → vùng đang mở
+    for group in merged_groups:
+        rect = fitz.Rect(group["rect"])
+        key = (group["highlight_color"], group.get("change_type"), group.get("moved_page"))
+        region = open_regions.get(key)
+        if region is None or rect.y0 - region["bottom"] > REGION_LINE_GAP * max(region["line_height"], rect.height):
+            region = {
+                "highlight_color": key[0], "change_type": key[1], "moved_page": key[2],
+                "rects": [], "texts": [], "bottom": rect.y1,
+            }
+            regions.append(region)
+            open_regions[key] = region
+        region["rects"].append(rect)
+        region["texts"].append(" ".join(group["texts"]))
+        region["bottom"] = max(region["bottom"], rect.y1)
+        region["line_height"] = rect.height
+    for region in regions:
+        del region["bottom"], region["line_height"]
+    return regions
+
+
+def apply_consolidated_groups(page: fitz.Page, merged_groups: List[Dict]) -> int:
+    """1 highlight annotation (nhiều quads) cho mỗi vùng của consolidate_groups."""
+    highlights_added = 0
+    for region in consolidate_groups(merged_groups):
+        color = HIGHLIGHT_COLORS.get(region["highlight_color"])
+        if not color:
+            continue
+        change_type = region["change_type"]
+        title, header, status = _REGION_HEADERS.get(
+            change_type, (f"Mode3-{change_type}", f"Change: {change_type}", "")
+        )
+        content = "\n".join(
+            [f"{header} ({len(region['texts'])})", status.format(page=region["moved_page"])]
+            + [f"- '{text}'" for text in region["texts"]]
+        )
+        try:
+            annot = page.add_highlight_annot(quads=[rect.quad for rect in region["rects"]])
+            annot.set_colors(stroke=color)
+            annot.set_opacity(0.5)
+            annot.set_info(title=title, content=content)
+            annot.update()
+            highlights_added += 1
+        except Exception:
+            # Silent fail for individual highlights
+            continue
+    return highlights_added
+
+
+def apply_rewritten_page(page: fitz.Page, bbox, summary: Dict, threshold: float) -> int:
+    """1 annotation khung đỏ quanh toàn bộ text của trang réécrite (thay cho highlight từng word)."""
+    annot = page.add_rect_annot(fitz.Rect(bbox) if bbox else page.rect)
+    annot.set_colors(stroke=HIGHLIGHT_COLORS["red"])
+    annot.set_border(width=1.5)
+    annot.set_info(
+        title="Mode3-RÉÉCRIT",
+        content=(
+            f"🔴 PAGE RÉÉCRITE\n"
+            f"Mots Référence / Final: {summary['ref_words']} / {summary['final_words']}\n"
+            f"Texte identique: {summary['matched_ratio']:.0%} (seuil: {threshold:.0%})\n"
+            f"Statut: Page largement réécrite, pas de comparaison mot-à-mot"
+        ),
+    )
+    annot.update()
+    return 1
+
+
+def _change_records(page_index: int, merged_groups: List[Dict]) -> List[Dict]:
+    """Danh sách thay đổi (cho JSON sidecar): 1 record / group."""
+    return [
+        {
+            "page": page_index + 1,
+            "change_type": group.get("change_type"),
+            "text": " ".join(group["texts"]),
+            "rect": [round(v, 2) for v in tuple(group["rect"])],
+            **({"moved_page": group["moved_page"]} if group.get("moved_page") else {}),
+        }
+        for group in merged_groups
+    ]
+
+
 def compare_pages_assemblage(
     ref_page: fitz.Page,
     ref_page_dict: Dict,
     final_page: fitz.Page,
     page_index: int,
+    tokens: TokenTable | None = None,
 ) -> Tuple[int, int]:
     """
     So khớp word diff và annotate cho cả ref_page và final_page. Trả về số highlight đã thêm.
+    ref_page_dict["words"]: PageWordTable hoặc list word records (make_word).
+    tokens: bảng intern đã dùng khi extract ref_page_dict.
+    """
+    ref_words = ref_page_dict["words"]
+    if isinstance(ref_words, PageWordTable):
+        tokens = tokens if tokens is not None else TokenTable()
+        ref_table = ref_words
+    else:
+        reintern = tokens is None
+        tokens = tokens if tokens is not None else TokenTable()
+        _ensure_word_keys(ref_words, tokens, reintern)
+        ref_table = PageWordTable.from_words(ref_words)
+    final_table = PageWordTable.from_page(final_page, tokens)
+
+    align_word_tables(ref_table, final_table, tokens)
+
+    ref_count = apply_highlight_groups(ref_page, ref_table.highlight_groups())
+    final_count = apply_highlight_groups(final_page, final_table.highlight_groups())
+
+    return ref_count, final_count
+
+
+def _compact_groups(groups: List[Dict]) -> List[Dict]:
+    """Group highlight với rect dạng tuple để gửi giữa các process."""
+    for group in groups:
+        group["rect"] = tuple(group["rect"])
+    return groups
+
+
+# (page_index, ref_groups, final_groups, summary)
+# summary: matched_ratio, rewritten, moved_spans, ref_words / final_words, ref_bbox / final_bbox
+PageDiff = Tuple[int, List[Dict], List[Dict], Dict]
+
+
+def _scan_documents(
+    ref_doc: fitz.Document,
+    final_doc: fitz.Document,
+    detect_moves: bool,
+    skip_bands: bool,
+    band_diff_once: bool = True,
+    move_pages: int | None = None,
+) -> Tuple[MoveIndexes | None, PageBands | None]:
     """
-    ref_words_data = ref_page_dict["words"]
+    Pass toàn tài liệu trước khi diff (1 lần đọc words / trang):
+    - index fingerprint n-gram của các trang Ref và Final được so sánh với nhau (detect_moves):
+      chỉ move_pages trang đầu (None = mọi trang). Trang không có trang tương ứng ở tài liệu
+      kia không được index: text ở đó không chứng minh được là đã déplacé.
+    - dòng header / footer lặp lại cần bỏ khỏi diff, theo trang (skip_bands). Chữ ký lặp lại ở
+      1 trong 2 tài liệu được bỏ ở CẢ 2 (Ref đã trích 1 trang vẫn khớp với Final).
+      band_diff_once: giữ lại dòng của mỗi chữ ký ở trang đầu tiên có chữ ký đó.
+    """
+    move_indexes: List[MoveIndex] = []
+    detectors: List[BandDetector] = []
+    for doc in (ref_doc, final_doc):
+        index = MoveIndex()
+        detector = BandDetector()
+        for page_index in range(doc.page_count):
+            page = doc.load_page(page_index)
+            words_raw = page.get_text("words")
+            norms = [_normalize_word(w[4]) for w in words_raw]
+            if detect_moves and (move_pages is None or page_index < move_pages):
+                index.add_page(page_index, norms)
+            if skip_bands:
+                detector.add_page(page_index, page.rect, words_raw, norms)
+        move_indexes.append(index)
+        detectors.append(detector)
+
+    page_bands = None
+    if skip_bands:
+        signatures = detectors[0].recurring() | detectors[1].recurring()
+        keep_pages: Dict = {}
+        if band_diff_once:
+            # Mỗi band (header, footer, ...) giữ lại ở trang đầu tiên có nó, trang chung cho 2 tài liệu
+            for detector in detectors:
+                for signature, page_index in detector.first_pages(signatures).items():
+                    keep_pages[signature] = min(page_index, keep_pages.get(signature, page_index))
+        ref_bands, final_bands = (detector.excluded_lines(signatures, keep_pages) for detector in detectors)
+        page_bands = (ref_bands, final_bands)
+    return (move_indexes[0], move_indexes[1]) if detect_moves else None, page_bands
 
-    final_words_raw = final_page.get_text("words")
-    final_words_data = [
-        {"text": t, "rect": fitz.Rect(x0, y0, x1, y1), "highlight_color": None}
-        for x0, y0, x1, y1, t, *_ in final_words_raw
+
+def _iter_page_diffs(
+    ref_doc: fitz.Document,
+    final_doc: fitz.Document,
+    page_indices,
+    rewrite_threshold: float = 0.0,
+    move_indexes: MoveIndexes | None = None,
+    page_bands: PageBands | None = None,
+    fuzzy_distance: int = 0,
+    diff_engine: str | None = None,
+) -> Iterator[PageDiff]:
+    """
+    Diff lần lượt từng trang của 2 document đang mở, yield ngay kết quả của trang đó.
+    Mỗi trang dùng TokenTable riêng → bộ nhớ chỉ giữ words của 1 trang.
+    Trang réécrite (xem align_word_tables) không có group nào.
+    move_indexes: xem align_word_tables.
+    page_bands: dòng header / footer bỏ khỏi diff theo trang (xem _scan_documents).
+    fuzzy_distance, diff_engine: xem align_word_tables (fuzzy_distance 0 = tắt).
+    """
+    ref_bands, final_bands = page_bands if page_bands is not None else ({}, {})
+    for page_index in page_indices:
+        tokens = TokenTable()
+        ref_table = PageWordTable.from_page(ref_doc.load_page(page_index), tokens, ref_bands.get(page_index))
+        final_table = PageWordTable.from_page(final_doc.load_page(page_index), tokens, final_bands.get(page_index))
+        summary = align_word_tables(
+            ref_table, final_table, tokens, rewrite_threshold, move_indexes, page_index, fuzzy_distance, diff_engine
+        )
+        summary.update(
+            ref_words=len(ref_table),
+            final_words=len(final_table),
+            ref_bbox=ref_table.text_bbox(),
+            final_bbox=final_table.text_bbox(),
+        )
+        yield page_index, ref_table.highlight_groups(), final_table.highlight_groups(), summary
+
+
+def _diff_page_range(
+    ref_pdf_path: str,
+    final_pdf_path: str,
+    page_indices: range,
+    rewrite_threshold: float = 0.0,
+    move_indexes: MoveIndexes | None = None,
+    page_bands: PageBands | None = None,
+    fuzzy_distance: int = 0,
+    diff_engine: str | None = None,
+) -> List[PageDiff]:
+    """
+    Worker: mở 2 PDF 1 lần, diff các trang page_indices.
+    Trả về [(page_index, ref_groups, final_groups, summary)], không annotate (process chính làm).
+    """
+    ref_doc = fitz.open(ref_pdf_path)
+    final_doc = fitz.open(final_pdf_path)
+    results = [
+        (page_index, _compact_groups(ref_groups), _compact_groups(final_groups), summary)
+        for page_index, ref_groups, final_groups, summary in _iter_page_diffs(
+            ref_doc, final_doc, page_indices,
+            rewrite_threshold, move_indexes, page_bands, fuzzy_distance, diff_engine,
+        )
     ]
+    ref_doc.close()
+    final_doc.close()
+    return results
 
-    align_words_assemblage(ref_words_data, final_words_data)
 
-    ref_count = apply_highlights_to_page(ref_page, ref_words_data, page_index)
-    final_count = apply_highlights_to_page(final_page, final_words_data, page_index)
+# Tham số chung của 1 lần diff song song, gửi 1 lần / worker qua initializer của pool
+# (index fingerprint toàn tài liệu có thể lớn: không pickle lại cho từng khoảng trang)
+_WORKER_ARGS: Tuple = ()
+
+
+def _init_diff_worker(*args) -> None:
+    global _WORKER_ARGS
+    _WORKER_ARGS = args
+
+
+def _diff_worker_range(page_indices: range) -> List[PageDiff]:
+    """Worker: _diff_page_range với tham số chung đã nhận từ _init_diff_worker."""
+    ref_pdf_path, final_pdf_path, *options = _WORKER_ARGS
+    return _diff_page_range(ref_pdf_path, final_pdf_path, page_indices, *options)
 
-    return ref_count, final_count
+
+def _iter_parallel_page_diffs(
+    ref_pdf_path: str,
+    final_pdf_path: str,
+    num_pages: int,
+    workers: int,
+    rewrite_threshold: float = 0.0,
+    move_indexes: MoveIndexes | None = None,
+    page_bands: PageBands | None = None,
+    fuzzy_distance: int = 0,
+    diff_engine: str | None = None,
+) -> Iterator[PageDiff]:
+    """
+    Diff các khoảng trang trên ProcessPoolExecutor, yield theo thứ tự khoảng nào xong trước.
+    move_indexes / page_bands... được gửi 1 lần cho mỗi worker (initializer), mỗi task chỉ
+    mang khoảng trang.
+    """
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_diff_worker,
+        initargs=(
+            ref_pdf_path, final_pdf_path,
+            rewrite_threshold, move_indexes, page_bands, fuzzy_distance, diff_engine,
+        ),
+    ) as executor:
+        futures = [executor.submit(_diff_worker_range, chunk) for chunk in _page_chunks(num_pages, workers)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def _resolve_workers(workers: int | None, num_pages: int) -> int:
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if num_pages < PARALLEL_MIN_PAGES:
+        return 1
+    return max(1, min(workers, num_pages))
+
+
+def _page_chunks(num_pages: int, workers: int) -> List[range]:
+    """Chia [0, num_pages) thành các khoảng trang liên tiếp (~CHUNKS_PER_WORKER khoảng / worker)."""
+    chunk_size = max(1, -(-num_pages // (workers * CHUNKS_PER_WORKER)))
+    return [range(start, min(start + chunk_size, num_pages)) for start in range(0, num_pages, chunk_size)]
 
 
 def compare_mode3(
@@ -552,6 +1170,15 @@ def compare_mode3(
     final_pdf_path: str,
     output_ref: str | None = None,
     output_final: str | None = None,
+    preprocess: bool = True,
+    workers: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+    annotation_mode: str | None = None,
+    rewrite_threshold: float | None = None,
+    detect_moves: bool | None = None,
+    skip_bands: bool | None = None,
+    fuzzy_match: bool | None = None,
+    diff_engine: str | None = None,
 ) -> Dict:
     """
     Mode 3 – Annotate cả reference và final PDF với highlight diff.
@@ -563,20 +1190,49 @@ def compare_mode3(
     
     Logic thông minh: Text giống nhau ở cả 2 PDFs sẽ KHÔNG được tô màu
     (Ví dụ: '32859' có ở cả 2 → không highlight)
+
+    preprocess: False → so sánh toàn bộ tài liệu trang-với-trang (không trích 1 trang Ref khớp).
+    workers: số process diff song song (None → MODE3_WORKERS, 0 → os.cpu_count()).
+        Workers trả về danh sách highlight gọn, process chính annotate và save 1 lần.
+    progress: progress(pages_done, total_pages) được gọi sau khi annotate xong mỗi trang.
+    annotation_mode: "group" | "consolidated" (None → MODE3_ANNOTATION_MODE). "consolidated":
+        1 highlight nhiều quads / vùng thay đổi, danh sách đầy đủ trong content và
+        file JSON sidecar (output_final + "_changes.json", key "changes_json").
+    rewrite_threshold: tỉ lệ text giống nhau tối thiểu (None → MODE3_REWRITE_THRESHOLD, 0 = tắt).
+        Trang dưới ngưỡng được đánh dấu "réécrite" bằng 1 annotation / PDF, không tô từng word.
+    detect_moves: đoạn MISSING / EXTRA có ở trang khác của tài liệu kia → "déplacé" (XANH DƯƠNG)
+        (None → MODE3_DETECT_MOVES). Index fingerprint n-gram của các trang được so sánh, tuyến tính.
+        Tắt khi Ref đã được trích 1 trang (preprocess).
+    skip_bands: bỏ header / footer / numéro de page lặp lại khỏi diff (None → MODE3_SKIP_BANDS),
+        chỉ so sánh chúng ở trang đầu tiên có chúng nếu MODE3_BAND_DIFF_ONCE=1.
+    fuzzy_match: word xóa / thêm khác nhau ≤ MODE3_FUZZY_MAX_DISTANCE glyph (OCR, ligature)
+        được coi là giống nhau (None → MODE3_FUZZY_MATCH).
+    diff_engine: "patience" | "hierarchical" | "difflib" (None → MODE3_DIFF_ENGINE).
+
+    Chạy tuần tự: extract → diff → annotate từng trang trên 2 document mở 1 lần,
+    bộ nhớ chỉ giữ words của 1 trang.
     
     Returns:
         Dict with output_ref, output_final, stats, and preprocessing metadata
     """
     # === SMART PREPROCESSING ===
     print("\n=== MODE 3: Comparaison mot-à-mot ===")
-    ref_pdf_path, preprocess_metadata = smart_preprocess(ref_pdf_path, final_pdf_path)
+    if preprocess:
+        ref_pdf_path, preprocess_metadata = smart_preprocess(ref_pdf_path, final_pdf_path)
     # ===========================
     
     ref_doc = fitz.open(ref_pdf_path)
-    ref_pages_data = extract_page_words_with_boxes(ref_pdf_path)
     final_doc = fitz.open(final_pdf_path)
+    if not preprocess:
+        preprocess_metadata = {
+            "ref_original_pages": ref_doc.page_count,
+            "extracted": False,
+            "matched_page": None,
+            "confidence": None,
+        }
 
-    num_pages = min(len(ref_pages_data), final_doc.page_count, ref_doc.page_count)
+    num_pages = min(final_doc.page_count, ref_doc.page_count)
+    workers = _resolve_workers(workers, num_pages)
 
     if output_ref is None:
         output_ref = ref_pdf_path.rsplit(".", 1)[0] + "_mode3_ref.pdf"
@@ -586,14 +1242,76 @@ def compare_mode3(
     ref_highlights = 0
     final_highlights = 0
 
-    for i in range(num_pages):
-        ref_page = ref_doc.load_page(i)
-        ref_page_dict = ref_pages_data[i]
-        final_page = final_doc.load_page(i)
+    if rewrite_threshold is None:
+        rewrite_threshold = REWRITE_THRESHOLD
+    if detect_moves is None:
+        detect_moves = DETECT_MOVES
+    if skip_bands is None:
+        skip_bands = SKIP_BANDS
+    if fuzzy_match is None:
+        fuzzy_match = FUZZY_MATCH
+    fuzzy_distance = FUZZY_MAX_DISTANCE if fuzzy_match else 0
+    diff_engine = diff_engine or DIFF_ENGINE
+    if diff_engine not in DIFF_ENGINES:
+        raise ValueError(f"Diff engine inconnu: {diff_engine!r} (attendu: {', '.join(DIFF_ENGINES)})")
+    max_pages = max(ref_doc.page_count, final_doc.page_count)
+    # Déplacé chỉ có nghĩa giữa các trang được so sánh cặp đôi: Ref đã trích 1 trang
+    # (preprocess) → các trang Final khác không có trang Ref tương ứng. Quá ít trang thì
+    # không có gì lặp lại.
+    detect_moves = detect_moves and num_pages > 1 and not preprocess_metadata["extracted"]
+    skip_bands = skip_bands and max_pages >= BAND_MIN_PAGES
+    move_indexes, page_bands = None, None
+    if detect_moves or skip_bands:
+        move_indexes, page_bands = _scan_documents(
+            ref_doc, final_doc, detect_moves, skip_bands, BAND_DIFF_ONCE, move_pages=num_pages
+        )
+    boilerplate_lines = 0
+    if page_bands is not None:
+        boilerplate_lines = sum(
+            len(lines) for bands in page_bands for page_index, lines in bands.items() if page_index < num_pages
+        )
 
-        r_count, f_count = compare_pages_assemblage(ref_page, ref_page_dict, final_page, i)
-        ref_highlights += r_count
-        final_highlights += f_count
+    if workers > 1:
+        print(f"⚙️ Diff parallèle: {num_pages} pages, {workers} processus")
+        page_diffs = _iter_parallel_page_diffs(
+            ref_pdf_path, final_pdf_path, num_pages, workers,
+            rewrite_threshold, move_indexes, page_bands, fuzzy_distance, diff_engine,
+        )
+    else:
+        page_diffs = _iter_page_diffs(
+            ref_doc, final_doc, range(num_pages),
+            rewrite_threshold, move_indexes, page_bands, fuzzy_distance, diff_engine,
+        )
+
+    annotation_mode = annotation_mode or ANNOTATION_MODE
+    consolidated = annotation_mode == "consolidated"
+    apply_groups = apply_consolidated_groups if consolidated else apply_highlight_groups
+    changes: Dict[str, List[Dict]] = {"ref": [], "final": []}
+    rewritten_pages: List[Dict] = []
+    moved_spans = 0
+    fuzzy_pairs = 0
+
+    for pages_done, (i, ref_groups, final_groups, summary) in enumerate(page_diffs, 1):
+        moved_spans += summary["moved_spans"]
+        fuzzy_pairs += summary["fuzzy_pairs"]
+        if summary["rewritten"]:
+            ref_highlights += apply_rewritten_page(ref_doc.load_page(i), summary["ref_bbox"], summary, rewrite_threshold)
+            final_highlights += apply_rewritten_page(
+                final_doc.load_page(i), summary["final_bbox"], summary, rewrite_threshold
+            )
+            rewritten_pages.append({
+                "page": i + 1,
+                "matched_ratio": round(summary["matched_ratio"], 4),
+                "ref_words": summary["ref_words"],
+                "final_words": summary["final_words"],
+            })
+        ref_highlights += apply_groups(ref_doc.load_page(i), ref_groups)
+        final_highlights += apply_groups(final_doc.load_page(i), final_groups)
+        if consolidated:
+            changes["ref"].extend(_change_records(i, ref_groups))
+            changes["final"].extend(_change_records(i, final_groups))
+        if progress is not None:
+            progress(pages_done, num_pages)
 
     ref_doc.save(output_ref, garbage=4, deflate=True)
     ref_doc.close()
@@ -605,21 +1323,45 @@ def compare_mode3(
         "total_pages": num_pages,
         "ref_highlights": ref_highlights,
         "final_highlights": final_highlights,
+        "workers": workers,
+        "annotation_mode": annotation_mode,
+        "rewritten_pages": rewritten_pages,
+        "moved_spans": moved_spans,
+        "boilerplate_lines": boilerplate_lines,
+        "fuzzy_pairs": fuzzy_pairs,
     }
 
-    return {
+    result = {
         "output_ref": output_ref,
         "output_final": output_final,
         "stats": stats,
         "preprocessing": preprocess_metadata,  # NEW
     }
 
+    if consolidated:
+        stats["ref_changes"] = len(changes["ref"])
+        stats["final_changes"] = len(changes["final"])
+        changes_json = output_final.rsplit(".", 1)[0] + "_changes.json"
+        with open(changes_json, "w", encoding="utf-8") as f:
+            json.dump(dict(changes, rewritten_pages=rewritten_pages), f, ensure_ascii=False, indent=2)
+        result["changes_json"] = changes_json
+
+    return result
+
 
 __all__ = [
     "compare_mode3",
     "extract_page_words_with_boxes",
+    "TokenTable",
+    "PageWordTable",
+    "make_word",
     "align_words_assemblage",
+    "align_word_tables",
     "apply_highlights_to_page",
+    "apply_highlight_groups",
+    "apply_consolidated_groups",
+    "apply_rewritten_page",
+    "consolidate_groups",
     "compare_pages_assemblage",
 ]
 
@@ -0,0 +1,122 @@
+"""
+OCR Cache: Lưu kết quả OCR (text, bbox, confidence) trên đĩa.
+
+Key = digest của raster trang đã render + cấu hình OCR engine, nên:
+- Trang đã OCR rồi → trả về ngay, không chạy lại OCR
+- Trang giống hệt nhau giữa các tài liệu khác nhau → chỉ OCR 1 lần
+
+Eviction theo LRU với giới hạn dung lượng (mtime được cập nhật mỗi lần hit).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Thư mục cache và giới hạn dung lượng (đọc từ env, fallback mặc định)
+OCR_CACHE_DIR = Path(
+    os.getenv("OCR_CACHE_DIR", str(Path(tempfile.gettempdir()) / "compare_batiment_ocr_cache"))
+)
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def raster_digest(pix, engine_config: Dict) -> str:
+    """
+    Tính digest từ raster (pixmap) của trang + cấu hình engine.
+    Cấu hình khác nhau (lang, dpi, ...) → key khác nhau.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(engine_config, sort_keys=True).encode("utf-8"))
+    h.update(f"{pix.width}x{pix.height}x{pix.n}".encode("ascii"))
+    h.update(pix.samples)
+    return h.hexdigest()
+
+
+class OCRCache:
+    """
+    Cache OCR trên đĩa: mỗi entry là 1 file JSON chứa list các dòng OCR
+    {"points": [[x, y], ...], "text": str, "confidence": float}.
+    """
+
+    def __init__(self, cache_dir: Path | str = OCR_CACHE_DIR, max_bytes: int = OCR_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = json.load(f)
+            # Cập nhật mtime để đánh dấu "mới dùng" cho LRU
+            os.utime(path, None)
+            return lines
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, lines: List[Dict]) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(lines, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Cache lỗi không được làm ngắt luồng OCR
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        """Xóa các entry ít dùng nhất cho đến khi tổng dung lượng <= max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for p in self.cache_dir.glob("*.json"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()  # mtime cũ nhất trước
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                    total -= size
+                except OSError:
+                    continue
+
+
+_default_cache: Optional[OCRCache] = None
+
+
+def get_ocr_cache() -> OCRCache:
+    """Trả về OCRCache mặc định (khởi tạo 1 lần)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = OCRCache()
+    return _default_cache
+
+
+__all__ = [
+    "OCRCache",
+    "get_ocr_cache",
+    "raster_digest",
+    "OCR_CACHE_DIR",
+    "OCR_CACHE_MAX_BYTES",
+]
@@ -0,0 +1,118 @@
+"""
+Page Bands: Nhận diện header / footer lặp lại (en-tête, pied de page, numéro de page,
+mentions légales) trên toàn tài liệu, để Mode 3 bỏ chúng khỏi word diff từng trang.
+
+- Chỉ xét các dòng nằm trong dải trên / dưới của trang (BAND_MARGIN × chiều cao trang)
+- Chữ ký 1 dòng = (dải, vị trí dọc làm tròn BAND_Y_TOLERANCE, crc32 của text đã normalize
+  với mọi số thay bằng "#") → "Page 3 / 12" và "Page 4 / 12" có cùng chữ ký
+- Chữ ký lặp lại trên ≥ BAND_MIN_PAGES trang và ≥ BAND_MIN_RATIO số trang → boilerplate
+- Vị trí dải dưới đo từ mép dưới trang (trang khác khổ vẫn khớp)
+"""
+
+from __future__ import annotations
+
+import re
+import zlib
+from typing import Dict, FrozenSet, List, Sequence, Set, Tuple
+
+import fitz  # PyMuPDF
+
+BAND_MARGIN = 0.12       # tỉ lệ chiều cao trang của mỗi dải header / footer
+BAND_Y_TOLERANCE = 4.0   # pt, vị trí dọc được làm tròn theo bước này
+BAND_MIN_PAGES = 3       # tài liệu ít trang hơn thì không có gì "lặp lại"
+BAND_MIN_RATIO = 0.5     # tỉ lệ số trang tối thiểu chứa chữ ký
+
+_DIGITS_RE = re.compile(r"[0-9]+")
+
+LineKey = Tuple[int, int]        # (block_no, line_no) của get_text("words")
+Signature = Tuple[str, int, int]  # ("top" | "bottom", vị trí dọc, crc32 text)
+
+
+class BandDetector:
+    """Thu chữ ký các dòng trong dải header / footer của từng trang 1 tài liệu."""
+
+    def __init__(self, margin: float = BAND_MARGIN):
+        self.margin = margin
+        self.page_count = 0
+        self.page_lines: Dict[int, List[Tuple[Signature, LineKey]]] = {}
+        self.pages_by_signature: Dict[Signature, Set[int]] = {}
+
+    def add_page(self, page_index: int, page_rect: fitz.Rect, words_raw: Sequence[Tuple], norms: Sequence[str]) -> None:
+        """
+        words_raw: page.get_text("words"); norms: normalized text của từng word (cùng thứ tự).
+        """
+        self.page_count += 1
+        height = page_rect.height
+        top_limit = page_rect.y0 + self.margin * height
+        bottom_limit = page_rect.y1 - self.margin * height
+
+        lines: Dict[LineKey, List] = {}
+        for w, norm in zip(words_raw, norms):
+            key = (w[5], w[6])
+            line = lines.get(key)
+            if line is None:
+                lines[key] = [w[1], w[3], [norm]]
+            else:
+                line[0] = min(line[0], w[1])
+                line[1] = max(line[1], w[3])
+                line[2].append(norm)
+
+        entries: List[Tuple[Signature, LineKey]] = []
+        for key, (y0, y1, line_norms) in lines.items():
+            if y1 <= top_limit:
+                zone, offset = "top", y0 - page_rect.y0
+            elif y0 >= bottom_limit:
+                zone, offset = "bottom", page_rect.y1 - y1
+            else:
+                continue
+            text = _DIGITS_RE.sub("#", " ".join(norm for norm in line_norms if norm))
+            if not text:
+                continue
+            signature = (zone, round(offset / BAND_Y_TOLERANCE), zlib.crc32(text.encode("utf-8")))
+            entries.append((signature, key))
+            self.pages_by_signature.setdefault(signature, set()).add(page_index)
+        if entries:
+            self.page_lines[page_index] = entries
+
+    def recurring(self) -> Set[Signature]:
+        """Chữ ký lặp lại đủ nhiều trang của tài liệu này."""
+        min_pages = max(BAND_MIN_PAGES, BAND_MIN_RATIO * self.page_count)
+        return {
+            signature for signature, pages in self.pages_by_signature.items()
+            if len(pages) >= min_pages
+        }
+
+    def first_pages(self, signatures: Set[Signature]) -> Dict[Signature, int]:
+        """Trang đầu tiên chứa từng chữ ký (chữ ký không có trong tài liệu này bị bỏ qua)."""
+        return {
+            signature: min(self.pages_by_signature[signature])
+            for signature in signatures if signature in self.pages_by_signature
+        }
+
+    def excluded_lines(
+        self, signatures: Set[Signature], keep_pages: Dict[Signature, int] | None = None
+    ) -> Dict[int, FrozenSet[LineKey]]:
+        """
+        Dòng cần bỏ khỏi diff, theo trang: mọi dòng có chữ ký trong signatures
+        (thường là recurring() của CẢ 2 tài liệu, để Ref chỉ có 1 trang vẫn bỏ đúng header).
+        keep_pages: chữ ký → trang vẫn giữ dòng đó trong diff (diff band 1 lần / chữ ký).
+        """
+        keep_pages = keep_pages or {}
+        excluded: Dict[int, FrozenSet[LineKey]] = {}
+        for page_index, entries in self.page_lines.items():
+            keys = frozenset(
+                key for signature, key in entries
+                if signature in signatures and keep_pages.get(signature) != page_index
+            )
+            if keys:
+                excluded[page_index] = keys
+        return excluded
+
+
+__all__ = [
+    "BandDetector",
+    "BAND_MARGIN",
+    "BAND_Y_TOLERANCE",
+    "BAND_MIN_PAGES",
+    "BAND_MIN_RATIO",
+]
@@ -0,0 +1,287 @@
+"""
+Spatial Index: Index không gian (grid) cho các words của 1 trang PDF.
+
+Words được extract 1 lần bằng page.get_text("words"), sau đó mọi truy vấn
+"text trong vùng rect" là tra grid, không parse lại text layer.
+
+DocumentWordIndex: inverted index word → vị trí trên toàn tài liệu, dùng để
+tìm lại "anchor" (text dưới annotation ở Ref) trên Final khi layout bị dịch chuyển.
+"""
+
+from __future__ import annotations
+
+import math
+import string
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+GRID_CELL_SIZE = 64.0  # pt
+
+# Anchor: các words gần annotation nhất ở Ref (trong bán kính ANCHOR_RADIUS)
+ANCHOR_RADIUS = 40.0      # pt
+ANCHOR_MAX_RADIUS = 320.0 # note đặt ở lề: mở rộng dần bán kính đến khi đủ words
+ANCHOR_MIN_WORDS = 3
+ANCHOR_MAX_WORDS = 12
+ANCHOR_SEEDS = 4          # số token hiếm nhất dùng làm điểm bắt đầu tìm
+ANCHOR_MAX_POSTINGS = 200 # bỏ qua token quá phổ biến làm seed
+ANCHOR_MIN_SCORE = 0.5    # tỉ lệ token anchor tối thiểu phải tìm thấy quanh vị trí mới
+
+_PUNCT = string.punctuation + "«»“”‘’…–—•·"
+
+
+def normalize_token(text: str) -> str:
+    """Token để so khớp anchor: lowercase, bỏ punctuation ở 2 đầu."""
+    return text.lower().strip(_PUNCT)
+
+
+class PageWordIndex:
+    """
+    Grid index theo tâm của word. Giữ nguyên thứ tự đọc của get_text("words")
+    để ghép lại text giống page.get_text("text", clip=...).
+    """
+
+    def __init__(self, words: Sequence[Tuple], page_rect: fitz.Rect, cell_size: float = GRID_CELL_SIZE):
+        self.page_rect = fitz.Rect(page_rect)
+        self.cell_size = cell_size
+        # (x0, y0, x1, y1, text, block_no, line_no)
+        self.words: List[Tuple] = [tuple(w[:7]) for w in words]
+        self.centers: List[Tuple[float, float]] = [
+            ((w[0] + w[2]) / 2, (w[1] + w[3]) / 2) for w in self.words
+        ]
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        for idx, (cx, cy) in enumerate(self.centers):
+            self._grid.setdefault(self._cell(cx, cy), []).append(idx)
+
+    @classmethod
+    def from_page(cls, page: fitz.Page, cell_size: float = GRID_CELL_SIZE) -> "PageWordIndex":
+        return cls(page.get_text("words"), page.rect, cell_size)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def query(self, rect: fitz.Rect) -> List[int]:
+        """Index các words có tâm nằm trong rect, theo thứ tự đọc."""
+        rect = fitz.Rect(rect) & self.page_rect
+        if rect.is_empty:
+            return []
+        cx0, cy0 = self._cell(rect.x0, rect.y0)
+        cx1, cy1 = self._cell(rect.x1, rect.y1)
+
+        hits = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for idx in self._grid.get((cx, cy), ()):
+                    x, y = self.centers[idx]
+                    if rect.x0 <= x <= rect.x1 and rect.y0 <= y <= rect.y1:
+                        hits.append(idx)
+        hits.sort()
+        return hits
+
+    def filter(self, indices: Sequence[int], rect: fitz.Rect) -> List[int]:
+        """Lọc subset của kết quả query() theo rect nhỏ hơn (không tra grid lại)."""
+        rect = fitz.Rect(rect)
+        return [
+            idx for idx in indices
+            if rect.x0 <= self.centers[idx][0] <= rect.x1 and rect.y0 <= self.centers[idx][1] <= rect.y1
+        ]
+
+    def lines(self, indices: Sequence[int]) -> List[Tuple[List[int], fitz.Rect]]:
+        """Nhóm words theo (block, line) giữ thứ tự đọc. Trả về [(indices, bbox của dòng)]."""
+        groups: List[Tuple[List[int], fitz.Rect]] = []
+        current_key = None
+        for idx in indices:
+            w = self.words[idx]
+            key = (w[5], w[6])
+            if key != current_key:
+                groups.append(([idx], fitz.Rect(w[:4])))
+                current_key = key
+            else:
+                groups[-1][0].append(idx)
+                groups[-1][1].include_rect(fitz.Rect(w[:4]))
+        return groups
+
+    def text(self, indices: Sequence[int]) -> str:
+        """Ghép words thành text: cùng (block, line) → 1 dòng, các dòng cách nhau bởi newline."""
+        lines: List[str] = []
+        current_key = None
+        for idx in indices:
+            w = self.words[idx]
+            key = (w[5], w[6])
+            if key != current_key:
+                lines.append(w[4])
+                current_key = key
+            else:
+                lines[-1] += " " + w[4]
+        return "\n".join(lines).strip()
+
+
+class DocumentWordIndex:
+    """
+    Inverted index token → [(page, word_idx)] trên toàn tài liệu,
+    kèm PageWordIndex của từng trang để chấm điểm vị trí ứng viên.
+    """
+
+    def __init__(self, pages: Dict[int, PageWordIndex]):
+        self.pages = pages
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for page_no, index in pages.items():
+            for idx, w in enumerate(index.words):
+                token = normalize_token(w[4])
+                if len(token) >= 2:
+                    self.postings.setdefault(token, []).append((page_no, idx))
+
+    @classmethod
+    def from_document(cls, doc: fitz.Document) -> "DocumentWordIndex":
+        return cls({i: PageWordIndex.from_page(doc.load_page(i)) for i in range(doc.page_count)})
+
+
+def capture_anchor(index: PageWordIndex, rect: fitz.Rect, radius: float = ANCHOR_RADIUS) -> Dict:
+    """
+    Lấy anchor của annotation ở Ref: tối đa ANCHOR_MAX_WORDS words gần rect nhất.
+    Words nằm dưới rect bị bỏ: đó là text mà annotation yêu cầu sửa, sẽ khác trên Final.
+    Bán kính tìm được nhân đôi (đến ANCHOR_MAX_RADIUS) cho đến khi có ít nhất
+    ANCHOR_MIN_WORDS words. Khoảng cách dọc được nhân 3 để ưu tiên words cùng dòng.
+    Trả về {"tokens": [...], "centers": [(x, y), ...], "bbox": Rect | None}
+    (locate_anchor cũng nhận bbox dạng tuple, VD: anchor đã được pickle).
+    """
+    rect = fitz.Rect(rect)
+    cx, cy = (rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2
+
+    covered = set(index.query(rect))
+    while True:
+        hits = [
+            idx for idx in index.query(expand_rect(rect, radius, index.page_rect))
+            if idx not in covered and len(normalize_token(index.words[idx][4])) >= 2
+        ]
+        if len(hits) >= ANCHOR_MIN_WORDS or radius >= ANCHOR_MAX_RADIUS:
+            break
+        radius *= 2
+
+    hits.sort(key=lambda i: math.hypot(index.centers[i][0] - cx, 3 * (index.centers[i][1] - cy)))
+
+    tokens: List[str] = []
+    centers: List[Tuple[float, float]] = []
+    bbox: Optional[fitz.Rect] = None
+    for idx in hits[:ANCHOR_MAX_WORDS]:
+        tokens.append(normalize_token(index.words[idx][4]))
+        centers.append(index.centers[idx])
+        word_rect = fitz.Rect(index.words[idx][:4])
+        bbox = word_rect if bbox is None else bbox | word_rect
+    return {"tokens": tokens, "centers": centers, "bbox": bbox}
+
+
+def locate_anchor(
+    doc_index: DocumentWordIndex,
+    anchor: Dict,
+    preferred_page: int,
+    radius: float = ANCHOR_RADIUS,
+) -> Optional[Dict]:
+    """
+    Tìm anchor trên tài liệu Final qua inverted index (không quét toàn bộ words):
+    - Seed = vị trí của các token anchor hiếm nhất
+    - Mỗi seed được chấm điểm = tỉ lệ token anchor có mặt quanh seed (tra grid)
+    - Ưu tiên điểm cao, rồi cùng trang, rồi gần vị trí cũ
+    - Nhưng giữ preferred_page nếu vị trí tốt nhất trên trang đó đạt ANCHOR_MIN_SCORE:
+      trang khác còn nguyên text cũ (VD: sửa đổi chỉ áp dụng ở trang của annotation)
+      không được kéo anchor đi
+
+    Trả về {"page", "score", "offset": (dx, dy)} hoặc None nếu không đủ tin cậy.
+    offset = median độ dịch chuyển của các token khớp (Ref → Final).
+    """
+    tokens = anchor["tokens"]
+    wanted = set(tokens)
+    if not wanted or anchor["bbox"] is None:
+        return None
+
+    ref_pos: Dict[str, Tuple[float, float]] = {}
+    for token, center in zip(tokens, anchor["centers"]):
+        ref_pos.setdefault(token, center)
+
+    seeds = sorted(
+        (t for t in wanted if 0 < len(doc_index.postings.get(t, ())) <= ANCHOR_MAX_POSTINGS),
+        key=lambda t: len(doc_index.postings[t]),
+    )[:ANCHOR_SEEDS]
+
+    ref_bbox = fitz.Rect(anchor["bbox"])
+    span = max(ref_bbox.width, ref_bbox.height) + radius
+
+    best = None
+    best_preferred = None
+    seen = set()
+    for token in seeds:
+        ref_x, ref_y = ref_pos[token]
+        for page_no, idx in doc_index.postings[token]:
+            if (page_no, idx) in seen:
+                continue
+            seen.add((page_no, idx))
+            index = doc_index.pages[page_no]
+            x, y = index.centers[idx]
+            # Vị trí kỳ vọng của mỗi token nếu seed này đúng: cùng offset với seed
+            seed_dx, seed_dy = x - ref_x, y - ref_y
+            window = index.query(fitz.Rect(x - span, y - span, x + span, y + span))
+
+            # Mỗi token anchor: lấy occurrence gần vị trí kỳ vọng nhất
+            nearest: Dict[str, Tuple[float, float, float]] = {}
+            for w_idx in window:
+                token_w = normalize_token(index.words[w_idx][4])
+                if token_w in wanted:
+                    wx, wy = index.centers[w_idx]
+                    ex, ey = ref_pos[token_w][0] + seed_dx, ref_pos[token_w][1] + seed_dy
+                    d = math.hypot(wx - ex, wy - ey)
+                    if token_w not in nearest or d < nearest[token_w][0]:
+                        nearest[token_w] = (d, wx - ref_pos[token_w][0], wy - ref_pos[token_w][1])
+
+            score = len(nearest) / len(wanted)
+            rank = (score, page_no == preferred_page, -math.hypot(seed_dx, seed_dy))
+            improves = best is None or rank > best[0]
+            improves_preferred = page_no == preferred_page and (best_preferred is None or rank > best_preferred[0])
+            if improves or improves_preferred:
+                dxs = sorted(v[1] for v in nearest.values())
+                dys = sorted(v[2] for v in nearest.values())
+                offset = (dxs[len(dxs) // 2], dys[len(dys) // 2])
+                candidate = (rank, page_no, score, offset)
+                if improves:
+                    best = candidate
+                if improves_preferred:
+                    best_preferred = candidate
+
+    if best_preferred is not None and best_preferred[2] >= ANCHOR_MIN_SCORE:
+        best = best_preferred
+    if best is None or best[2] < ANCHOR_MIN_SCORE:
+        return None
+    return {"page": best[1], "score": best[2], "offset": best[3]}
+
+
+def expand_rect(rect: fitz.Rect, context_size: float, page_rect: fitz.Rect) -> fitz.Rect:
+    """Mở rộng rect mỗi phía context_size pt, giới hạn trong trang."""
+    return fitz.Rect(
+        max(0, rect.x0 - context_size),
+        max(0, rect.y0 - context_size),
+        min(page_rect.width, rect.x1 + context_size),
+        min(page_rect.height, rect.y1 + context_size),
+    )
+
+
+def texts_around(index: PageWordIndex, rect: fitz.Rect, context_sizes: Sequence[float]) -> List[str]:
+    """
+    Text quanh rect cho nhiều bán kính: tra grid 1 lần với bán kính lớn nhất,
+    các bán kính nhỏ hơn lọc lại từ kết quả đó. Trả về theo thứ tự context_sizes.
+    """
+    largest = max(context_sizes)
+    base = index.query(expand_rect(rect, largest, index.page_rect))
+    return [
+        index.text(base if size == largest else index.filter(base, expand_rect(rect, size, index.page_rect)))
+        for size in context_sizes
+    ]
+
+
+__all__ = [
+    "PageWordIndex",
+    "DocumentWordIndex",
+    "capture_anchor",
+    "locate_anchor",
+    "normalize_token",
+    "expand_rect",
+    "texts_around",
+]
@@ -0,0 +1,40 @@
+from annotation_rules import parse_instruction, precheck_annotation
+
+REF = "Prix unitaire 12,50 € HT - Livraison sous 8 jours - Coloris rouge"
+
+
+def test_replace_rule_still_resolved():
+    verdict = precheck_annotation("remplacer 12,50 € par 13,90 €", "Prix unitaire 13,90 € HT", "", REF)
+    assert verdict["status"] == "implemented"
+    assert verdict["source"] == "rule"
+
+
+def test_prose_with_au_lieu_de_goes_to_llm():
+    note = "Merci de mettre la photo du modèle bleu au lieu de rouge"
+    assert parse_instruction(note) is None
+    assert precheck_annotation(note, "Coloris rouge", "Coloris rouge", REF) is None
+
+
+def test_delete_of_non_text_goes_to_llm():
+    # "le logo" n'est jamais du texte dans la Ref : son absence ne prouve rien
+    assert precheck_annotation("supprimer le logo", "Prix unitaire", "Prix unitaire", REF) is None
+
+
+def test_add_already_in_ref_goes_to_llm():
+    ref = "Dimensions 120 x 80 cm"
+    assert precheck_annotation("ajouter cm", "Dimensions 120 x 80 cm", "Dimensions 120 x 80 cm", ref) is None
+
+
+def test_arrow_without_verb_goes_to_llm():
+    note = "Voir page 3 -> corriger"
+    assert parse_instruction(note) is None
+    assert precheck_annotation(note, "corriger", "Voir page 3 corriger", "Voir page 3") is None
+
+
+def test_long_values_are_not_rules():
+    note = "supprimer toute la phrase concernant les conditions de livraison en zone rurale"
+    assert parse_instruction(note) is None
+
+
+def test_without_ref_text_goes_to_llm():
+    assert precheck_annotation("remplacer 12,50 € par 13,90 €", "Prix unitaire 13,90 € HT", "") is None
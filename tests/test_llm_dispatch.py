@@ -0,0 +1,14 @@
+from llm_dispatch import percentile
+
+
+def test_percentile_nearest_rank():
+    assert percentile(range(1, 7), 50) == 3
+    assert percentile(range(1, 21), 15) == 3
+    assert percentile(range(1, 21), 95) == 19
+    assert percentile(range(1, 21), 100) == 20
+    assert percentile(range(1, 21), 0) == 1
+    assert percentile([5.0, 1.0, 3.0], 50) == 3.0
+
+
+def test_percentile_empty():
+    assert percentile([], 95) == 0.0
@@ -0,0 +1,66 @@
+import json
+from types import SimpleNamespace
+
+import fitz
+import pytest
+
+import mode2
+from llm_cache import VerdictCache
+
+NOTES = ["Vérifier la cohérence avec le CCTP", "Préciser la classe de résistance au feu"]
+
+
+class FakeClient:
+    """Répond toujours avec une confiance faible, pour forcer l'escalade vers le modèle fort."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        answer = {"implemented": True, "status": "implemented", "confidence": 0.5, "reasoning": "", "evidence": ""}
+        content = json.dumps(dict(answer, results=[dict(answer, id=i) for i in range(len(NOTES))]))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=100),
+        )
+
+
+def _write(path, with_notes):
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    page.insert_text((40, 300), "Lot 4 menuiseries intérieures : bloc-porte coupe-feu posé.", fontsize=9)
+    page.insert_text((40, 500), "Lot 5 cloisons : plaques de plâtre hydrofuges en pièces humides.", fontsize=9)
+    if with_notes:
+        for y, note in zip((300, 500), NOTES):
+            page.add_text_annot((300, y - 8), note)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_second_run_served_from_cache_reports_no_spend(tmp_path, monkeypatch, batch):
+    client = FakeClient()
+    monkeypatch.setattr(mode2, "get_openai_client", lambda api_key=None: client)
+    monkeypatch.setattr(mode2, "VerdictCache", lambda: VerdictCache(tmp_path / "cache.sqlite"))
+    ref = _write(tmp_path / "ref.pdf", with_notes=True)
+    final = _write(tmp_path / "final.pdf", with_notes=False)
+
+    def _run():
+        return mode2.compare_mode2(
+            ref, final, str(tmp_path / "out.pdf"), model="fast", strong_model="strong",
+            batch=batch, hedge=False, max_concurrency=1,
+        )["summary"]
+
+    first = _run()
+    assert first["escalated"] == len(NOTES)
+    assert first["prompt_tokens"] > 0 and first["cache_hits"] == 0
+
+    calls = client.calls
+    second = _run()
+    assert client.calls == calls
+    assert second["cache_hits"] == len(NOTES)
+    assert second["escalated"] == 0
+    assert second["prompt_tokens"] == 0
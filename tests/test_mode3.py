@@ -0,0 +1,122 @@
+import fitz
+
+import mode3
+
+
+def _words(prefix, count):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+A = _words("alpha", 60)
+B = _words("bravo", 60)
+S = _words("sierra", 25)
+
+
+def _write(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page(width=595, height=842)
+        page.insert_textbox(fitz.Rect(40, 200, 555, 640), text, fontsize=9)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def _compare(tmp_path, ref_pages, final_pages, **kwargs):
+    ref = _write(tmp_path / "ref.pdf", ref_pages)
+    final = _write(tmp_path / "final.pdf", final_pages)
+    return mode3.compare_mode3(
+        ref, final, str(tmp_path / "out_ref.pdf"), str(tmp_path / "out_final.pdf"),
+        workers=1, detect_moves=True, skip_bands=False, **kwargs,
+    )
+
+
+def test_moves_detected_between_compared_pages(tmp_path):
+    result = _compare(tmp_path, [A + " " + S, B], [A, S + " " + B], preprocess=False)
+    assert result["stats"]["moved_spans"] == 2
+
+
+def test_no_moves_against_final_pages_without_ref_counterpart(tmp_path):
+    # S a été supprimé de la page 1 ; il existe aussi en page 2 des DEUX documents,
+    # mais la Ref est réduite à la page correspondante par le prétraitement.
+    result = _compare(tmp_path, [A + " " + S, B + " " + S], [A, B + " " + S], preprocess=True)
+    assert result["preprocessing"]["extracted"]
+    assert result["stats"]["total_pages"] == 1
+    assert result["stats"]["moved_spans"] == 0
+    titles = [annot.info["title"] for annot in fitz.open(result["output_ref"])[0].annots()]
+    assert titles and "Mode3-DÉPLACÉ" not in titles
+
+
+def test_no_moves_when_ref_has_single_page(tmp_path):
+    result = _compare(tmp_path, [A + " " + S], [A, S + " " + B], preprocess=False)
+    assert result["stats"]["moved_spans"] == 0
+
+
+def _write_banded(path, bodies, headers, footers):
+    doc = fitz.open()
+    for body, header, footer in zip(bodies, headers, footers):
+        page = doc.new_page(width=595, height=842)
+        if header:
+            page.insert_text((40, 40), header, fontsize=9)
+        page.insert_textbox(fitz.Rect(40, 200, 555, 640), body, fontsize=9)
+        if footer:
+            page.insert_text((40, 820), footer, fontsize=9)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_each_band_diffed_once_on_its_own_first_page(tmp_path):
+    # Header dès la page 1, footer seulement à partir de la page 2 : la modification
+    # du footer en page 2 doit être comparée, pas masquée comme boilerplate.
+    bodies = [A, B, S, A]
+    headers = ["ACME Rapport annuel"] * 4
+    ref_footers = [None] + ["Confidentiel diffusion restreinte"] * 3
+    final_footers = [None, "Confidentiel diffusion libre"] + ["Confidentiel diffusion restreinte"] * 2
+    ref = _write_banded(tmp_path / "ref.pdf", bodies, headers, ref_footers)
+    final = _write_banded(tmp_path / "final.pdf", bodies, headers, final_footers)
+    result = mode3.compare_mode3(
+        ref, final, str(tmp_path / "out_ref.pdf"), str(tmp_path / "out_final.pdf"),
+        preprocess=False, workers=1, detect_moves=False, skip_bands=True,
+    )
+    assert result["stats"]["boilerplate_lines"] > 0
+    ref_page = fitz.open(result["output_ref"])[1]
+    assert [annot for annot in ref_page.annots() if annot.rect.y0 > 800]
+
+
+def test_deleted_duplicate_is_not_a_move(tmp_path):
+    # S reste en page 2 des deux documents : sa suppression en page 1 n'est pas un déplacement.
+    result = _compare(tmp_path, [A + " " + S, B + " " + S], [A, B + " " + S], preprocess=False)
+    assert result["stats"]["moved_spans"] == 0
+
+
+def test_moves_off_by_default(tmp_path):
+    ref = _write(tmp_path / "ref.pdf", [A + " " + S, B])
+    final = _write(tmp_path / "final.pdf", [A, S + " " + B])
+    result = mode3.compare_mode3(
+        ref, final, str(tmp_path / "out_ref.pdf"), str(tmp_path / "out_final.pdf"),
+        preprocess=False, workers=1, skip_bands=False,
+    )
+    assert result["stats"]["moved_spans"] == 0
+
+
+def test_rewritten_pages_opt_in(tmp_path):
+    assert _compare(tmp_path, [A], [B], preprocess=False)["stats"]["rewritten_pages"] == []
+    result = _compare(tmp_path, [A], [B], preprocess=False, rewrite_threshold=0.2)
+    assert [page["page"] for page in result["stats"]["rewritten_pages"]] == [1]
+
+
+def test_band_edits_compared_on_every_page_by_default(tmp_path):
+    bodies = [A, B, S, A]
+    headers = ["ACME Rapport annuel"] * 4
+    ref_footers = ["Révision du 12 mars"] * 4
+    final_footers = ["Révision du 12 mars"] * 2 + ["Révision du 19 avril"] + ["Révision du 12 mars"]
+    ref = _write_banded(tmp_path / "ref.pdf", bodies, headers, ref_footers)
+    final = _write_banded(tmp_path / "final.pdf", bodies, headers, final_footers)
+    result = mode3.compare_mode3(
+        ref, final, str(tmp_path / "out_ref.pdf"), str(tmp_path / "out_final.pdf"),
+        preprocess=False, workers=1,
+    )
+    assert result["stats"]["boilerplate_lines"] == 0
+    ref_page = fitz.open(result["output_ref"])[2]
+    assert [annot for annot in ref_page.annots() if annot.rect.y0 > 800]
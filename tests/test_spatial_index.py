@@ -0,0 +1,35 @@
+import fitz
+
+from spatial_index import DocumentWordIndex, PageWordIndex, capture_anchor, locate_anchor
+
+LINE = "Lot 4 menuiseries : le prix unitaire du bloc-porte est de {} € HT posé, hors quincaillerie."
+
+
+def _doc(lines):
+    doc = fitz.open()
+    for line in lines:
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((40, 300), line, fontsize=9)
+    return doc
+
+
+def test_anchor_stays_on_page_where_edit_was_applied():
+    ref = _doc([LINE.format("12,50")])
+    final = _doc([LINE.format("13,90"), LINE.format("12,50")])
+    rect = ref[0].search_for("12,50")[0]
+    anchor = capture_anchor(PageWordIndex.from_page(ref[0]), rect)
+    assert "12,50" not in anchor["tokens"]
+
+    located = locate_anchor(DocumentWordIndex.from_document(final), anchor, preferred_page=0)
+    assert located["page"] == 0
+    assert located["score"] == 1.0
+
+
+def test_anchor_follows_text_moved_to_another_page():
+    ref = _doc([LINE.format("12,50")])
+    final = _doc(["Page de garde", LINE.format("12,50")])
+    rect = ref[0].search_for("12,50")[0]
+    anchor = capture_anchor(PageWordIndex.from_page(ref[0]), rect)
+
+    located = locate_anchor(DocumentWordIndex.from_document(final), anchor, preferred_page=0)
+    assert located["page"] == 1
@@ -0,0 +1,51 @@
+import random
+
+from token_diff import diff_opcodes, hierarchical_opcodes
+
+
+def _matched(opcodes):
+    return sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal")
+
+
+def test_hierarchical_keeps_patience_alignment_when_small_block_moves():
+    # Ref: 1 long paragraph (block 0, 3 lines) then a small price block (block 1).
+    # Final: the price block moved to the top, the paragraph reflowed into other lines.
+    paragraph = list(range(100, 130))
+    prices = [900, 901, 902]
+    a = paragraph + prices
+    a_path = [(0, i // 10) for i in range(len(paragraph))] + [(1, 0)] * len(prices)
+    b = prices + paragraph
+    b_path = [(0, 0)] * len(prices) + [(1, i // 12) for i in range(len(paragraph))]
+
+    patience = diff_opcodes(a, b)
+    hierarchical = hierarchical_opcodes(a, a_path, b, b_path)
+    assert _matched(hierarchical) == _matched(patience) == len(paragraph)
+    assert hierarchical == patience
+
+
+def test_hierarchical_matches_identical_blocks_on_repetitive_text():
+    line = [1, 2, 3, 1, 2, 3]
+    a = line * 4
+    a_path = [(k // 12, k // 6) for k in range(len(a))]
+    b = line * 2 + [7] + line * 2
+    b_path = [(0, 0)] * 6 + [(0, 1)] * 6 + [(1, 0)] + [(2, 0)] * 6 + [(2, 1)] * 6
+    assert _matched(hierarchical_opcodes(a, a_path, b, b_path)) == len(a)
+
+
+def test_repetitive_page_over_edit_budget_keeps_alignment():
+    # Low-vocabulary page (no unique anchor token) with ~30% edits: far more edits than
+    # MYERS_MAX_COST, the gap must still be aligned instead of being marked changed as a whole.
+    rng = random.Random(7)
+    a = [rng.randrange(30) for _ in range(3000)]
+    b = []
+    for token in a:
+        roll = rng.random()
+        if roll < 0.1:
+            continue
+        if roll < 0.2:
+            b.append(rng.randrange(30))
+        elif roll < 0.3:
+            b.extend((token, rng.randrange(30)))
+        else:
+            b.append(token)
+    assert _matched(diff_opcodes(a, b)) > 2000
@@ -0,0 +1,123 @@
+"""
+Text Moves: Index fingerprint (rolling hash + winnowing) của các n-gram token trên
+toàn tài liệu, dùng để nhận ra đoạn text bị XÓA ở 1 trang nhưng xuất hiện ở trang
+khác (đoạn "déplacé") mà không cần diff chéo giữa các trang.
+
+- Token hash ổn định giữa các process (crc32, không dùng hash() của Python)
+- Hash n-gram (Rabin–Karp) tính cuốn chiếu: O(1) / token
+- Winnowing: giữ hash nhỏ nhất của mỗi cửa sổ MOVE_WINDOW n-gram liên tiếp →
+  mọi đoạn chung dài ≥ MOVE_WINDOW + MOVE_NGRAM - 1 token chắc chắn có fingerprint chung
+- Index: fingerprint → các trang chứa nó. Xây và tra đều tuyến tính theo số token.
+"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+MOVE_NGRAM = 3           # số token / n-gram
+MOVE_WINDOW = 4          # số n-gram / cửa sổ winnowing
+MOVE_MIN_COVERAGE = 0.6  # tỉ lệ fingerprint của đoạn phải tìm thấy trên cùng 1 trang
+MOVE_MAX_GAP = 2         # số word khớp tình cờ (VD: "de", "la") tối đa bên trong 1 đoạn déplacé
+
+_HASH_MOD = (1 << 61) - 1
+_HASH_BASE = 1_000_003
+
+
+def token_hash(norm: str) -> int:
+    """Hash ổn định (giống nhau ở mọi process) của 1 normalized token."""
+    return zlib.crc32(norm.encode("utf-8"))
+
+
+def ngram_hashes(norms: Sequence[str], n: int = MOVE_NGRAM) -> List[int]:
+    """Hash của mọi n-gram liên tiếp (rolling hash Rabin–Karp)."""
+    if len(norms) < n:
+        return []
+    top = pow(_HASH_BASE, n - 1, _HASH_MOD)
+    hashes: List[int] = []
+    value = 0
+    token_hashes = [token_hash(norm) for norm in norms]
+    for i, h in enumerate(token_hashes):
+        if i >= n:
+            value = (value - token_hashes[i - n] * top) % _HASH_MOD
+        value = (value * _HASH_BASE + h) % _HASH_MOD
+        if i >= n - 1:
+            hashes.append(value)
+    return hashes
+
+
+def winnow(hashes: Sequence[int], window: int = MOVE_WINDOW) -> Set[int]:
+    """Fingerprints: hash nhỏ nhất của mỗi cửa sổ `window` hash liên tiếp."""
+    if len(hashes) <= window:
+        return {min(hashes)} if hashes else set()
+    fingerprints: Set[int] = set()
+    for start in range(len(hashes) - window + 1):
+        fingerprints.add(min(hashes[start:start + window]))
+    return fingerprints
+
+
+def fingerprints(norms: Sequence[str]) -> Set[int]:
+    """Fingerprints winnowing của 1 dãy normalized tokens (bỏ token rỗng)."""
+    return winnow(ngram_hashes([norm for norm in norms if norm]))
+
+
+class MoveIndex:
+    """Fingerprint → tập trang (0-based) của 1 tài liệu."""
+
+    def __init__(self):
+        self.postings: Dict[int, Set[int]] = {}
+
+    def add_page(self, page_index: int, norms: Sequence[str]) -> None:
+        for fingerprint in fingerprints(norms):
+            self.postings.setdefault(fingerprint, set()).add(page_index)
+
+    def _page_hits(self, span_fingerprints: Set[int], exclude_page: int) -> Dict[int, int]:
+        """Trang (≠ exclude_page) → số fingerprint của đoạn có trên trang đó."""
+        hits: Dict[int, int] = {}
+        for fingerprint in span_fingerprints:
+            for page_index in self.postings.get(fingerprint, ()):
+                if page_index != exclude_page:
+                    hits[page_index] = hits.get(page_index, 0) + 1
+        return hits
+
+    def find(
+        self, norms: Sequence[str], exclude_page: int, counterpart: Optional[MoveIndex] = None
+    ) -> Optional[Tuple[int, float]]:
+        """
+        Trang (≠ exclude_page) chứa nhiều fingerprint của đoạn norms nhất.
+        Trả về (page_index, coverage) nếu coverage ≥ MOVE_MIN_COVERAGE, ngược lại None.
+        Đoạn quá ngắn (< MOVE_NGRAM token) không bao giờ khớp.
+        counterpart: index của tài liệu chứa đoạn norms. Trang j mà chính tài liệu đó cũng có
+        đoạn này (≥ MOVE_MIN_COVERAGE) bị loại: đó là text lặp lại, không phải text déplacé.
+        """
+        span_fingerprints = fingerprints(norms)
+        if not span_fingerprints:
+            return None
+        min_count = MOVE_MIN_COVERAGE * len(span_fingerprints)
+        hits = {
+            page_index: count for page_index, count in self._page_hits(span_fingerprints, exclude_page).items()
+            if count >= min_count
+        }
+        if hits and counterpart is not None:
+            duplicates = counterpart._page_hits(span_fingerprints, exclude_page)
+            hits = {
+                page_index: count for page_index, count in hits.items()
+                if duplicates.get(page_index, 0) < min_count
+            }
+        if not hits:
+            return None
+        # Nhiều fingerprint nhất, hòa thì trang gần exclude_page nhất
+        page_index, count = max(hits.items(), key=lambda item: (item[1], -abs(item[0] - exclude_page)))
+        return page_index, count / len(span_fingerprints)
+
+
+__all__ = [
+    "MoveIndex",
+    "fingerprints",
+    "ngram_hashes",
+    "winnow",
+    "MOVE_NGRAM",
+    "MOVE_WINDOW",
+    "MOVE_MIN_COVERAGE",
+    "MOVE_MAX_GAP",
+]
@@ -0,0 +1,395 @@
+"""
+Token Diff: Diff engine cho 2 dãy token id (int) của mode 3.
+
+- Patience: token xuất hiện đúng 1 lần ở CẢ 2 dãy làm anchor (LIS theo vị trí),
+  chia bài toán thành các khoảng nhỏ, đệ quy trong từng khoảng
+- Myers O(ND) linear-space (middle snake) cho khoảng không còn anchor duy nhất; khoảng
+  vượt quá MYERS_MAX_COST edit (trang lặp từ, sửa nhiều) → alignment gần đúng của difflib
+- Không có heuristic autojunk như difflib: kết quả không đổi theo độ dài trang
+- Hierarchical: patience như trên, nhưng vùng không còn token duy nhất (nơi patience gọi
+  Myers, phần tốn kém trên trang lặp từ) được so khớp block → line theo hash nội dung
+  trước, chỉ diff word-level trong các đoạn không khớp. Anchor token duy nhất vẫn quyết định
+  alignment tổng thể → chỉ khác patience bên trong các vùng đó (Myers tối ưu số token khớp,
+  khớp theo đoạn thì không).
+
+Output cùng format SequenceMatcher.get_opcodes(): [(tag, i1, i2, j1, j2), ...]
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from difflib import SequenceMatcher
+from typing import Dict, List, Sequence, Tuple
+
+# Giới hạn số edit của Myers trong 1 khoảng; vượt quá → SequenceMatcher (autojunk=False) cho
+# khoảng đó: không tối ưu nhưng vẫn giữ được phần lớn token khớp, không tốn O(N·D)
+MYERS_MAX_COST = 512
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def _unique_anchors(a: Sequence[int], a0: int, a1: int, b: Sequence[int], b0: int, b1: int) -> List[Tuple[int, int]]:
+    """Các cặp (i, j) của token duy nhất ở cả 2 khoảng, lấy dãy con tăng dài nhất theo j."""
+    positions: Dict[int, List[int]] = {}
+    for i in range(a0, a1):
+        entry = positions.get(a[i])
+        if entry is None:
+            positions[a[i]] = [i, -1, 1]
+        else:
+            entry[2] += 1
+    for j in range(b0, b1):
+        entry = positions.get(b[j])
+        if entry is None or entry[2] != 1:
+            continue
+        if entry[1] == -1:
+            entry[1] = j
+        else:
+            entry[2] = 2  # lặp lại ở b → không còn duy nhất
+
+    candidates = sorted(
+        (entry[0], entry[1]) for entry in positions.values() if entry[2] == 1 and entry[1] != -1
+    )
+    if not candidates:
+        return []
+
+    # Patience sorting: LIS theo j (candidates đã tăng theo i)
+    tails: List[int] = []      # j nhỏ nhất kết thúc dãy tăng độ dài k+1
+    tail_idx: List[int] = []   # index trong candidates tương ứng
+    prev: List[int] = [-1] * len(candidates)
+    for idx, (_, j) in enumerate(candidates):
+        k = bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[k] = j
+            tail_idx[k] = idx
+        prev[idx] = tail_idx[k - 1] if k > 0 else -1
+
+    anchors: List[Tuple[int, int]] = []
+    idx = tail_idx[-1]
+    while idx != -1:
+        anchors.append(candidates[idx])
+        idx = prev[idx]
+    anchors.reverse()
+    return anchors
+
+
+def _middle_snake(
+    a: Sequence[int], a0: int, n: int, b: Sequence[int], b0: int, m: int, max_cost: int
+):
+    """
+    Middle snake của Myers (tìm song song từ 2 đầu). Trả về (x, y, u, v, d) trong toạ độ
+    tương đối, hoặc None nếu số edit vượt quá max_cost.
+    """
+    delta = n - m
+    odd = delta & 1
+    limit = min((n + m + 1) // 2, max_cost)
+    offset = limit + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            reverse_k = delta - k
+            if odd and -(d - 1) <= reverse_k <= d - 1 and x + backward[offset + reverse_k] >= n:
+                return x_start, y_start, x, y, 2 * d - 1
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a0 + n - 1 - x] == b[b0 + m - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            forward_k = delta - k
+            if not odd and -d <= forward_k <= d and x + forward[offset + forward_k] >= n:
+                return n - x, m - y, n - x_start, m - y_start, 2 * d
+
+    return None
+
+
+def _trim(a: Sequence[int], a0: int, a1: int, b: Sequence[int], b0: int, b1: int, matches: List[Tuple[int, int]]):
+    """Bỏ prefix/suffix chung (ghi vào matches). Trả về khoảng còn lại."""
+    while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+        matches.append((a0, b0))
+        a0 += 1
+        b0 += 1
+    suffix = []
+    while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+        a1 -= 1
+        b1 -= 1
+        suffix.append((a1, b1))
+    return a0, a1, b0, b1, suffix
+
+
+def _difflib_matches(
+    a: Sequence[int], a0: int, a1: int, b: Sequence[int], b0: int, b1: int, matches: List[Tuple[int, int]]
+) -> None:
+    """Alignment best-effort của difflib cho 1 khoảng (không autojunk), ghi vào matches theo thứ tự."""
+    matcher = SequenceMatcher(None, a[a0:a1], b[b0:b1], autojunk=False)
+    for i, j, size in matcher.get_matching_blocks():
+        matches.extend((a0 + i + k, b0 + j + k) for k in range(size))
+
+
+def _myers(
+    a: Sequence[int], a0: int, a1: int, b: Sequence[int], b0: int, b1: int,
+    matches: List[Tuple[int, int]], max_cost: int,
+) -> None:
+    """Myers linear-space (đệ quy qua middle snake), ghi các cặp khớp vào matches theo thứ tự."""
+    a0, a1, b0, b1, suffix = _trim(a, a0, a1, b, b0, b1, matches)
+    n, m = a1 - a0, b1 - b0
+    if n > 0 and m > 0:
+        snake = _middle_snake(a, a0, n, b, b0, m, max_cost)
+        if snake is not None:
+            x, y, u, v, _ = snake
+            _myers(a, a0, a0 + x, b, b0, b0 + y, matches, max_cost)
+            matches.extend((a0 + x + k, b0 + y + k) for k in range(u - x))
+            _myers(a, a0 + u, a1, b, b0 + v, b1, matches, max_cost)
+        else:
+            _difflib_matches(a, a0, a1, b, b0, b1, matches)
+    matches.extend(reversed(suffix))
+
+
+def _patience(
+    a: Sequence[int], a0: int, a1: int, b: Sequence[int], b0: int, b1: int,
+    matches: List[Tuple[int, int]], max_cost: int, fallback=None,
+) -> None:
+    """
+    Chia theo anchor duy nhất, đệ quy trong từng khoảng; hết anchor → Myers
+    (hoặc fallback(a, a0, a1, b, b0, b1, matches, max_cost) nếu có).
+    """
+    a0, a1, b0, b1, suffix = _trim(a, a0, a1, b, b0, b1, matches)
+    if a0 < a1 and b0 < b1:
+        anchors = _unique_anchors(a, a0, a1, b, b0, b1)
+        if anchors:
+            i_prev, j_prev = a0, b0
+            for i, j in anchors:
+                _patience(a, i_prev, i, b, j_prev, j, matches, max_cost, fallback)
+                matches.append((i, j))
+                i_prev, j_prev = i + 1, j + 1
+            _patience(a, i_prev, a1, b, j_prev, b1, matches, max_cost, fallback)
+        else:
+            (fallback or _myers)(a, a0, a1, b, b0, b1, matches, max_cost)
+    matches.extend(reversed(suffix))
+
+
+def match_pairs(a: Sequence[int], b: Sequence[int], max_cost: int = MYERS_MAX_COST) -> List[Tuple[int, int]]:
+    """Các cặp (i, j) với a[i] == b[j] của alignment, tăng dần theo cả i và j."""
+    matches: List[Tuple[int, int]] = []
+    _patience(a, 0, len(a), b, 0, len(b), matches, max_cost)
+    return matches
+
+
+def _level_runs(path: Sequence[Tuple], levels: int) -> List[List[int]]:
+    """
+    runs[depth][i] = id của đoạn liên tiếp (cùng path[:depth + 1]) chứa token i.
+    Tính 1 lần để chia đoạn chỉ còn so sánh int.
+    """
+    runs: List[List[int]] = []
+    for depth in range(levels):
+        ids: List[int] = []
+        run_id = 0
+        prev = None
+        for key in path:
+            key = key[:depth + 1]
+            if key != prev:
+                run_id += 1
+                prev = key
+            ids.append(run_id)
+        runs.append(ids)
+    return runs
+
+
+def _segments(run_ids: Sequence[int], start: int, end: int) -> List[Tuple[int, int]]:
+    """Chia [start, end) thành các đoạn liên tiếp cùng run id (cùng block / cùng line)."""
+    segments: List[Tuple[int, int]] = []
+    seg_start = start
+    for idx in range(start + 1, end):
+        if run_ids[idx] != run_ids[seg_start]:
+            segments.append((seg_start, idx))
+            seg_start = idx
+    if start < end:
+        segments.append((seg_start, end))
+    return segments
+
+
+def _heaviest_unique_anchors(
+    a_keys: Sequence[int], b_keys: Sequence[int], weights: Sequence[int]
+) -> List[Tuple[int, int]]:
+    """
+    Các cặp (si, sj) của key duy nhất ở cả 2 dãy, dãy con tăng theo cả si và sj có tổng
+    weights[si] lớn nhất (Fenwick tree max theo sj, O(k log k)).
+    """
+    positions: Dict[int, List[int]] = {}
+    for i, key in enumerate(a_keys):
+        entry = positions.get(key)
+        if entry is None:
+            positions[key] = [i, -1, 1]
+        else:
+            entry[2] += 1
+    for j, key in enumerate(b_keys):
+        entry = positions.get(key)
+        if entry is None or entry[2] != 1:
+            continue
+        if entry[1] == -1:
+            entry[1] = j
+        else:
+            entry[2] = 2
+    candidates = sorted(
+        (entry[0], entry[1]) for entry in positions.values() if entry[2] == 1 and entry[1] != -1
+    )
+    if not candidates:
+        return []
+
+    size = len(b_keys)
+    tree_weight = [0] * (size + 1)
+    tree_idx = [-1] * (size + 1)
+    best_weight = [0] * len(candidates)
+    prev = [-1] * len(candidates)
+    for idx, (i, j) in enumerate(candidates):
+        # Chuỗi tốt nhất kết thúc ở sj < j
+        weight, before = 0, -1
+        pos = j
+        while pos > 0:
+            if tree_weight[pos] > weight:
+                weight, before = tree_weight[pos], tree_idx[pos]
+            pos -= pos & -pos
+        best_weight[idx] = weight + weights[i]
+        prev[idx] = before
+        pos = j + 1
+        while pos <= size:
+            if best_weight[idx] > tree_weight[pos]:
+                tree_weight[pos], tree_idx[pos] = best_weight[idx], idx
+            pos += pos & -pos
+
+    idx = max(range(len(candidates)), key=best_weight.__getitem__)
+    anchors: List[Tuple[int, int]] = []
+    while idx != -1:
+        anchors.append(candidates[idx])
+        idx = prev[idx]
+    anchors.reverse()
+    return anchors
+
+
+def _hierarchical(
+    a: Sequence[int], a_runs: List[List[int]], a0: int, a1: int,
+    b: Sequence[int], b_runs: List[List[int]], b0: int, b1: int,
+    depth: int, matches: List[Tuple[int, int]], max_cost: int,
+) -> None:
+    if a0 >= a1 or b0 >= b1:
+        return
+    if depth >= len(a_runs):
+        _patience(a, a0, a1, b, b0, b1, matches, max_cost)
+        return
+
+    # Mỗi đoạn (block / line) → id theo hash của dãy token
+    a_segments = _segments(a_runs[depth], a0, a1)
+    b_segments = _segments(b_runs[depth], b0, b1)
+    keys: Dict[Tuple[int, ...], int] = {}
+    a_keys = [keys.setdefault(tuple(a[s:e]), len(keys)) for s, e in a_segments]
+    b_keys = [keys.setdefault(tuple(b[s:e]), len(keys)) for s, e in b_segments]
+    anchors = _heaviest_unique_anchors(a_keys, b_keys, [e - s for s, e in a_segments])
+    if not anchors:
+        # Không còn đoạn duy nhất khớp nguyên vẹn → xuống cấp chi tiết hơn
+        _hierarchical(a, a_runs, a0, a1, b, b_runs, b0, b1, depth + 1, matches, max_cost)
+        return
+
+    i_prev, j_prev = a0, b0
+    for si, sj in anchors:
+        (sa, ea), (sb, eb) = a_segments[si], b_segments[sj]
+        # Vùng giữa 2 anchor: có thể có đoạn duy nhất mới ở cùng cấp
+        _hierarchical(a, a_runs, i_prev, sa, b, b_runs, j_prev, sb, depth, matches, max_cost)
+        matches.extend(zip(range(sa, ea), range(sb, eb)))
+        i_prev, j_prev = ea, eb
+    _hierarchical(a, a_runs, i_prev, a1, b, b_runs, j_prev, b1, depth, matches, max_cost)
+
+
+def hierarchical_match_pairs(
+    a: Sequence[int],
+    a_path: Sequence[Tuple],
+    b: Sequence[int],
+    b_path: Sequence[Tuple],
+    max_cost: int = MYERS_MAX_COST,
+) -> List[Tuple[int, int]]:
+    """
+    Như match_pairs nhưng theo cấp: path[i] = (block, line) của token i (tokens liên tiếp
+    cùng block/line). Trong các vùng patience không còn anchor: block duy nhất khớp nguyên
+    vẹn → khớp luôn, không diff bên trong; vùng còn lại xuống cấp line, rồi word (Myers).
+    """
+    levels = min(len(a_path[0]) if a_path else 0, len(b_path[0]) if b_path else 0)
+    a_runs = _level_runs(a_path, levels)
+    b_runs = _level_runs(b_path, levels)
+
+    def _segment_fallback(a, a0, a1, b, b0, b1, matches, max_cost):
+        _hierarchical(a, a_runs, a0, a1, b, b_runs, b0, b1, 0, matches, max_cost)
+
+    matches: List[Tuple[int, int]] = []
+    _patience(a, 0, len(a), b, 0, len(b), matches, max_cost, _segment_fallback)
+    return matches
+
+
+def opcodes_from_matches(matches: Sequence[Tuple[int, int]], len_a: int, len_b: int) -> List[Opcode]:
+    """Opcodes (equal/replace/delete/insert) giống format SequenceMatcher.get_opcodes()."""
+    # Gộp các cặp liên tiếp thành block (i, j, size), thêm block sentinel ở cuối
+    blocks: List[Tuple[int, int, int]] = []
+    for i, j in matches:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + 1)
+        else:
+            blocks.append((i, j, 1))
+    blocks.append((len_a, len_b, 0))
+
+    opcodes: List[Opcode] = []
+    i = j = 0
+    for ai, bj, size in blocks:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(("equal", ai, i, bj, j))
+    return opcodes
+
+
+def diff_opcodes(a: Sequence[int], b: Sequence[int], max_cost: int = MYERS_MAX_COST) -> List[Opcode]:
+    """Opcodes của alignment patience + Myers."""
+    return opcodes_from_matches(match_pairs(a, b, max_cost), len(a), len(b))
+
+
+def hierarchical_opcodes(
+    a: Sequence[int],
+    a_path: Sequence[Tuple],
+    b: Sequence[int],
+    b_path: Sequence[Tuple],
+    max_cost: int = MYERS_MAX_COST,
+) -> List[Opcode]:
+    """Opcodes của alignment block → line → word (xem hierarchical_match_pairs)."""
+    return opcodes_from_matches(hierarchical_match_pairs(a, a_path, b, b_path, max_cost), len(a), len(b))
+
+
+__all__ = [
+    "diff_opcodes",
+    "hierarchical_opcodes",
+    "hierarchical_match_pairs",
+    "match_pairs",
+    "opcodes_from_matches",
+    "MYERS_MAX_COST",
+]